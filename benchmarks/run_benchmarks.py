@@ -0,0 +1,313 @@
+"""
+A module that times the service's hot paths against generated data at
+several scales of site: parsing the data file, loading it as the service
+does with an empty dataset cache and again from the cache, interpolating
+it onto the grid, point queries, the site list, a live simulation tick, and pushing a
+tick to subscribers through a stub webhook server on localhost. Results are
+the best and median seconds per call over a number of repeats. They can be
+saved as a baseline, and later runs are compared with it, failing when any
+benchmark is slower than its baseline by more than the threshold.
+Baselines only compare fairly on the machine they were recorded on.
+
+Usage: python -m benchmarks.run_benchmarks --scales 130,1000,10000
+       python -m benchmarks.run_benchmarks --save
+Author: Ross Cochrane
+"""
+
+import argparse
+import contextlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import timeit
+import numpy
+from src import air_data_generation, pollution_loader
+from src import pseudo_air_pollution_data as live
+from src import subscriptions_utils
+from src.live_clock import SimulationClock
+from src.pollution_store import epoch_to_datetime, to_python_floats
+from src.subscription_registry import SubscriptionRegistry
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+DEFAULT_SCALES = (130, 1000, 10000)
+
+# Hours of readings generated for each scale, keeping the 10 second grid
+# of the largest scale within a few hundred megabytes
+DEFAULT_HOURS = 3
+DEFAULT_REPEAT = 5
+
+# Fraction by which a benchmark may exceed its baseline before it is a regression
+DEFAULT_THRESHOLD = 0.25
+
+START = datetime(2025, 5, 19, tzinfo=timezone.utc)
+SEED = 42
+SUBSCRIBERS = 10
+DATASET = "AIR QUALITY DYNAMIC"
+
+# Calls per repeat of each benchmark
+NUMBERS = {
+    "load_store": 1,
+    "load_cold": 1,
+    "load_cached": 1,
+    "interpolate_data": 1,
+    "get_pollution_data": 1000,
+    "get_all_sites_coordinates": 20,
+    "simulate_live_data": 10,
+    "notify_subscribers": 5
+}
+
+
+class StubWebhook(BaseHTTPRequestHandler):
+    """
+    Accepts every POST with an empty 204, keeping connections alive.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def stub_webhook_server():
+    """
+    A function to serve StubWebhook on a free localhost port for the
+    duration of the context, yielding its base URL.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubWebhook)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def write_metadata(site_codes: list, file_name: str, seed: int = SEED) -> None:
+    """
+    A function to write site metadata for the given codes, with points
+    scattered around Newcastle.
+    """
+    rng = numpy.random.default_rng(seed)
+    latitudes = rng.uniform(54.85, 55.05, len(site_codes)).round(6).tolist()
+    longitudes = rng.uniform(-1.75, -1.45, len(site_codes)).round(6).tolist()
+    sites = [
+        {"systemCodeNumber": code,
+         "definitions": [{"point": {"latitude": lat, "longitude": lon}}]}
+        for code, lat, lon in zip(site_codes, latitudes, longitudes)
+    ]
+    with open(file_name, "w") as file:
+        json.dump(sites, file)
+
+
+def time_call(function, number: int, repeat: int, setup=None) -> dict:
+    """
+    A function to return the best and median seconds per call of function
+    over repeat runs of number calls, with setup run before each run.
+    """
+    timer = timeit.Timer(function, setup=setup or (lambda: None))
+    per_call = [total / number for total in timer.repeat(repeat, number)]
+    return {"best": min(per_call), "median": statistics.median(per_call), "number": number}
+
+
+def live_records(data, timestamp: datetime) -> list:
+    """
+    A function to return the records simulate_live_data pushes at a time.
+    """
+    snapshot = data.get_live_snapshot(timestamp)
+    return [
+        {"systemCodeNumber": code,
+         **{k: v for k, v in zip(snapshot["measurements"], values) if not numpy.isnan(v)},
+         "lastUpdated": epoch_to_datetime(epoch).isoformat()}
+        for code, epoch, values in zip(snapshot["site_codes"], snapshot["timestamps"],
+                                       to_python_floats(snapshot["values"]))
+    ]
+
+
+@contextlib.contextmanager
+def live_simulation(data, state_dir: str, registry: SubscriptionRegistry):
+    """
+    A function to point the live simulation at data, a clock in state_dir
+    and a subscription registry for the duration of the context.
+    """
+    saved = (live.pollution_data, live.simulation_clock, subscriptions_utils.subscriptions)
+    live.pollution_data = data
+    live.simulation_clock = SimulationClock(os.path.join(state_dir, "simulation_clock.json"), START)
+    subscriptions_utils.subscriptions = registry
+    try:
+        yield live.simulation_clock
+    finally:
+        live.pollution_data, live.simulation_clock, subscriptions_utils.subscriptions = saved
+
+
+def run_scale(num_sites: int, hours: float = DEFAULT_HOURS, repeat: int = DEFAULT_REPEAT,
+              numbers: dict = NUMBERS) -> dict:
+    """
+    A function to generate data for num_sites sites and time every
+    benchmark against it, returning the timings by benchmark name.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="airdata-benchmark-") as directory, \
+            contextlib.redirect_stdout(io.StringIO()):
+        data_file = os.path.join(directory, "pollution_data.json")
+        metadata_file = os.path.join(directory, "metadata.json")
+        air_data_generation.generate(num_sites, hours / 24, start=START.replace(tzinfo=None), seed=SEED,
+                                     output=data_file, workers=1)
+
+        results["load_store"] = time_call(lambda: pollution_loader.load_store(data_file),
+                                          numbers["load_store"], repeat)
+
+        # A cold load parses, interpolates and publishes the dataset cache
+        # entry; a cached load maps the entry it published
+        cache_dir = os.path.join(directory, "cache")
+        data = live.PollutionData(cache_dir=cache_dir, data_file=data_file)
+        results["load_cold"] = time_call(data.load, numbers["load_cold"], repeat,
+                                         lambda: shutil.rmtree(cache_dir, ignore_errors=True))
+        results["load_cached"] = time_call(data.load, numbers["load_cached"], repeat)
+
+        raw, _ = pollution_loader.load_store(data_file)
+        results["interpolate_data"] = time_call(lambda: data.__interpolate_data__(raw),
+                                                numbers["interpolate_data"], repeat)
+        write_metadata(list(data.data.site_codes), metadata_file)
+        data.site_metadata_cache.clear()
+        data.load_site_metadata(metadata_file)
+
+        rng = numpy.random.default_rng(SEED)
+        site_codes = list(data.data.site_codes)
+        queries = [
+            (START + timedelta(seconds=float(offset)), site_codes[site])
+            for offset, site in zip(rng.uniform(0, hours * 3600, numbers["get_pollution_data"]),
+                                    rng.integers(len(site_codes), size=numbers["get_pollution_data"]))
+        ]
+        cursor = iter(())
+
+        def query():
+            data.get_pollution_data(*next(cursor))
+
+        def reset_queries():
+            nonlocal cursor
+            cursor = iter(queries)
+
+        results["get_pollution_data"] = time_call(query, numbers["get_pollution_data"], repeat, reset_queries)
+        results["get_all_sites_coordinates"] = time_call(data.get_all_sites_coordinates,
+                                                         numbers["get_all_sites_coordinates"], repeat)
+
+        # A tick with no subscribers times the snapshot and records alone
+        with live_simulation(data, directory, SubscriptionRegistry()) as clock:
+            results["simulate_live_data"] = time_call(live.simulate_live_data, numbers["simulate_live_data"],
+                                                      repeat, lambda: clock.set(START))
+
+        registry = SubscriptionRegistry()
+        records = live_records(data, START + timedelta(minutes=1))
+        with stub_webhook_server() as url, live_simulation(data, directory, registry):
+            for subscriber in range(SUBSCRIBERS):
+                registry.add(f"{url}/webhook/{subscriber}", [DATASET])
+
+            def notify():
+                subscriptions_utils.notify_subscribers(DATASET, records)
+                subscriptions_utils.delivery_queue.flush(timeout=60)
+
+            results["notify_subscribers"] = time_call(notify, numbers["notify_subscribers"], repeat)
+            for subscription_id in list(registry.subscriptions):
+                subscriptions_utils.forget_subscriber(subscription_id)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list:
+    """
+    A function to return the benchmarks whose best time exceeds the
+    baseline's by more than threshold, as (scale, name, baseline, current)
+    tuples. Benchmarks missing from the baseline are skipped.
+    """
+    regressions = []
+    for scale, timings in results.items():
+        for name, timing in timings.items():
+            previous = baseline.get("results", {}).get(scale, {}).get(name)
+            if previous and timing["best"] > previous["best"] * (1 + threshold):
+                regressions.append((scale, name, previous["best"], timing["best"]))
+    return regressions
+
+
+def format_seconds(seconds: float) -> str:
+    """
+    A function to format a duration with a readable unit.
+    """
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds * 1e9:.3g} ns"
+
+
+def main(argv: list = None) -> int:
+    """
+    Command line entry point for the benchmarks. Returns 1 if any
+    benchmark regressed against the baseline.
+    """
+    parser = argparse.ArgumentParser(description="Time the pollution data hot paths.")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)),
+                        help="comma separated numbers of sites")
+    parser.add_argument("--hours", type=float, default=DEFAULT_HOURS, help="hours of readings per site")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs of each benchmark")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline results file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown beyond which a benchmark is a regression, e.g. 0.25 for 25%%")
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline")
+    args = parser.parse_args(argv)
+
+    # The module's own scheduler would tick the live simulation mid-benchmark
+    live.scheduler.shutdown(wait=False)
+
+    results = {}
+    for num_sites in (int(scale) for scale in args.scales.split(",")):
+        results[str(num_sites)] = run_scale(num_sites, args.hours, args.repeat)
+        for name, timing in results[str(num_sites)].items():
+            print(f"{num_sites:>6} sites  {name:<28}{format_seconds(timing['best']):>12} best"
+                  f"{format_seconds(timing['median']):>12} median")
+
+    if args.save:
+        with open(args.baseline, "w") as file:
+            json.dump({
+                "recorded": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "machine": {"platform": platform.platform(), "processor": platform.machine(),
+                            "python": platform.python_version(), "cpus": os.cpu_count()},
+                "settings": {"hours": args.hours, "repeat": args.repeat},
+                "results": results
+            }, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; record one with --save")
+        return 0
+    with open(args.baseline, "r") as file:
+        baseline = json.load(file)
+    if baseline.get("settings", {}).get("hours") != args.hours:
+        print(f"Warning: the baseline was recorded with --hours {baseline.get('settings', {}).get('hours')}")
+    regressions = compare(results, baseline, args.threshold)
+    for scale, name, previous, current in regressions:
+        print(f"REGRESSION {name} at {scale} sites: {format_seconds(previous)} -> {format_seconds(current)} "
+              f"({current / previous - 1:+.0%})")
+    if not regressions:
+        print(f"No regressions beyond {args.threshold:.0%} of {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
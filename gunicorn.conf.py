@@ -0,0 +1,17 @@
+"""
+Gunicorn settings. The master creates one state directory for the
+simulation clock, leader lock and subscriptions, which its workers inherit
+through SIMULATION_STATE_DIR so they share one live simulation.
+Author: Ross Cochrane
+"""
+
+
+import os
+import tempfile
+
+
+def on_starting(server):
+    """
+    Runs in the master before any worker is forked.
+    """
+    os.environ.setdefault("SIMULATION_STATE_DIR", tempfile.mkdtemp(prefix="airdatageneration-"))
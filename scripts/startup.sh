@@ -1 +1 @@
-gunicorn --bind=0.0.0.0:80 src.app:app
+gunicorn --config=gunicorn.conf.py --bind=0.0.0.0:80 src.app:app
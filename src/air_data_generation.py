@@ -1,90 +1,252 @@
 """
-This file generates simulated pollution data over a 24 hour period.
+This file generates simulated pollution data over a number of days.
 Output saved as a JSON file, structured to mimic the UTMC Open Data Service
-and to be consumed by PANT Spring API
+and to be consumed by PANT Spring API, or as a columnar .npz or .parquet
+file that loads far faster and is an order of magnitude smaller.
+Values are drawn a whole array at a time with NumPy, sites are generated in
+fixed-size chunks across a process pool, and the output is streamed to disk
+one chunk at a time in site order.
+
+Usage: python -m src.air_data_generation --sites 130 --days 1 --interval 10 --seed 42
+       python -m src.air_data_generation --output data/pollution_data.npz
 Author: Ross Cochrane
 """
 
-import random
-import json
-from datetime import datetime, timedelta
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
 import os
+import numpy
+from src import columnar_format
+from src.pollution_store import MEASUREMENTS
 
 
+# Default settings for the simulation:
+DEFAULT_SITES = 130
+DEFAULT_START = datetime(2025, 5, 19, 0, 0, 0)
+DEFAULT_DAYS = 1
+DEFAULT_INTERVAL_MINUTES = 10
+DEFAULT_OUTPUT = os.path.join("data", "pollution_data.json")
 
-# Settings for the simulation:
-num_sites = 130
-start_time = datetime(2025, 5, 19, 0, 0, 0)
-interval_minutes = 10
-num_points = (24 * 60) // interval_minutes  # 144 points for 24 hours
+# Sites per chunk. Each chunk has its own random stream derived from the
+# seed, so the output for a seed does not depend on the number of workers.
+SITES_PER_CHUNK = 250
+
+# Ranges drawn from in (quiet, busy) periods.
+# Data points taken from: no and no2: Sunderland Wessington Way. co: Newcastle
+# centre historic (2012) monitoring sites
+# Noise: www.extrium.co.uk/noiseviewer.html
+RANGES = {
+    "co": ((0.1, 0.17), (0.5, 5.0)),
+    "no": ((1, 10), (20, 150)),
+    "no2": ((5, 30), (40, 300)),
+    "noise": ((30, 60), (70, 100)),
+    "rh": ((55, 59.9), (70, 85))
+}
+
+BATTERY_RANGE = (3.5, 4.2)
+
+# Decimal places each measurement is rounded to
+DECIMALS = {"co": 2, "no": 2, "no2": 2, "noise": 2, "rh": 0, "temperature": 1, "battery": 1}
+
+READING_TEMPLATE = ('{"co":%r,"no":%r,"no2":%r,"rh":%d,"temperature":%r,'
+                    '"noise":%r,"battery":%r,"lastUpdated":"%s"}')
 
 
 def is_busy_period(ts):
     """
-    A function to determine if the timestamp is during a busy period 
+    A function to determine if the timestamp is during a busy period
     ie 8:00-9:00 or 16:00-19:00.
     """
     hour = ts.hour
     return (8 <= hour < 9) or (16 <= hour < 19)
 
 
+def busy_hours(hours):
+    """
+    A function to return a mask of the hours in a busy period, the
+    vectorized form of is_busy_period.
+    """
+    return ((8 <= hours) & (hours < 9)) | ((16 <= hours) & (hours < 19))
+
+
+def temperature_ranges(hours):
+    """
+    A function to return the low and high temperature for each hour of the day.
+    TO DO: Change this to follow a day pattern
+    """
+    day = (10 <= hours) & (hours < 18)
+    night = (22 <= hours) | (hours < 6)
+    low = numpy.select([day, night], [18.0, 5.0], 7.0)
+    high = numpy.select([day, night], [24.0, 10.0], 17.0)
+    return low, high
+
+
+def measurement_ranges(hours) -> dict:
+    """
+    A function to return the low and high value of every measurement for
+    each hour of the day, following the busy period and temperature rules.
+    """
+    busy = busy_hours(hours)
+    ranges = {}
+    for measurement, ((quiet_low, quiet_high), (busy_low, busy_high)) in RANGES.items():
+        ranges[measurement] = (numpy.where(busy, busy_low, quiet_low), numpy.where(busy, busy_high, quiet_high))
+    ranges["temperature"] = temperature_ranges(hours)
+    ranges["battery"] = BATTERY_RANGE
+    return ranges
+
+
+def draw_chunk(chunk: int, num_sites: int, start: datetime, num_points: int,
+               interval_minutes: int, seed: int) -> tuple:
+    """
+    A function to draw the readings for one chunk of sites. Every pollutant
+    is drawn for the whole chunk in a single call, following the busy period
+    and temperature rules. Returns the site codes, reading times and a
+    (sites, points) array per measurement, rounded as they are written.
+    """
+    rng = numpy.random.default_rng([seed, chunk])
+    first_site = chunk * SITES_PER_CHUNK
+    count = min(SITES_PER_CHUNK, num_sites - first_site)
+    shape = (count, num_points)
+
+    times = [start + timedelta(minutes=i * interval_minutes) for i in range(num_points)]
+    hours = numpy.array([time.hour for time in times])
+
+    columns = {}
+    for measurement, (low, high) in measurement_ranges(hours).items():
+        columns[measurement] = numpy.round(rng.uniform(low, high, shape), DECIMALS[measurement])
+    columns["rh"] = columns["rh"].astype(numpy.int64)
+
+    site_codes = [f"SITE{first_site + site + 1:03d}" for site in range(count)]
+    return site_codes, times, columns
+
+
+def generate_chunk(chunk: int, num_sites: int, start: datetime, num_points: int,
+                   interval_minutes: int, seed: int) -> bytes:
+    """
+    A function to generate the JSON text for one chunk of sites.
+    """
+    site_codes, times, columns = draw_chunk(chunk, num_sites, start, num_points, interval_minutes, seed)
+    stamps = [time.strftime("%Y-%m-%dT%H:%M:%S.000+0000") for time in times]
+    co, no, no2, rh, temperature, noise, battery = (
+        columns[measurement].tolist() for measurement in ("co", "no", "no2", "rh", "temperature", "noise", "battery")
+    )
+
+    sites = []
+    for site, site_code in enumerate(site_codes):
+        readings = ",".join(
+            READING_TEMPLATE % reading
+            for reading in zip(co[site], no[site], no2[site], rh[site], temperature[site],
+                               noise[site], battery[site], stamps)
+        )
+        sites.append(f'{{"systemCodeNumber":"{site_code}","dynamics":[{readings}]}}')
+    return ",\n".join(sites).encode("utf-8")
+
+
+def generate_columns(chunk: int, num_sites: int, start: datetime, num_points: int,
+                     interval_minutes: int, seed: int) -> tuple:
+    """
+    A function to generate one chunk of sites as columns for a columnar
+    writer: the site codes, readings per site, epoch timestamps and a
+    (readings, measurements) values matrix. The values match the JSON output
+    for the same seed.
+    """
+    site_codes, times, columns = draw_chunk(chunk, num_sites, start, num_points, interval_minutes, seed)
+    epochs = numpy.array([int(time.replace(tzinfo=timezone.utc).timestamp()) for time in times], dtype=numpy.int64)
+    values = numpy.stack([columns[measurement].ravel() for measurement in MEASUREMENTS], axis=1)
+    return site_codes, [num_points] * len(site_codes), numpy.tile(epochs, len(site_codes)), values
+
 
-# A program to generate the dataset.
-sites = []
-for site_num in range(1, num_sites + 1):
-    system_code = f"SITE{site_num:03d}"
-    dynamics = []
-
-    for i in range(num_points):
-        current_time = start_time + timedelta(minutes=i * interval_minutes)
-        busy = is_busy_period(current_time)
-
-        
-        # Simulate pollutant and noise values based on busy or quiet period.
-        # Data points taken from: no and no2: Sunderland Wessington Way. co: Newcastle 
-        # centre historic (2012) monitoring sites
-        # Noise: www.extrium.co.uk/noiseviewer.html
-        
-        co = round(random.uniform(0.5, 5.0) if busy else random.uniform(0.1, 0.17), 2)
-        no = round(random.uniform(20, 150) if busy else random.uniform(1, 10), 2)
-        no2 = round(random.uniform(40, 300) if busy else random.uniform(5, 30), 2)
-        noise = round(random.uniform(70, 100) if busy else random.uniform(30, 60), 2)
-        rh = round(random.uniform(70, 85) if busy else random.uniform(55, 59.9))
-        
-        # Set the temperature according to the time of day
-        # TO DO: Change this to follow a day pattern
-        if 10 <= current_time.hour < 18:
-            temperature = round(random.uniform(18, 24), 1)
-        elif 22 <= current_time.hour or current_time.hour < 6:
-            temperature = round(random.uniform(5, 10), 1)
-        else:
-            temperature = round(random.uniform(7, 17), 1)
-
-        battery = round(random.uniform(3.5, 4.2), 1)
-
-        dynamics.append({
-            "co": co,
-            "no": no,
-            "no2": no2,
-            "rh": rh,
-            "temperature": temperature,
-            "noise": noise,
-            "battery": battery,
-            "lastUpdated": current_time.strftime("%Y-%m-%dT%H:%M:%S.000+0000")
-        })
-
-    sites.append({
-        "systemCodeNumber": system_code,
-        "dynamics": dynamics
-    })
-
-
-# Save JSON to data folder
-
-os.makedirs("data", exist_ok=True)
-
-file_path = os.path.join("data", "pollution_data.json")
-with open(file_path, "w") as json_file:
-    json.dump(sites, json_file, indent=4)
-
-print(f"JSON data successfully saved to {file_path}")
+def generate(num_sites: int = DEFAULT_SITES, days: float = DEFAULT_DAYS,
+             interval_minutes: int = DEFAULT_INTERVAL_MINUTES, start: datetime = DEFAULT_START,
+             seed: int = None, output: str = DEFAULT_OUTPUT, workers: int = None,
+             file_format: str = None, compress: bool = True) -> int:
+    """
+    A function to generate the dataset and stream it to output, returning
+    the seed used. Chunks are generated on up to workers processes, with a
+    bounded number in flight so memory stays flat however large the output.
+    The format is json, npz or parquet, taken from output's extension when
+    not given; turning off compress stores an .npz uncompressed, several
+    times larger but quicker to write.
+    """
+    if num_sites < 1 or days <= 0 or interval_minutes < 1:
+        raise ValueError("Sites, days and interval must be positive.")
+    file_format = file_format or columnar_format.format_for(output)
+    if file_format not in columnar_format.FORMATS:
+        raise ValueError(f"Unknown format {file_format}.")
+    if start.tzinfo is not None:
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    if seed is None:
+        seed = int(numpy.random.SeedSequence().entropy % 2 ** 63)
+    num_points = int(days * 24 * 60) // interval_minutes
+    chunks = -(-num_sites // SITES_PER_CHUNK)
+    workers = min(workers or os.cpu_count() or 1, chunks)
+    arguments = (num_sites, start, num_points, interval_minutes, seed)
+
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if file_format == "json":
+        temp_name = f"{output}.tmp"
+        json_file = open(temp_name, "wb")
+        json_file.write(b"[\n")
+        make_chunk = generate_chunk
+
+        def write(chunk, result):
+            json_file.write(b",\n" if chunk else b"")
+            json_file.write(result)
+    else:
+        writer = columnar_format.open_writer(output, MEASUREMENTS, file_format, compress)
+        make_chunk = generate_columns
+
+        def write(chunk, result):
+            writer.write_sites(*result)
+
+    if workers <= 1:
+        for chunk in range(chunks):
+            write(chunk, make_chunk(chunk, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            for chunk in range(chunks):
+                pending[chunk] = executor.submit(make_chunk, chunk, *arguments)
+                # Write the oldest chunk once enough are queued behind it
+                while len(pending) > 2 * workers or (chunk == chunks - 1 and pending):
+                    oldest = min(pending)
+                    write(oldest, pending.pop(oldest).result())
+
+    if file_format == "json":
+        json_file.write(b"\n]\n")
+        json_file.close()
+        os.replace(temp_name, output)
+    else:
+        writer.close()
+    return seed
+
+
+def main(argv: list = None) -> None:
+    """
+    Command line entry point for the generator.
+    """
+    parser = argparse.ArgumentParser(description="Generate simulated pollution data.")
+    parser.add_argument("--sites", type=int, default=DEFAULT_SITES, help="number of sites")
+    parser.add_argument("--days", type=float, default=DEFAULT_DAYS, help="number of days of readings")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL_MINUTES, help="minutes between readings")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=DEFAULT_START,
+                        help="first reading time in UTC, e.g. 2025-05-19T00:00:00")
+    parser.add_argument("--seed", type=int, default=None, help="seed for a reproducible dataset")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="output file")
+    parser.add_argument("--format", choices=columnar_format.FORMATS, default=None,
+                        help="output format, taken from the output extension by default")
+    parser.add_argument("--no-compress", dest="compress", action="store_false",
+                        help="store an .npz output uncompressed, larger but quicker to write")
+    args = parser.parse_args(argv)
+
+    seed = generate(args.sites, args.days, args.interval, args.start, args.seed, args.output, args.workers,
+                    args.format, args.compress)
+    print(f"Data successfully saved to {args.output} (seed {seed})")
+
+
+if __name__ == "__main__":
+    main()
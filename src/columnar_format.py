@@ -0,0 +1,250 @@
+"""
+A module that reads and writes pollution readings in columnar files, as a
+compact and fast alternative to pollution_data.json. NPZ is always
+available; Parquet is used when pyarrow is installed. Both keep one column
+per measurement, so a reader can load only the pollutants it needs.
+Files are written a chunk of sites at a time and renamed into place.
+Author: Ross Cochrane
+"""
+
+
+import os
+import shutil
+import tempfile
+import zipfile
+import numpy
+from src.pollution_store import PollutionStore
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:     # Parquet support is optional
+    pyarrow = None
+
+
+FORMATS = ("json", "npz", "parquet")
+
+EXTENSIONS = {".json": "json", ".npz": "npz", ".parquet": "parquet", ".pq": "parquet"}
+
+# Deflate level for .npz members; compresses the readings nearly as well as
+# the default level 6 in well under half the time
+COMPRESS_LEVEL = 3
+
+
+def detect_format(file_name: str) -> str:
+    """
+    A function to work out a data file's format from its first bytes,
+    falling back to its extension for files that do not exist yet.
+    """
+    try:
+        with open(file_name, "rb") as file:
+            magic = file.read(4)
+    except FileNotFoundError:
+        return format_for(file_name)
+    if magic.startswith(b"PK"):
+        return "npz"
+    if magic == b"PAR1":
+        return "parquet"
+    return "json"
+
+
+def format_for(file_name: str) -> str:
+    """
+    A function to return the format implied by a file name's extension.
+    """
+    return EXTENSIONS.get(os.path.splitext(file_name)[1].lower(), "json")
+
+
+def project(available: tuple, measurements) -> tuple:
+    """
+    A function to check the requested measurements against those in a file.
+    Returns every available measurement when none are requested.
+    """
+    if measurements is None:
+        return tuple(available)
+    unknown = [measurement for measurement in measurements if measurement not in available]
+    if unknown:
+        raise ValueError(f"Measurements not in the data file: {', '.join(unknown)}.")
+    return tuple(measurements)
+
+
+class NpzWriter:
+    """
+    Streams sites into an .npz archive holding site_codes, offsets,
+    timestamps and a values_<measurement> column per measurement. Columns
+    are appended to raw files as chunks arrive and copied into the archive
+    with their .npy headers on close. Members are deflated at
+    COMPRESS_LEVEL, or stored when compress is False.
+    """
+
+    def __init__(self, file_name: str, measurements: tuple, compress: bool = True) -> None:
+        self.file_name = file_name
+        self.measurements = tuple(measurements)
+        self.compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self.site_codes = []
+        self.counts = []
+        self.rows = 0
+        directory = os.path.dirname(os.path.abspath(file_name))
+        os.makedirs(directory, exist_ok=True)
+        self.temp_dir = tempfile.mkdtemp(prefix=".columns-", dir=directory)
+        self.columns = {
+            name: open(os.path.join(self.temp_dir, name), "wb")
+            for name in ("timestamps", *(f"values_{measurement}" for measurement in self.measurements))
+        }
+
+
+    def write_sites(self, site_codes: list, counts, timestamps, values) -> None:
+        """
+        A method to append sites given their codes, reading counts, epoch
+        timestamps and a (rows, measurements) values matrix.
+        """
+        self.site_codes.extend(site_codes)
+        self.counts.extend(int(count) for count in counts)
+        self.rows += len(timestamps)
+        self.columns["timestamps"].write(numpy.ascontiguousarray(timestamps, dtype=numpy.int64).tobytes())
+        values = numpy.asarray(values, dtype=numpy.float32)
+        for column, measurement in enumerate(self.measurements):
+            self.columns[f"values_{measurement}"].write(numpy.ascontiguousarray(values[:, column]).tobytes())
+
+
+    def close(self) -> None:
+        """
+        A method to assemble the archive and move it into place.
+        """
+        for file in self.columns.values():
+            file.close()
+        temp_name = f"{self.file_name}.tmp"
+        try:
+            with zipfile.ZipFile(temp_name, "w", self.compression, allowZip64=True,
+                                 compresslevel=COMPRESS_LEVEL) as archive:
+                small = {
+                    "site_codes": numpy.array(self.site_codes, dtype=str),
+                    "measurements": numpy.array(self.measurements, dtype=str),
+                    "offsets": numpy.concatenate(([0], numpy.cumsum(self.counts, dtype=numpy.int64)))
+                }
+                for name, array in small.items():
+                    with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+                        numpy.lib.format.write_array(member, array)
+                for name in self.columns:
+                    dtype = numpy.dtype(numpy.int64 if name == "timestamps" else numpy.float32)
+                    with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+                        numpy.lib.format.write_array_header_1_0(member, {
+                            "descr": numpy.lib.format.dtype_to_descr(dtype),
+                            "fortran_order": False,
+                            "shape": (self.rows,)
+                        })
+                        with open(os.path.join(self.temp_dir, name), "rb") as raw:
+                            shutil.copyfileobj(raw, member, 1 << 20)
+            os.replace(temp_name, self.file_name)
+        finally:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+class ParquetWriter:
+    """
+    Streams sites into a Parquet file with one row per reading: the site
+    code, a UTC timestamp and a float32 column per measurement.
+    """
+
+    def __init__(self, file_name: str, measurements: tuple) -> None:
+        if pyarrow is None:
+            raise ValueError("Writing Parquet needs the pyarrow package.")
+        self.file_name = file_name
+        self.measurements = tuple(measurements)
+        self.schema = pyarrow.schema(
+            [("systemCodeNumber", pyarrow.string()), ("timestamp", pyarrow.timestamp("s", tz="UTC"))]
+            + [(measurement, pyarrow.float32()) for measurement in self.measurements]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(f"{file_name}.tmp", self.schema, compression="zstd")
+
+
+    def write_sites(self, site_codes: list, counts, timestamps, values) -> None:
+        """
+        A method to append sites given their codes, reading counts, epoch
+        timestamps and a (rows, measurements) values matrix.
+        """
+        values = numpy.asarray(values, dtype=numpy.float32)
+        columns = [
+            pyarrow.array(numpy.repeat(numpy.array(site_codes, dtype=str), counts)),
+            pyarrow.array(numpy.asarray(timestamps, dtype="datetime64[s]"), type=pyarrow.timestamp("s", tz="UTC"))
+        ] + [pyarrow.array(values[:, column]) for column in range(len(self.measurements))]
+        self.writer.write_table(pyarrow.Table.from_arrays(columns, schema=self.schema))
+
+
+    def close(self) -> None:
+        """
+        A method to finish the file and move it into place.
+        """
+        self.writer.close()
+        os.replace(f"{self.file_name}.tmp", self.file_name)
+
+
+def open_writer(file_name: str, measurements: tuple, file_format: str = None, compress: bool = True):
+    """
+    A function to open a columnar writer for the file's format. Turning off
+    compress stores .npz members as they are; Parquet is always compressed
+    with zstd.
+    """
+    file_format = file_format or format_for(file_name)
+    if file_format == "npz":
+        return NpzWriter(file_name, measurements, compress)
+    if file_format == "parquet":
+        return ParquetWriter(file_name, measurements)
+    raise ValueError(f"{file_format} is not a columnar format.")
+
+
+def write_store(store: PollutionStore, file_name: str, file_format: str = None, compress: bool = True) -> None:
+    """
+    A function to write a whole store to a columnar file.
+    """
+    writer = open_writer(file_name, store.measurements, file_format, compress)
+    writer.write_sites(store.site_codes, numpy.diff(store.offsets), store.timestamps, store.values)
+    writer.close()
+
+
+def read_npz(file_name: str, measurements=None) -> PollutionStore:
+    """
+    A function to read an .npz data file, loading only the requested
+    measurement columns.
+    """
+    with numpy.load(file_name) as archive:
+        measurements = project(tuple(archive["measurements"].tolist()), measurements)
+        offsets = archive["offsets"]
+        values = numpy.empty((offsets[-1], len(measurements)), dtype=numpy.float32)
+        for column, measurement in enumerate(measurements):
+            values[:, column] = archive[f"values_{measurement}"]
+        return PollutionStore(archive["site_codes"].tolist(), offsets, archive["timestamps"], values, measurements)
+
+
+def read_parquet(file_name: str, measurements=None) -> PollutionStore:
+    """
+    A function to read a Parquet data file, loading only the requested
+    measurement columns. Rows are grouped by site in order of first
+    appearance and sorted by time within each site.
+    """
+    if pyarrow is None:
+        raise ValueError("Reading Parquet needs the pyarrow package.")
+    names = pyarrow.parquet.read_schema(file_name).names
+    measurements = project(tuple(name for name in names if name not in ("systemCodeNumber", "timestamp")), measurements)
+    table = pyarrow.parquet.read_table(file_name, columns=["systemCodeNumber", "timestamp", *measurements])
+
+    sites = table.column("systemCodeNumber").combine_chunks().dictionary_encode()
+    site_codes = sites.dictionary.to_pylist()
+    site_of_row = sites.indices.to_numpy(zero_copy_only=False)
+    timestamps = table.column("timestamp").to_numpy().astype("datetime64[s]").astype(numpy.int64)
+    order = numpy.lexsort((timestamps, site_of_row))
+
+    values = numpy.empty((len(timestamps), len(measurements)), dtype=numpy.float32)
+    for column, measurement in enumerate(measurements):
+        values[:, column] = table.column(measurement).to_numpy()[order]
+    offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(site_of_row, minlength=len(site_codes)))))
+    return PollutionStore(site_codes, offsets, timestamps[order], values, measurements)
+
+
+def read_store(file_name: str, measurements=None) -> PollutionStore:
+    """
+    A function to read a columnar data file of either format.
+    """
+    if detect_format(file_name) == "parquet":
+        return read_parquet(file_name, measurements)
+    return read_npz(file_name, measurements)
@@ -0,0 +1,165 @@
+"""
+A module that caches the fully processed pollution dataset on disk so a
+restart does not have to parse the JSON and interpolate again. Each cache
+entry is a directory of raw .npy arrays that can be memory mapped, named
+by a hash of the source file contents and the processing settings.
+Mapped read-only, the arrays are shared through the page cache by every
+worker process instead of each holding a private copy. The first worker
+to start builds and publishes an entry while the others wait on a lock.
+Build it ahead of time with: python -m src.dataset_cache
+Author: Ross Cochrane
+"""
+
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import numpy
+from src.pollution_store import PollutionStore
+from src.process_lock import file_lock
+
+
+# Bump whenever the processing or the cache layout changes
+CACHE_VERSION = 1
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+DEFAULT_SOURCE_FILE = os.path.join(PROJECT_DIR, "data", "pollution_data.json")
+DEFAULT_CACHE_DIR = os.path.join(PROJECT_DIR, "data", "cache")
+
+# Used when the cache directory cannot be written, e.g. a read-only image
+FALLBACK_CACHE_DIR = os.path.join(tempfile.gettempdir(), "airdatageneration-cache")
+
+ARRAYS = ("offsets", "timestamps", "values")
+
+
+def cache_key(source_files: list, settings: dict) -> str:
+    """
+    A function to hash the contents of the source files together with the
+    processing settings and cache version.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"version": CACHE_VERSION, **settings}, sort_keys=True).encode("utf-8"))
+    for file_name in source_files:
+        with open(file_name, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def writable_cache_dir(cache_dir: str):
+    """
+    A function to return cache_dir if entries can be written there,
+    otherwise the fallback directory, or None if neither is writable.
+    """
+    for directory in (cache_dir, FALLBACK_CACHE_DIR):
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            continue
+        if os.access(directory, os.W_OK):
+            return directory
+    return None
+
+
+def save_store(store: PollutionStore, directory: str) -> None:
+    """
+    A function to write a store into a new cache directory. The arrays are
+    written to a temporary directory that is renamed into place, so readers
+    never see a partial entry.
+    """
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=".building-", dir=parent)
+    try:
+        for name in ARRAYS:
+            numpy.save(os.path.join(temp_dir, f"{name}.npy"), numpy.ascontiguousarray(getattr(store, name)))
+        with open(os.path.join(temp_dir, "meta.json"), "w") as file:
+            json.dump({"site_codes": store.site_codes, "measurements": list(store.measurements)}, file)
+        os.rename(temp_dir, directory)
+    except OSError:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        # Another process may have published the same entry first
+        if not os.path.isdir(directory):
+            raise
+
+
+def load_store(directory: str, mmap: bool = True) -> PollutionStore:
+    """
+    A function to open a cache directory as a store. With mmap the arrays
+    are mapped read-only rather than read into memory.
+    """
+    with open(os.path.join(directory, "meta.json"), "r") as file:
+        meta = json.load(file)
+    arrays = {
+        name: numpy.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+        for name in ARRAYS
+    }
+    return PollutionStore(meta["site_codes"], arrays["offsets"], arrays["timestamps"], arrays["values"],
+                          tuple(meta["measurements"]))
+
+
+def load_or_build(source_file: str, settings: dict, build, cache_dir: str = DEFAULT_CACHE_DIR,
+                  mmap: bool = True):
+    """
+    A function to return the cached store for a source file and settings,
+    calling build() and caching its result on a miss. build returns a
+    PollutionStore, or None on failure, which is not cached. Processes
+    missing the same entry build it once: the first holds the build lock
+    and the rest wait, then map what it published. A cache that cannot be
+    read or written is logged and bypassed.
+    """
+    key = cache_key([source_file], settings)
+    for directory in (os.path.join(cache_dir, key), os.path.join(FALLBACK_CACHE_DIR, key)):
+        if os.path.isdir(directory):
+            try:
+                return load_store(directory, mmap)
+            except (OSError, ValueError, KeyError) as e:
+                logging.error(f"Ignoring unreadable dataset cache {directory}: {e}")
+
+    build_dir = writable_cache_dir(cache_dir)
+    if build_dir is None:
+        logging.error("No writable dataset cache directory, processing without a cache.")
+        return build()
+
+    directory = os.path.join(build_dir, key)
+    store = None
+    try:
+        with file_lock(f"{directory}.lock"):
+            # Another process may have published the entry while we waited
+            if not os.path.isdir(directory):
+                store = build()
+                if store is None:
+                    return None
+                save_store(store, directory)
+            return load_store(directory, mmap)
+    except (OSError, ValueError, KeyError) as e:
+        logging.error(f"Failed to use dataset cache {directory}: {e}")
+        return store if store is not None else build()
+
+
+def main() -> None:
+    """
+    Builds the dataset cache so the service starts warm.
+    """
+    # Imported here as importing the module starts the live simulation
+    from src.pseudo_air_pollution_data import PollutionData
+
+    parser = argparse.ArgumentParser(description="Build the preprocessed pollution dataset cache.")
+    parser.add_argument("--step", type=int, default=10, help="interpolation step in seconds")
+    parser.add_argument("--mode", choices=[mode for mode in PollutionData.MODES if mode != "procedural"],
+                        default="precomputed")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    data = PollutionData(interpolation_step=args.step, mode=args.mode, cache_dir=args.cache_dir)
+    if not data.load():
+        raise SystemExit(1)
+    print(f"Dataset cache ready in {args.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+A module that decouples producing live notifications from delivering them.
+Each subscriber has a bounded outbox of encoded notifications; a dispatcher
+thread hands due outboxes to the push pool, retrying failures with
+exponential backoff and coalescing a lagging subscriber's backlog into a
+single POST. Subscribers that keep failing are moved to a dead-letter state.
+Dropped notifications are reported so delta subscribers can be resynced.
+Author: Ross Cochrane
+"""
+
+
+from collections import deque
+import itertools
+import logging
+import random
+import threading
+import time
+
+
+ACTIVE = "active"
+DEAD = "dead"
+
+
+class Outbox:
+    """
+    Pending notifications and delivery state for one subscriber
+    """
+
+    def __init__(self, subscription_id: str, notification_url: str, max_pending: int) -> None:
+        self.subscription_id = subscription_id
+        self.notification_url = notification_url
+        self.content_encoding = None
+        # (sequence number, encoded notification) pairs, oldest dropped when full
+        self.pending = deque(maxlen=max_pending)
+        self.dead_letters = deque(maxlen=max_pending)
+        self.sequence = itertools.count()
+        self.state = ACTIVE
+        self.in_flight = False
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.delivered = 0
+        self.dropped = 0
+        self.last_result = None
+
+
+    def stats(self) -> dict:
+        """
+        A method to report the outbox's state for monitoring.
+        """
+        return {
+            "subscriptionId": self.subscription_id,
+            "notificationUrl": self.notification_url,
+            "contentEncoding": self.content_encoding,
+            "state": self.state,
+            "pending": len(self.pending),
+            "deadLetters": len(self.dead_letters),
+            "failures": self.failures,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "lastResult": self.last_result
+        }
+
+
+class DeliveryQueue:
+    """
+    Per-subscriber outboxes drained by a dispatcher thread onto an executor.
+    post is called as post(subscription_id, notification_url, payload,
+    content_encoding) and must return a result dict with an "ok" flag;
+    build_payload wraps the encoded notifications list for a subscriber.
+    on_loss, if given, is called with a subscription ID whenever one of its
+    notifications is dropped. on_result, if given, is called with the
+    subscription ID, result and last sequence number sent of every push
+    attempt as it completes.
+    """
+
+    def __init__(self, post, build_payload, executor, max_pending: int = 120, max_batch: int = 20,
+                 max_failures: int = 8, base_backoff: float = 1.0, max_backoff: float = 300.0,
+                 on_loss=None, on_result=None) -> None:
+        self.post = post
+        self.build_payload = build_payload
+        self.executor = executor
+        self.on_loss = on_loss
+        self.on_result = on_result
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.max_failures = max_failures
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.outboxes = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+
+    def enqueue(self, subscription_id: str, notification_url: str, notification: bytes,
+                content_encoding: str = None):
+        """
+        A method to add an encoded notification to a subscriber's outbox
+        without waiting on any network I/O. content_encoding is the coding
+        the subscriber's payloads are compressed with, if any. Returns the
+        notification's sequence number in the outbox, or None if the
+        subscriber is dead-lettered.
+        """
+        with self.condition:
+            outbox = self.outboxes.get(subscription_id)
+            if outbox is None or outbox.notification_url != notification_url:
+                outbox = Outbox(subscription_id, notification_url, self.max_pending)
+                self.outboxes[subscription_id] = outbox
+            outbox.content_encoding = content_encoding
+            queue = outbox.dead_letters if outbox.state == DEAD else outbox.pending
+            lost = len(queue) == queue.maxlen
+            if lost:
+                outbox.dropped += 1
+            sequence = None
+            if outbox.state == DEAD:
+                queue.append(notification)
+            else:
+                sequence = next(outbox.sequence)
+                queue.append((sequence, notification))
+                self.condition.notify_all()
+        if lost and self.on_loss is not None:
+            self.on_loss(subscription_id)
+        if outbox.state != DEAD:
+            self.start()
+        return sequence
+
+
+    def remove(self, subscription_id: str) -> None:
+        """
+        A method to discard a subscriber's outbox.
+        """
+        with self.condition:
+            self.outboxes.pop(subscription_id, None)
+
+
+    def revive(self, subscription_id: str) -> bool:
+        """
+        A method to return a dead-lettered subscriber to active delivery,
+        replaying its dead letters. Returns whether it was dead.
+        """
+        with self.condition:
+            outbox = self.outboxes.get(subscription_id)
+            if outbox is None or outbox.state != DEAD:
+                return False
+            logging.info(f"Reviving {outbox.notification_url} with {len(outbox.dead_letters)} dead letters.")
+            outbox.state = ACTIVE
+            outbox.failures = 0
+            outbox.next_attempt = 0.0
+            for notification in outbox.dead_letters:
+                outbox.pending.append((next(outbox.sequence), notification))
+            outbox.dead_letters.clear()
+            self.condition.notify_all()
+        self.start()
+        return True
+
+
+    def start(self) -> None:
+        """
+        A method to start the dispatcher thread if it is not already running.
+        """
+        with self.condition:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.stopped = False
+            self.thread = threading.Thread(target=self.__run, name="delivery-dispatcher", daemon=True)
+            self.thread.start()
+
+
+    def stop(self) -> None:
+        """
+        A method to stop the dispatcher thread; pending notifications are kept.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        A method to wait until every active outbox is empty and idle.
+        Returns False if the timeout expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while any(
+                outbox.in_flight or (outbox.state == ACTIVE and outbox.pending)
+                for outbox in self.outboxes.values()
+            ):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+    def stats(self) -> list:
+        """
+        A method to report the state of every outbox.
+        """
+        with self.condition:
+            return [outbox.stats() for outbox in self.outboxes.values()]
+
+
+    def __run(self) -> None:
+        """
+        Dispatcher loop handing each due outbox to the executor, one delivery
+        in flight per subscriber.
+        """
+        with self.condition:
+            while not self.stopped:
+                now = time.monotonic()
+                wake_at = None
+                for outbox in self.outboxes.values():
+                    if outbox.state != ACTIVE or outbox.in_flight or not outbox.pending:
+                        continue
+                    if outbox.next_attempt > now:
+                        wake_at = outbox.next_attempt if wake_at is None else min(wake_at, outbox.next_attempt)
+                        continue
+                    outbox.in_flight = True
+                    self.executor.submit(self.__deliver, outbox)
+                self.condition.wait(None if wake_at is None else wake_at - now)
+
+
+    def __deliver(self, outbox: Outbox) -> None:
+        """
+        Posts up to max_batch pending notifications as one payload, so a
+        subscriber that has fallen behind catches up in a single request.
+        """
+        with self.condition:
+            batch = list(itertools.islice(outbox.pending, self.max_batch))
+        payload = self.build_payload(outbox.subscription_id, b"[" + b",".join(item for _, item in batch) + b"]")
+
+        try:
+            result = self.post(outbox.subscription_id, outbox.notification_url, payload, outbox.content_encoding)
+        except Exception as e:
+            result = {"ok": False, "error": str(e)}
+        # Reported before the outbox is idle again, so flush waits for it
+        if self.on_result is not None:
+            try:
+                self.on_result(outbox.subscription_id, result, batch[-1][0])
+            except Exception as e:
+                logging.error(f"Failed to record the push result for {outbox.notification_url}: {e}")
+
+        with self.condition:
+            outbox.in_flight = False
+            outbox.last_result = result
+            if result.get("ok"):
+                # Items may have been dropped meanwhile, so remove by sequence number
+                last_sequence = batch[-1][0]
+                while outbox.pending and outbox.pending[0][0] <= last_sequence:
+                    outbox.pending.popleft()
+                outbox.delivered += len(batch)
+                outbox.failures = 0
+                outbox.next_attempt = 0.0
+            else:
+                outbox.failures += 1
+                if outbox.failures >= self.max_failures:
+                    logging.error(f"Dead-lettering {outbox.notification_url} after {outbox.failures} failed pushes.")
+                    outbox.state = DEAD
+                    outbox.dead_letters.extend(item for _, item in outbox.pending)
+                    outbox.pending.clear()
+                else:
+                    backoff = min(self.max_backoff, self.base_backoff * 2 ** (outbox.failures - 1))
+                    outbox.next_attempt = time.monotonic() + backoff * random.uniform(1.0, 1.1)
+            self.condition.notify_all()
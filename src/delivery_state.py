@@ -0,0 +1,82 @@
+"""
+A module that shares the delivery queue's control and statistics between
+worker processes through the state directory. Only the leader pushes, so
+only its outboxes hold anything: other workers record revive requests for
+the leader to apply on its next tick, and the leader publishes its outbox
+statistics for any worker to report. Cancelled subscriptions need no
+request, since the leader sees them leave the shared registry.
+Author: Ross Cochrane
+"""
+
+
+import json
+import logging
+import os
+from src.process_lock import file_lock
+
+
+class SharedDeliveryState:
+    """
+    Subscribers waiting to be revived and the leader's latest outbox
+    statistics, each kept in a JSON file in directory and replaced
+    atomically.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.revivals_file = os.path.join(directory, "delivery_revivals.json")
+        self.stats_file = os.path.join(directory, "delivery_stats.json")
+
+
+    def __read(self, file_name: str, default):
+        try:
+            with open(file_name, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return default
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to read {file_name}: {e}")
+            return default
+
+
+    def __write(self, file_name: str, value) -> None:
+        temp_name = f"{file_name}.{os.getpid()}.tmp"
+        with open(temp_name, "w") as file:
+            json.dump(value, file)
+        os.replace(temp_name, file_name)
+
+
+    def request_revival(self, subscription_id: str) -> None:
+        """
+        A method to ask the leader to revive a subscriber.
+        """
+        with file_lock(f"{self.revivals_file}.lock"):
+            revivals = self.__read(self.revivals_file, [])
+            if subscription_id not in revivals:
+                revivals.append(subscription_id)
+                self.__write(self.revivals_file, revivals)
+
+
+    def take_revivals(self) -> list:
+        """
+        A method to return the subscription IDs waiting to be revived, in
+        the order they were asked for, removing them.
+        """
+        with file_lock(f"{self.revivals_file}.lock"):
+            revivals = self.__read(self.revivals_file, [])
+            if revivals:
+                os.remove(self.revivals_file)
+        return revivals
+
+
+    def publish_stats(self, stats: list) -> None:
+        """
+        A method to publish the leader's outbox statistics.
+        """
+        self.__write(self.stats_file, stats)
+
+
+    def read_stats(self) -> list:
+        """
+        A method to return the last published outbox statistics.
+        """
+        return self.__read(self.stats_file, [])
@@ -0,0 +1,87 @@
+"""
+A module that keeps the live simulation time in a state file, so every
+worker process reads and sets the same clock. Under gunicorn the master
+creates the state directory and passes it to its workers through
+SIMULATION_STATE_DIR; a lone process uses a private one.
+Author: Ross Cochrane
+"""
+
+
+import atexit
+from datetime import datetime, timedelta
+import json
+import os
+import shutil
+import tempfile
+from src.process_lock import file_lock
+
+
+def default_state_dir() -> str:
+    """
+    A function to return the directory holding state shared between the
+    worker processes.
+    """
+    state_dir = os.environ.get("SIMULATION_STATE_DIR")
+    if state_dir:
+        os.makedirs(state_dir, exist_ok=True)
+        return state_dir
+    # A process on its own keeps its state private and removes it on exit
+    state_dir = tempfile.mkdtemp(prefix="airdatageneration-")
+    atexit.register(shutil.rmtree, state_dir, True)
+    return state_dir
+
+
+STATE_DIR = default_state_dir()
+
+
+class SimulationClock:
+    """
+    The simulation time, stored in a file so every process sees the latest
+    value. Changes are made under a file lock so a tick advancing the clock
+    cannot overwrite a time set by another process.
+    """
+
+    def __init__(self, state_file: str, start: datetime) -> None:
+        self.state_file = state_file
+        self.start = start
+
+
+    def __read(self) -> datetime:
+        try:
+            with open(self.state_file, "r") as file:
+                return datetime.fromisoformat(json.load(file)["timestamp"])
+        except FileNotFoundError:
+            return self.start
+
+
+    def __write(self, timestamp: datetime) -> None:
+        temp_name = f"{self.state_file}.{os.getpid()}.tmp"
+        with open(temp_name, "w") as file:
+            json.dump({"timestamp": timestamp.isoformat()}, file)
+        os.replace(temp_name, self.state_file)
+
+
+    def get(self) -> datetime:
+        """
+        A method to return the current simulation time.
+        """
+        return self.__read()
+
+
+    def set(self, timestamp: datetime) -> None:
+        """
+        A method to set the simulation time for every process.
+        """
+        with file_lock(f"{self.state_file}.lock"):
+            self.__write(timestamp)
+
+
+    def advance(self, seconds: float) -> datetime:
+        """
+        A method to move the simulation time on by the given number of
+        seconds, returning the time before the move.
+        """
+        with file_lock(f"{self.state_file}.lock"):
+            current = self.__read()
+            self.__write(current + timedelta(seconds=seconds))
+        return current
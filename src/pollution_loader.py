@@ -0,0 +1,223 @@
+"""
+A module that streams pollution_data.json into a PollutionStore. The file
+is decoded one site at a time, so only the current site's JSON is held as
+Python objects, and each site's timestamps and measurements are converted
+to typed arrays in bulk. Values that fail to convert are reported per site
+and field rather than stopping the load.
+Author: Ross Cochrane
+"""
+
+
+from datetime import datetime
+import json
+import os
+import numpy
+from src.pollution_store import PollutionStore, MEASUREMENTS
+
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f%z'
+
+# Layout of the timestamps the generator writes, e.g. 2025-05-19T00:00:00.000+0000
+FAST_TIMESTAMP_LENGTH = 28
+OFFSET_AT = 23
+
+# Measurements held as whole numbers, truncated like int() would
+WHOLE_MEASUREMENTS = ("rh",)
+
+READ_SIZE = 1 << 20
+
+# Typical bytes of JSON per reading, used to size the arrays before loading;
+# pages of the estimate that are never written are not backed by memory
+BYTES_PER_READING = 128
+GROWTH_FACTOR = 1.5
+
+
+def iter_sites(file_name: str, read_size: int = READ_SIZE):
+    """
+    A generator that yields the site objects of a JSON array one at a time,
+    reading the file in blocks. Raises ValueError if the file is not a JSON
+    array of values.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_name, "r", encoding="utf-8") as file:
+        buffer, position = "", 0
+        eof = False
+        expecting = "["
+        while True:
+            # Skip whitespace, reading more of the file whenever the buffer runs out
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position == len(buffer):
+                if eof:
+                    raise ValueError(f"Unexpected end of {file_name}.")
+                block = file.read(read_size)
+                eof = not block
+                buffer, position = buffer[position:] + block, 0
+                continue
+
+            char = buffer[position]
+            if expecting == "[":
+                if char != "[":
+                    raise ValueError(f"{file_name} does not hold a JSON array.")
+                position += 1
+                expecting = "first"
+            elif char == "]" and expecting in ("first", ","):
+                return
+            elif expecting == ",":
+                if char != ",":
+                    raise ValueError(f"Expected ',' between sites in {file_name} but found {char!r}.")
+                position += 1
+                expecting = "site"
+            else:
+                try:
+                    site, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    # The site runs past the buffer, so read at least as much again
+                    block = file.read(max(read_size, len(buffer) - position))
+                    eof = not block
+                    buffer, position = buffer[position:] + block, 0
+                    continue
+                yield site
+                expecting = ","
+
+
+def parse_timestamps(texts: list):
+    """
+    A function to convert timestamp strings into epoch seconds, returning
+    an int64 array and a mask of the strings that parsed. Timestamps in the
+    generator's fixed-width layout are converted in one vectorized pass;
+    anything else falls back to strptime one at a time.
+    """
+    count = len(texts)
+    if count and all(isinstance(text, str) and len(text) == FAST_TIMESTAMP_LENGTH for text in texts):
+        strings = numpy.array(texts, dtype=f"U{FAST_TIMESTAMP_LENGTH}")
+        codes = strings.view(numpy.uint32).reshape(count, FAST_TIMESTAMP_LENGTH)
+        digits = codes[:, OFFSET_AT + 1:].astype(numpy.int64) - ord("0")
+        signs = codes[:, OFFSET_AT]
+        if numpy.all((digits >= 0) & (digits <= 9)) and numpy.all((signs == ord("+")) | (signs == ord("-"))):
+            try:
+                local = strings.astype(f"U{OFFSET_AT}").astype("datetime64[ms]").astype(numpy.int64) // 1000
+            except ValueError:
+                pass    # at least one is malformed, so find which one by one
+            else:
+                offsets = (digits[:, 0] * 10 + digits[:, 1]) * 3600 + (digits[:, 2] * 10 + digits[:, 3]) * 60
+                offsets = numpy.where(signs == ord("-"), -offsets, offsets)
+                return local - offsets, numpy.ones(count, dtype=bool)
+
+    epochs = numpy.zeros(count, dtype=numpy.int64)
+    parsed = numpy.zeros(count, dtype=bool)
+    for index, text in enumerate(texts):
+        try:
+            epochs[index] = int(datetime.strptime(text, TIMESTAMP_FORMAT).timestamp())
+            parsed[index] = True
+        except (TypeError, ValueError):
+            pass
+    return epochs, parsed
+
+
+def parse_values(values: list):
+    """
+    A function to convert a column of measurement values into float64,
+    returning the array and a mask of the values that converted. Missing
+    values become NaN without being counted as failures.
+    """
+    try:
+        return numpy.array(values, dtype=numpy.float64), numpy.ones(len(values), dtype=bool)
+    except (TypeError, ValueError):
+        pass
+
+    column = numpy.full(len(values), numpy.nan)
+    converted = numpy.ones(len(values), dtype=bool)
+    for index, value in enumerate(values):
+        if value is None:
+            continue
+        try:
+            column[index] = float(value)
+        except (TypeError, ValueError):
+            converted[index] = False
+    return column, converted
+
+
+def convert_site(site: dict, measurements: tuple = MEASUREMENTS) -> tuple:
+    """
+    A function to convert one site's dynamics into epoch seconds sorted by
+    time and a float32 values matrix. Readings without a valid lastUpdated
+    are dropped and values that fail to convert are stored as NaN. Returns
+    the site code, timestamps, values and a list of errors, one per field
+    with failures.
+    """
+    site_code = site.get("systemCodeNumber")
+    dynamics = [dynamic for dynamic in site.get("dynamics", []) if isinstance(dynamic, dict)]
+    errors = []
+
+    epochs, parsed = parse_timestamps([dynamic.get("lastUpdated") for dynamic in dynamics])
+    if not parsed.all():
+        errors.append(field_error(site_code, "lastUpdated", [dynamic.get("lastUpdated") for dynamic in dynamics], parsed))
+
+    values = numpy.empty((len(dynamics), len(measurements)), dtype=numpy.float32)
+    for column, measurement in enumerate(measurements):
+        raw = [dynamic.get(measurement) for dynamic in dynamics]
+        converted_values, converted = parse_values(raw)
+        if measurement in WHOLE_MEASUREMENTS:
+            converted_values = numpy.trunc(converted_values)
+        if not converted.all():
+            errors.append(field_error(site_code, measurement, raw, converted))
+        values[:, column] = converted_values
+
+    order = numpy.argsort(epochs[parsed], kind="stable")
+    return site_code, epochs[parsed][order], values[parsed][order], errors
+
+
+def field_error(site_code: str, field: str, raw: list, ok) -> dict:
+    """
+    A function to summarise the values of one field that failed to convert.
+    """
+    failed = numpy.nonzero(~ok)[0]
+    return {
+        "systemCodeNumber": site_code,
+        "field": field,
+        "count": len(failed),
+        "example": raw[failed[0]]
+    }
+
+
+def load_store(file_name: str, measurements: tuple = MEASUREMENTS) -> tuple:
+    """
+    A function to stream a pollution data file into a PollutionStore.
+    Each site's readings are written in place into arrays sized from the
+    file, which are grown and finally trimmed with realloc, so the load
+    never holds a second copy of the readings. Returns the store and the
+    list of conversion errors; sites without a systemCodeNumber are skipped
+    and reported.
+    """
+    site_codes = []
+    offsets = [0]
+    errors = []
+    capacity = max(os.path.getsize(file_name) // BYTES_PER_READING, 1)
+    timestamps = numpy.empty(capacity, dtype=numpy.int64)
+    values = numpy.empty((capacity, len(measurements)), dtype=numpy.float32)
+
+    for site in iter_sites(file_name):
+        if not isinstance(site, dict) or site.get("systemCodeNumber") is None:
+            errors.append({"systemCodeNumber": None, "field": "systemCodeNumber", "count": 1, "example": None})
+            continue
+        site_code, site_timestamps, site_values, site_errors = convert_site(site, measurements)
+        start, end = offsets[-1], offsets[-1] + len(site_timestamps)
+        if end > capacity:
+            # Rows are contiguous, so growing the first axis keeps them in place
+            capacity = max(end, int(capacity * GROWTH_FACTOR))
+            timestamps.resize(capacity, refcheck=False)
+            values.resize((capacity, len(measurements)), refcheck=False)
+        timestamps[start:end] = site_timestamps
+        values[start:end] = site_values
+        site_codes.append(site_code)
+        offsets.append(end)
+        errors.extend(site_errors)
+
+    if not site_codes:
+        return PollutionStore.empty(measurements), errors
+    timestamps.resize(offsets[-1], refcheck=False)
+    values.resize((offsets[-1], len(measurements)), refcheck=False)
+    return PollutionStore(site_codes, offsets, timestamps, values, measurements), errors
@@ -0,0 +1,603 @@
+"""
+A module that holds pollution readings in a columnar, NumPy backed layout.
+Every site's readings sit in one shared block: an int64 array of epoch
+seconds and a float32 matrix with one column per measurement. The rows of
+a site are contiguous and located through an offsets array.
+Author: Ross Cochrane
+"""
+
+
+from datetime import datetime, timezone
+import functools
+import math
+import threading
+import numpy
+
+
+MEASUREMENTS = ("co", "no", "no2", "rh", "temperature", "noise", "battery")
+
+# Grid points interpolated per vectorized pass
+INTERPOLATION_CHUNK_POINTS = 1 << 18
+
+
+def epoch_to_datetime(epoch) -> datetime:
+    """
+    A function to convert epoch seconds back into a UTC datetime.
+    """
+    return datetime.fromtimestamp(int(epoch), tz=timezone.utc)
+
+
+def to_python_floats(values) -> list:
+    """
+    A function to convert a float32 array into python floats using the
+    shortest float32 representation, so 0.17 is returned as 0.17 rather
+    than 0.17000000178813934.
+    """
+    return numpy.asarray(values).astype(str).astype(float).tolist()
+
+
+class PollutionStore:
+    """
+    Columnar storage for the pollution readings of every site
+    """
+
+    def __init__(self, site_codes: list, offsets, timestamps, values,
+                 measurements: tuple = MEASUREMENTS) -> None:
+        self.site_codes = list(site_codes)
+        self.offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        self.timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+        self.values = numpy.asarray(values, dtype=numpy.float32)
+        self.measurements = tuple(measurements)
+        # Hash index from site code to position, built once per store
+        self.site_index = {code: position for position, code in enumerate(self.site_codes)}
+
+
+    @classmethod
+    def empty(cls, measurements: tuple = MEASUREMENTS) -> "PollutionStore":
+        """
+        A method to create a store without any sites.
+        """
+        return cls([], [0], numpy.empty(0, dtype=numpy.int64),
+                   numpy.empty((0, len(measurements)), dtype=numpy.float32), measurements)
+
+
+    @classmethod
+    def from_sites(cls, sites: list, measurements: tuple = MEASUREMENTS) -> "PollutionStore":
+        """
+        A method to build a store from a list of site dictionaries, each holding
+        a systemCodeNumber and a list of dynamics with a datetime lastUpdated.
+        Missing measurements are stored as NaN.
+        """
+        site_codes = []
+        offsets = [0]
+        timestamps = []
+        rows = []
+
+        for site in sites:
+            dynamics = sorted(site.get("dynamics", []), key=lambda dynamic: dynamic["lastUpdated"])
+            site_codes.append(site["systemCodeNumber"])
+            for dynamic in dynamics:
+                timestamps.append(int(dynamic["lastUpdated"].timestamp()))
+                rows.append([dynamic.get(measurement, numpy.nan) for measurement in measurements])
+            offsets.append(len(timestamps))
+
+        values = numpy.array(rows, dtype=numpy.float32).reshape(len(rows), len(measurements))
+        return cls(site_codes, offsets, timestamps, values, measurements)
+
+
+    def interpolate(self, step: int = 10) -> "PollutionStore":
+        """
+        A method to expand the readings onto a regular time grid, every step
+        seconds from each reading up to the next one, followed by the site's
+        final reading. Sites are interpolated a vectorized chunk at a time
+        into preallocated arrays, so the float64 working arrays stay bounded
+        by INTERPOLATION_CHUNK_POINTS however large the grid.
+        """
+        if step <= 0:
+            raise ValueError("Interpolation step must be a positive number of seconds.")
+
+        rows = numpy.arange(len(self.timestamps))
+        ends = self.offsets[1:]
+        # Each reading is the start of a segment unless it is the last of its site
+        is_last = numpy.zeros(len(rows), dtype=bool)
+        is_last[ends[ends > self.offsets[:-1]] - 1] = True
+        next_rows = numpy.where(is_last, rows, rows + 1)
+
+        elapsed = self.timestamps[next_rows] - self.timestamps
+        counts = numpy.where(is_last, 1, -(-elapsed // step))
+        total_points = numpy.concatenate(([0], numpy.cumsum(counts)))
+        site_points = total_points[self.offsets]
+
+        timestamps = numpy.empty(total_points[-1], dtype=numpy.int64)
+        values = numpy.empty((total_points[-1], len(self.measurements)), dtype=numpy.float32)
+        site = 0
+        while site < len(self.site_codes):
+            # Take whole sites up to the chunk size, and at least one
+            last_site = int(numpy.searchsorted(site_points, site_points[site] + INTERPOLATION_CHUNK_POINTS,
+                                               side="right")) - 1
+            last_site = min(max(last_site, site + 1), len(self.site_codes))
+            row_start, row_end = self.offsets[site], self.offsets[last_site]
+            chunk_counts = counts[row_start:row_end]
+
+            # Repeat each source row once per grid point and work out its step number
+            source = numpy.repeat(rows[row_start:row_end], chunk_counts)
+            point_start, point_end = total_points[row_start], total_points[row_end]
+            steps_in = (numpy.arange(point_start, point_end)
+                        - numpy.repeat(total_points[row_start:row_end], chunk_counts)) * step
+
+            seconds = elapsed[source]
+            fraction = numpy.divide(steps_in, seconds, out=numpy.zeros(len(source)), where=seconds > 0)
+            current = self.values[source].astype(numpy.float64)
+            following = self.values[next_rows[source]].astype(numpy.float64)
+            timestamps[point_start:point_end] = self.timestamps[source] + steps_in
+            values[point_start:point_end] = current + (following - current) * fraction[:, None]
+            site = last_site
+
+        return PollutionStore(self.site_codes, site_points, timestamps, values, self.measurements)
+
+
+    def __len__(self) -> int:
+        return len(self.site_codes)
+
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The number of bytes held by the reading arrays.
+        """
+        return self.offsets.nbytes + self.timestamps.nbytes + self.values.nbytes
+
+
+    def site_position(self, system_code_number: str):
+        """
+        A method to find the position of a site in the store, or None if unknown.
+        """
+        return self.site_index.get(system_code_number)
+
+
+    def site_bounds(self, position: int) -> tuple:
+        """
+        A method to return the first and one past the last row of a site.
+        """
+        return int(self.offsets[position]), int(self.offsets[position + 1])
+
+
+    def nearest_row(self, position: int, epoch: float):
+        """
+        A method to return the row of the site's reading closest to the given
+        epoch seconds, or None if the site has no readings. Ties resolve to
+        the earlier reading.
+        """
+        start, end = self.site_bounds(position)
+        if start == end:
+            return None
+
+        # Binary search the site's sorted timestamps for its neighbours
+        timestamps = self.timestamps[start:end]
+        after = int(numpy.searchsorted(timestamps, epoch, side="left"))
+        if after == 0:
+            return start
+        if after == len(timestamps):
+            return end - 1
+        before = after - 1
+        if epoch - timestamps[before] <= timestamps[after] - epoch:
+            return start + before
+        return start + after
+
+
+    def nearest_reading(self, position: int, epoch: float):
+        """
+        A method to return the timestamp and values of the site's reading
+        closest to the given epoch seconds, or None if there is no reading.
+        """
+        row = self.nearest_row(position, epoch)
+        if row is None:
+            return None
+        return int(self.timestamps[row]), self.values[row]
+
+
+    def first_rows_at_or_after(self, starts, ends, epochs):
+        """
+        A method to binary search many row ranges in lockstep for the first
+        reading at or after each epoch, returning the range end if none is.
+        """
+        low = starts.copy()
+        high = ends.copy()
+        active = low < high
+        while active.any():
+            middle = (low + high) // 2
+            probe = self.timestamps[numpy.minimum(middle, len(self.timestamps) - 1)]
+            go_right = active & (probe < epochs)
+            low = numpy.where(go_right, middle + 1, low)
+            high = numpy.where(active & ~go_right, middle, high)
+            active = low < high
+        return low
+
+
+    def closer_neighbours(self, starts, ends, low, epochs):
+        """
+        A method to pick, for each row range, whichever of the readings either
+        side of low is closer to the epoch, preferring the earlier on ties.
+        Ranges must not be empty.
+        """
+        after = numpy.minimum(low, numpy.maximum(ends - 1, 0))
+        before = numpy.maximum(low - 1, starts)
+        before_gap = epochs - self.timestamps[before]
+        after_gap = self.timestamps[after] - epochs
+        use_after = (low == starts) | ((low < ends) & (before_gap > after_gap))
+        return numpy.where(use_after, after, before)
+
+
+    def tick_cursor(self) -> "TickCursor":
+        """
+        A method to create a cursor for stepping the live simulation clock
+        through the store.
+        """
+        return TickCursor(self)
+
+
+    def nearest_rows(self, positions, epochs):
+        """
+        A method to find the closest reading for many (site position, epoch)
+        lookups at once. Every site is binary searched in lockstep, so the
+        cost is a handful of array operations regardless of the lookup count.
+        Returns the rows and a mask of lookups that found a reading; unknown
+        positions are given as -1.
+        """
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        epochs = numpy.asarray(epochs, dtype=numpy.float64)
+        known = (positions >= 0) & (positions < len(self.site_codes))
+        if not len(self.timestamps):
+            return numpy.full(len(positions), -1, dtype=numpy.int64), numpy.zeros(len(positions), dtype=bool)
+
+        safe_positions = numpy.where(known, positions, 0)
+        starts = numpy.where(known, self.offsets[safe_positions], 0)
+        ends = numpy.where(known, self.offsets[safe_positions + 1], 0)
+        found = starts < ends
+
+        low = self.first_rows_at_or_after(starts, ends, epochs)
+        rows = numpy.full(len(positions), -1, dtype=numpy.int64)
+        rows[found] = self.closer_neighbours(starts[found], ends[found], low[found], epochs[found])
+        return rows, found
+
+
+    def nearest_readings(self, positions, epochs):
+        """
+        A method to return the timestamps and values of the closest reading
+        for many (site position, epoch) lookups, plus a mask of lookups that
+        found one. Rows without a reading hold 0 and NaN.
+        """
+        rows, found = self.nearest_rows(positions, epochs)
+        timestamps = numpy.zeros(len(rows), dtype=numpy.int64)
+        timestamps[found] = self.timestamps[rows[found]]
+        values = numpy.full((len(rows), len(self.measurements)), numpy.nan, dtype=numpy.float32)
+        values[found] = self.values[rows[found]]
+        return timestamps, values, found
+
+
+    def iter_range(self, position: int, start_epoch: float, end_epoch: float,
+                   stride: int = 1, chunk_size: int = 1024):
+        """
+        A generator yielding (timestamps, values) chunks of a site's readings
+        between two epochs inclusive, keeping every stride-th reading. The
+        window is located by binary search and chunks are array views.
+        """
+        site_start, site_end = self.site_bounds(position)
+        timestamps = self.timestamps[site_start:site_end]
+        first = site_start + int(numpy.searchsorted(timestamps, start_epoch, side="left"))
+        last = site_start + int(numpy.searchsorted(timestamps, end_epoch, side="right"))
+
+        for chunk_start in range(first, last, chunk_size * stride):
+            chunk_end = min(chunk_start + chunk_size * stride, last)
+            yield (self.timestamps[chunk_start:chunk_end:stride],
+                   self.values[chunk_start:chunk_end:stride])
+
+
+    def row_to_dict(self, row: int) -> dict:
+        """
+        A method to convert a single row into a dynamics dictionary with a
+        datetime lastUpdated, skipping measurements that are missing.
+        """
+        return self.reading_to_dict(self.timestamps[row], self.values[row])
+
+
+    def reading_to_dict(self, timestamp: int, values) -> dict:
+        """
+        A method to convert a timestamp and a row of values into a dynamics
+        dictionary with a datetime lastUpdated, skipping missing measurements.
+        """
+        entry = {
+            measurement: value
+            for measurement, value in zip(self.measurements, to_python_floats(values))
+            if not math.isnan(value)
+        }
+        entry["lastUpdated"] = epoch_to_datetime(timestamp)
+        return entry
+
+
+class TickCursor:
+    """
+    Keeps a per-site cursor into the sorted timestamps so each tick of the
+    live simulation only steps the cursors forward by the few readings that
+    passed since the previous tick, instead of searching every site again.
+    Large jumps or moving backwards fall back to a lockstep binary search.
+    """
+
+    def __init__(self, store: PollutionStore, max_steps: int = 64) -> None:
+        self.store = store
+        self.max_steps = max_steps
+        self.starts = store.offsets[:-1]
+        self.ends = store.offsets[1:]
+        self.has_readings = self.starts < self.ends
+        self.cursor = None
+        self.epoch = None
+        self.lock = threading.Lock()
+
+
+    def __advance(self, epoch: float) -> None:
+        """
+        A method to move each cursor to the site's first reading at or after epoch.
+        """
+        timestamps = self.store.timestamps
+        if self.cursor is None or epoch < self.epoch:
+            self.cursor = self.store.first_rows_at_or_after(self.starts, self.ends, numpy.full(len(self.starts), epoch))
+            return
+
+        last_row = len(timestamps) - 1
+        for _ in range(self.max_steps):
+            moving = (self.cursor < self.ends) & (timestamps[numpy.minimum(self.cursor, last_row)] < epoch)
+            if not moving.any():
+                return
+            self.cursor = self.cursor + moving
+        self.cursor = self.store.first_rows_at_or_after(self.starts, self.ends, numpy.full(len(self.starts), epoch))
+
+
+    def readings(self, epoch: float):
+        """
+        A method to return the timestamps and values of every site's reading
+        closest to epoch, plus a mask of sites that have one.
+        """
+        timestamps = numpy.zeros(len(self.starts), dtype=numpy.int64)
+        values = numpy.full((len(self.starts), len(self.store.measurements)), numpy.nan, dtype=numpy.float32)
+        if not len(self.store.timestamps):
+            return timestamps, values, self.has_readings
+
+        self.__advance(epoch)
+        self.epoch = epoch
+        has = self.has_readings
+        rows = self.store.closer_neighbours(self.starts[has], self.ends[has], self.cursor[has], epoch)
+        timestamps[self.has_readings] = self.store.timestamps[rows]
+        values[self.has_readings] = self.store.values[rows]
+        return timestamps, values, self.has_readings
+
+
+    def snapshot(self, epoch: float, tolerance: float = 10) -> dict:
+        """
+        A method to build a columnar snapshot of the readings within tolerance
+        seconds of epoch, ready for the push layer.
+        """
+        with self.lock:
+            timestamps, values, found = self.readings(epoch)
+        within = found & (numpy.abs(timestamps - epoch) <= tolerance)
+        positions = numpy.nonzero(within)[0]
+        return {
+            "epoch": epoch,
+            "measurements": self.store.measurements,
+            "site_codes": [self.store.site_codes[position] for position in positions],
+            "timestamps": timestamps[within],
+            "values": values[within]
+        }
+
+
+class LazyTickCursor(TickCursor):
+    """
+    Tick cursor for a store with no precomputed grid to step through, such
+    as a LazyPollutionStore, so each site's nearest grid point is found directly.
+    """
+
+    def __init__(self, store) -> None:
+        self.store = store
+        self.lock = threading.Lock()
+
+
+    def readings(self, epoch: float):
+        """
+        A method to return the timestamps and values of every site's grid
+        point closest to epoch, plus a mask of sites that have one.
+        """
+        positions = numpy.arange(len(self.store.site_codes))
+        return self.store.nearest_readings(positions, numpy.full(len(positions), epoch))
+
+
+class LazyPollutionStore:
+    """
+    Keeps only the raw readings and interpolates a grid point when a lookup
+    asks for it, returning the same results as the precomputed grid of
+    PollutionStore.interpolate. The raw PollutionStore is held rather than
+    extended, since its row lookups would answer from the raw readings; only
+    the lookups that answer from the grid are offered. Recently used (site,
+    grid time) results are held in a bounded LRU cache.
+    """
+
+    def __init__(self, raw: PollutionStore, step: int = 10, cache_size: int = 4096) -> None:
+        if step <= 0:
+            raise ValueError("Interpolation step must be a positive number of seconds.")
+        self.raw = raw
+        self.site_codes = raw.site_codes
+        self.measurements = raw.measurements
+        self.step = step
+        self.reading_at = functools.lru_cache(maxsize=cache_size)(self.__reading_at)
+
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+
+    def site_position(self, system_code_number: str):
+        """
+        A method to find the position of a site in the store, or None if unknown.
+        """
+        return self.raw.site_position(system_code_number)
+
+
+    def reading_to_dict(self, timestamp: int, values) -> dict:
+        """
+        A method to convert a timestamp and a row of values into a dynamics
+        dictionary, as PollutionStore.reading_to_dict.
+        """
+        return self.raw.reading_to_dict(timestamp, values)
+
+
+    def nearest_grid_time(self, position: int, epoch: float):
+        """
+        A method to find the grid time closest to the given epoch seconds for
+        a site, or None if the site has no readings. Ties resolve to the
+        earlier grid time.
+        """
+        start, end = self.raw.site_bounds(position)
+        if start == end:
+            return None
+
+        timestamps = self.raw.timestamps[start:end]
+        segment = int(numpy.searchsorted(timestamps, epoch, side="right")) - 1
+        if segment < 0:
+            return int(timestamps[0])
+        if segment >= len(timestamps) - 1:
+            return int(timestamps[-1])
+
+        segment_start = int(timestamps[segment])
+        segment_end = int(timestamps[segment + 1])
+        points_in_segment = -(-(segment_end - segment_start) // self.step)
+        point = min(int((epoch - segment_start) // self.step), points_in_segment - 1)
+
+        lower = segment_start + point * self.step
+        upper = lower + self.step if point + 1 < points_in_segment else segment_end
+        return lower if epoch - lower <= upper - epoch else upper
+
+
+    def __reading_at(self, position: int, grid_time: int):
+        """
+        A method to interpolate the values of a site at one of its grid times.
+        """
+        start, end = self.raw.site_bounds(position)
+        timestamps = self.raw.timestamps
+        row = start + int(numpy.searchsorted(timestamps[start:end], grid_time, side="right")) - 1
+        if row == end - 1 or timestamps[row] == grid_time:
+            values = self.raw.values[row].copy()
+        else:
+            # Same arithmetic as PollutionStore.interpolate so both modes agree
+            fraction = (grid_time - timestamps[row]) / (timestamps[row + 1] - timestamps[row])
+            current = self.raw.values[row].astype(numpy.float64)
+            following = self.raw.values[row + 1].astype(numpy.float64)
+            values = (current + (following - current) * fraction).astype(numpy.float32)
+        values.flags.writeable = False
+        return values
+
+
+    def nearest_reading(self, position: int, epoch: float):
+        """
+        A method to return the timestamp and interpolated values of the grid
+        point closest to the given epoch seconds, or None if there is none.
+        """
+        grid_time = self.nearest_grid_time(position, epoch)
+        if grid_time is None:
+            return None
+        return grid_time, self.reading_at(position, grid_time)
+
+
+    def tick_cursor(self) -> TickCursor:
+        """
+        A method to create a cursor for stepping the live simulation clock
+        through the store.
+        """
+        return LazyTickCursor(self)
+
+
+    def nearest_readings(self, positions, epochs):
+        """
+        A method to return the timestamps and values of the closest grid
+        point for many (site position, epoch) lookups, plus a mask of lookups
+        that found one. Each lookup goes through the LRU cache.
+        """
+        timestamps = numpy.zeros(len(positions), dtype=numpy.int64)
+        values = numpy.full((len(positions), len(self.measurements)), numpy.nan, dtype=numpy.float32)
+        found = numpy.zeros(len(positions), dtype=bool)
+        for index, (position, epoch) in enumerate(zip(positions, epochs)):
+            if not 0 <= position < len(self.site_codes):
+                continue
+            reading = self.nearest_reading(int(position), float(epoch))
+            if reading is not None:
+                timestamps[index], values[index] = reading
+                found[index] = True
+        return timestamps, values, found
+
+
+    def interpolate_at(self, position: int, grid_times):
+        """
+        A method to interpolate the values of a site at an array of its grid
+        times, using the same arithmetic as PollutionStore.interpolate.
+        """
+        start, end = self.raw.site_bounds(position)
+        grid_times = numpy.asarray(grid_times, dtype=numpy.int64)
+        timestamps = self.raw.timestamps
+        rows = start + numpy.searchsorted(timestamps[start:end], grid_times, side="right") - 1
+        following_rows = numpy.minimum(rows + 1, end - 1)
+
+        elapsed = timestamps[following_rows] - timestamps[rows]
+        fraction = numpy.divide(grid_times - timestamps[rows], elapsed,
+                                out=numpy.zeros(len(grid_times)), where=elapsed > 0)
+        current = self.raw.values[rows].astype(numpy.float64)
+        following = self.raw.values[following_rows].astype(numpy.float64)
+        return (current + (following - current) * fraction[:, None]).astype(numpy.float32)
+
+
+    def iter_grid_times(self, position: int, start_epoch: float, end_epoch: float, stride: int = 1):
+        """
+        A generator yielding the site's grid times between two epochs
+        inclusive, one segment at a time, keeping every stride-th time.
+        """
+        start, end = self.raw.site_bounds(position)
+        timestamps = self.raw.timestamps[start:end]
+        if start == end:
+            return
+
+        # Start from the segment containing the window start
+        segment = max(int(numpy.searchsorted(timestamps, start_epoch, side="right")) - 1, 0)
+        skip = 0
+        for index in range(segment, len(timestamps)):
+            segment_start = int(timestamps[index])
+            if segment_start > end_epoch:
+                return
+            if index == len(timestamps) - 1:
+                times = numpy.array([segment_start], dtype=numpy.int64)
+            else:
+                times = numpy.arange(segment_start, int(timestamps[index + 1]), self.step, dtype=numpy.int64)
+            times = times[(times >= start_epoch) & (times <= end_epoch)]
+
+            # Carry the stride across segment boundaries
+            yield times[skip::stride]
+            skip = (skip - len(times)) % stride
+
+
+    def iter_range(self, position: int, start_epoch: float, end_epoch: float,
+                   stride: int = 1, chunk_size: int = 1024):
+        """
+        A generator yielding (timestamps, values) chunks of a site's grid
+        readings between two epochs inclusive, keeping every stride-th one.
+        Values are interpolated a chunk at a time.
+        """
+        pending = []
+        pending_count = 0
+        for times in self.iter_grid_times(position, start_epoch, end_epoch, stride):
+            pending.append(times)
+            pending_count += len(times)
+            if pending_count >= chunk_size:
+                times = numpy.concatenate(pending)
+                for chunk_start in range(0, len(times) - chunk_size + 1, chunk_size):
+                    chunk = times[chunk_start:chunk_start + chunk_size]
+                    yield chunk, self.interpolate_at(position, chunk)
+                pending = [times[len(times) - len(times) % chunk_size:]]
+                pending_count = len(pending[0])
+        if pending_count:
+            times = numpy.concatenate(pending)
+            yield times, self.interpolate_at(position, times)
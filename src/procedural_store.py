@@ -0,0 +1,189 @@
+"""
+A module that derives pollution readings on demand instead of loading them.
+Every site has a reading at the start of each time bucket, drawn from a
+seeded hash of the site, bucket and measurement using the generator's busy
+period and temperature rules, and readings between buckets are linearly
+interpolated onto the usual grid. Any timestamp can be served, past or
+future, without a data file and with memory that does not grow with time.
+Author: Ross Cochrane
+"""
+
+
+import hashlib
+import numpy
+from src.air_data_generation import DECIMALS, DEFAULT_INTERVAL_MINUTES, measurement_ranges
+from src.pollution_store import PollutionStore, LazyTickCursor, MEASUREMENTS
+
+
+DEFAULT_SEED = 2025
+
+BUCKET_SECONDS = DEFAULT_INTERVAL_MINUTES * 60
+
+# splitmix64 constants
+GOLDEN_GAMMA = numpy.uint64(0x9E3779B97F4A7C15)
+MIX_1 = numpy.uint64(0xBF58476D1CE4E5B9)
+MIX_2 = numpy.uint64(0x94D049BB133111EB)
+
+
+def stable_key(text: str) -> numpy.uint64:
+    """
+    A function to turn a string into a 64 bit key that is the same in every
+    process, unlike hash().
+    """
+    return numpy.uint64(int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little"))
+
+
+def mix(keys):
+    """
+    A function to scramble an array of 64 bit keys with the splitmix64 finalizer.
+    """
+    keys = keys + GOLDEN_GAMMA
+    keys = (keys ^ (keys >> numpy.uint64(30))) * MIX_1
+    keys = (keys ^ (keys >> numpy.uint64(27))) * MIX_2
+    return keys ^ (keys >> numpy.uint64(31))
+
+
+def uniform(seed: int, site_keys, buckets, measurement_key):
+    """
+    A function to draw a uniform number in [0, 1) for each (site, bucket)
+    pair of a measurement, the same every time it is asked for.
+    """
+    keys = mix(numpy.array([seed % 2 ** 64], dtype=numpy.uint64) ^ measurement_key)
+    keys = mix(keys ^ site_keys)
+    keys = mix(keys ^ buckets.astype(numpy.uint64))
+    return (keys >> numpy.uint64(11)).astype(numpy.float64) * 2.0 ** -53
+
+
+class ProceduralPollutionStore:
+    """
+    A store whose readings are computed from the site, time and seed rather
+    than held in arrays. Lookups return the nearest point on a step second
+    grid, interpolated between the bucket readings either side of it, so it
+    answers like an interpolated PollutionStore that never runs out of data.
+    The sites are kept in a PollutionStore without readings, for its site
+    index and reading format; there are no rows to look up.
+    """
+
+    def __init__(self, site_codes: list, step: int = 10, seed: int = DEFAULT_SEED,
+                 measurements: tuple = MEASUREMENTS, bucket_seconds: int = BUCKET_SECONDS) -> None:
+        if step <= 0 or bucket_seconds <= 0:
+            raise ValueError("Interpolation step and bucket length must be a positive number of seconds.")
+        unknown = [measurement for measurement in measurements if measurement not in DECIMALS]
+        if unknown:
+            raise ValueError(f"No rule to generate {', '.join(unknown)}.")
+        self.sites = PollutionStore(site_codes, numpy.zeros(len(site_codes) + 1), numpy.empty(0),
+                                    numpy.empty((0, len(measurements))), measurements)
+        self.site_codes = self.sites.site_codes
+        self.measurements = self.sites.measurements
+        self.step = step
+        self.seed = seed
+        self.bucket_seconds = bucket_seconds
+        self.site_keys = numpy.array([stable_key(code) for code in self.site_codes], dtype=numpy.uint64)
+        self.measurement_keys = [stable_key(measurement) for measurement in self.measurements]
+
+
+    def __len__(self) -> int:
+        return len(self.site_codes)
+
+
+    def site_position(self, system_code_number: str):
+        """
+        A method to find the position of a site in the store, or None if unknown.
+        """
+        return self.sites.site_position(system_code_number)
+
+
+    def reading_to_dict(self, timestamp: int, values) -> dict:
+        """
+        A method to convert a timestamp and a row of values into a dynamics
+        dictionary, as PollutionStore.reading_to_dict.
+        """
+        return self.sites.reading_to_dict(timestamp, values)
+
+
+    def bucket_values(self, positions, buckets):
+        """
+        A method to compute the readings at the start of each bucket for
+        paired site positions and bucket numbers, rounded like the generator.
+        """
+        hours = (buckets * self.bucket_seconds // 3600) % 24
+        ranges = measurement_ranges(hours)
+        site_keys = self.site_keys[positions]
+        values = numpy.empty((len(buckets), len(self.measurements)))
+        for column, measurement in enumerate(self.measurements):
+            low, high = ranges[measurement]
+            draw = uniform(self.seed, site_keys, buckets, self.measurement_keys[column])
+            values[:, column] = numpy.round(low + (high - low) * draw, DECIMALS[measurement])
+        return values
+
+
+    def values_at(self, positions, grid_times):
+        """
+        A method to interpolate the readings of paired site positions and
+        grid times between the buckets either side, with the same arithmetic
+        as PollutionStore.interpolate.
+        """
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        grid_times = numpy.asarray(grid_times, dtype=numpy.int64)
+        buckets = grid_times // self.bucket_seconds
+        fraction = (grid_times - buckets * self.bucket_seconds) / self.bucket_seconds
+        current = self.bucket_values(positions, buckets)
+        following = self.bucket_values(positions, buckets + 1)
+        return (current + (following - current) * fraction[:, None]).astype(numpy.float32)
+
+
+    def nearest_grid_times(self, epochs):
+        """
+        A method to find the grid times closest to an array of epoch seconds,
+        with ties resolving to the earlier grid time.
+        """
+        epochs = numpy.asarray(epochs, dtype=numpy.float64)
+        lower = (numpy.floor(epochs / self.step) * self.step).astype(numpy.int64)
+        return numpy.where(epochs - lower <= self.step / 2, lower, lower + self.step)
+
+
+    def nearest_reading(self, position: int, epoch: float):
+        """
+        A method to return the timestamp and values of the grid point closest
+        to the given epoch seconds.
+        """
+        grid_time = int(self.nearest_grid_times([epoch])[0])
+        return grid_time, self.values_at([position], [grid_time])[0]
+
+
+    def nearest_readings(self, positions, epochs):
+        """
+        A method to return the timestamps and values of the closest grid
+        point for many (site position, epoch) lookups, plus a mask of lookups
+        that found one, which is every lookup for a known site.
+        """
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        found = (positions >= 0) & (positions < len(self.site_codes))
+        timestamps = numpy.zeros(len(positions), dtype=numpy.int64)
+        values = numpy.full((len(positions), len(self.measurements)), numpy.nan, dtype=numpy.float32)
+        timestamps[found] = self.nearest_grid_times(numpy.asarray(epochs, dtype=numpy.float64)[found])
+        values[found] = self.values_at(positions[found], timestamps[found])
+        return timestamps, values, found
+
+
+    def tick_cursor(self) -> LazyTickCursor:
+        """
+        A method to create a cursor for the live simulation clock, which
+        computes each tick's readings directly.
+        """
+        return LazyTickCursor(self)
+
+
+    def iter_range(self, position: int, start_epoch: float, end_epoch: float,
+                   stride: int = 1, chunk_size: int = 1024):
+        """
+        A generator yielding (timestamps, values) chunks of a site's grid
+        readings between two epochs inclusive, keeping every stride-th one.
+        """
+        first = -(-int(numpy.ceil(start_epoch)) // self.step) * self.step
+        last = int(numpy.floor(end_epoch))
+        spacing = self.step * stride
+        for chunk_start in range(first, last + 1, chunk_size * spacing):
+            times = numpy.arange(chunk_start, min(chunk_start + chunk_size * spacing, last + 1), spacing,
+                                 dtype=numpy.int64)
+            yield times, self.values_at(numpy.full(len(times), position), times)
@@ -0,0 +1,76 @@
+"""
+A module with advisory file locks used to coordinate gunicorn worker
+processes. Locks are taken with flock, so they are also exclusive between
+threads of one process that open the lock file separately. Where fcntl is
+not available (Windows) the locks do nothing and every process leads.
+Author: Ross Cochrane
+"""
+
+
+import contextlib
+import threading
+
+try:
+    import fcntl
+except ImportError:     # not available on Windows
+    fcntl = None
+
+
+@contextlib.contextmanager
+def file_lock(lock_file: str):
+    """
+    A context manager holding an exclusive lock on lock_file, waiting for
+    any other holder to release it first.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(lock_file, "a") as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+class LeaderLock:
+    """
+    Elects one leader among the processes sharing a lock file. The first
+    process to take the lock keeps it until it exits, when the kernel
+    releases it and the next process to ask takes over.
+    """
+
+    def __init__(self, lock_file: str) -> None:
+        self.lock_file = lock_file
+        self.file = None
+        self.lock = threading.Lock()
+
+
+    def is_leader(self) -> bool:
+        """
+        A method to return whether this process leads, taking the lock
+        without waiting if it is free.
+        """
+        if fcntl is None:
+            return True
+        with self.lock:
+            if self.file is not None:
+                return True
+            file = open(self.lock_file, "a")
+            try:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                file.close()
+                return False
+            self.file = file
+            return True
+
+
+    def release(self) -> None:
+        """
+        A method to step down as leader.
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
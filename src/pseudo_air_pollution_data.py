@@ -1,18 +1,28 @@
 """
 A module that simulates air quality data by loading pre-generated readings and 
-interpolating values. Pushes updates every 60 seconds.
+interpolating values. Pushes updates every 60 seconds from whichever
+worker process holds the leader lock, on a clock shared by every worker.
 Author: Ross Cochrane
 """
 
 
 import json
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 import logging
-import numpy
+import math
 import os
+import threading
+import numpy
 import requests
 from apscheduler.schedulers.background import BackgroundScheduler
-from src.subscriptions_utils import notify_subscribers
+from src.subscriptions_utils import notify_subscribers, sync_delivery
+from src import columnar_format, dataset_cache, pollution_loader
+from src.live_clock import STATE_DIR, SimulationClock
+from src.process_lock import LeaderLock
+from src.procedural_store import DEFAULT_SEED, ProceduralPollutionStore
+from src.rollups import RESOLUTIONS, Rollups
+from src.pollution_store import PollutionStore, LazyPollutionStore, MEASUREMENTS, epoch_to_datetime, to_python_floats
+from src.spatial_index import SpatialIndex
 
 
 
@@ -62,124 +72,198 @@ def load_json(file_name: str, json_data: list) -> bool:
     return success
 
 
-def simulate_live_data():
+def simulate_live_data(subscription_id: str = None):
     """
     A method to simulate live data by pushing the latest pollution data to subscribers.
+    Given a subscription_id, the data at the current time is pushed to that
+    subscriber alone and the clock is left where it is.
     """
 
-    current_sim_time = simulate_live_data.timestamp
+    if subscription_id is None:
+        # Advance simulated time by 60 seconds as per UTMC specs, pushing the time it was at
+        current_sim_time = simulation_clock.advance(60)
+    else:
+        current_sim_time = simulation_clock.get()
+
+    # Columnar snapshot of the readings within 10 seconds of the current time
+    snapshot = pollution_data.get_live_snapshot(current_sim_time, tolerance=10)
+    measurements = snapshot["measurements"]
     data_to_push = []
 
-    for site in pollution_data.data:
-        dynamics = site.get("dynamics", [])
-        # Select the closest dynamics entry to the current simulated time
-        # and ensure it is within 10 seconds of the current time
-        if dynamics:
-            closest = min(
-                dynamics,
-                key=lambda d: abs((d["lastUpdated"] - current_sim_time).total_seconds())
-            )
-            if abs((closest["lastUpdated"] - current_sim_time).total_seconds()) <= 10:
-                data_to_push.append({
-                "systemCodeNumber": site["systemCodeNumber"],
-                **{k: v for k, v in closest.items() if k != "lastUpdated"},
-                "lastUpdated": closest["lastUpdated"].isoformat()
-                })
+    for system_code, timestamp, values in zip(
+        snapshot["site_codes"], snapshot["timestamps"], to_python_floats(snapshot["values"])
+    ):
+        data_to_push.append({
+        "systemCodeNumber": system_code,
+        **{k: v for k, v in zip(measurements, values) if not math.isnan(v)},
+        "lastUpdated": epoch_to_datetime(timestamp).isoformat()
+        })
 
 
     logging.info(f"Pushing data at {current_sim_time.isoformat()} with {len(data_to_push)} records.")
 
     if data_to_push:
-        notify_subscribers("AIR QUALITY DYNAMIC", data_to_push)
+        notify_subscribers("AIR QUALITY DYNAMIC", data_to_push,
+                           subscription_ids=None if subscription_id is None else [subscription_id])
+
+
+def run_live_tick():
+    """
+    A method run every 60 seconds in every worker process; only the leader
+    advances the clock and pushes, so subscribers get one push per tick.
+    The leader first applies delivery changes made through other workers.
+    """
+    if leader_lock.is_leader():
+        sync_delivery()
+        simulate_live_data()
 
-    # Advance simulated time by 60 seconds as per UTMC specs
-    simulate_live_data.timestamp += timedelta(seconds=60)
-    
 
 class PollutionData:
     """
-    Pollution data per second
+    Pollution data per second.
+    In "precomputed" mode the interpolated grid is built at load time, in
+    "lazy" mode only the raw readings are kept and grid values are
+    interpolated on demand, with the last cache_size results cached. In
+    "procedural" mode no data file is read: each site's readings are derived
+    from seed for any time asked for, so the simulation never runs out.
+    The processed readings are cached in cache_dir and memory mapped on
+    later loads; pass an empty cache_dir to always process the data file.
+    The data file is JSON, NPZ or Parquet, by default the most recently
+    written pollution_data file in the data directory, and measurements
+    limits the load to the named pollutants. A pyramid of rollups is built
+    from the stored readings on the first statistics or downsampled range
+    read after a load, so workers that never serve them never pay for it.
+    The rollups summarise what is stored: the interpolated grid in
+    precomputed mode but the raw readings in lazy mode, so counts and
+    fine-resolution buckets differ between the two modes.
     """
 
-    def __init__(self) -> None:
-        self.data = []
+    MODES = ("precomputed", "lazy", "procedural")
+
+    # Longest window procedural data is summarised over on demand
+    MAX_PROCEDURAL_WINDOW_DAYS = 31
+
+    DATA_FILES = ("pollution_data.npz", "pollution_data.parquet", "pollution_data.json")
+
+    def __init__(self, interpolation_step: int = 10, mode: str = "precomputed",
+                 cache_size: int = 4096, cache_dir: str = dataset_cache.DEFAULT_CACHE_DIR,
+                 data_file: str = None, measurements: tuple = None, seed: int = DEFAULT_SEED) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown pollution data mode '{mode}'.")
+        self.data = PollutionStore.empty()
+        self.rollups = None
+        self.rollup_lock = threading.Lock()
+        self.interpolation_step = interpolation_step
+        self.mode = mode
+        self.cache_size = cache_size
+        self.cache_dir = cache_dir
+        self.data_file = data_file
+        self.measurements = tuple(measurements) if measurements else None
+        self.seed = seed
+        # Bumped on every load so cached responses can tell they are stale
+        self.version = 0
         self.site_metadata_cache = {}
+        self.spatial_index = SpatialIndex([], [], [])
+        self.__tick_cursor = None
         self.__loaded = False
         self.load_site_metadata()
 
 
-    def __interpolate_data__(self, input_data) -> list:
+    def __interpolate_data__(self, input_data: PollutionStore) -> PollutionStore:
         """
-        A method to generate interpolated pollution values
+        A method to generate interpolated pollution values every
+        interpolation_step seconds between the loaded readings
         """
+        return input_data.interpolate(self.interpolation_step)
 
-        for site in input_data:
-            new_dynamics = []
-
-            # Sort dynamics by timestamp
-            dynamics_sorted = sorted(site["dynamics"], key=lambda timestamp: timestamp["lastUpdated"])
-
-            for i in range(len(dynamics_sorted) - 1):
-                current = dynamics_sorted[i]
-                next_entry = dynamics_sorted[i + 1]
-
-                start_time = current["lastUpdated"]
-                end_time = next_entry["lastUpdated"]
-                elapsed_seconds = int((end_time - start_time).total_seconds())
-
-                # Interpolate each pollutant between timestamps, every 10 
-                step = 10
-                for j in range(0, elapsed_seconds, step):
-                    interpolated_time = start_time + timedelta(seconds=j)
-                    interpolated_entry = {
-                        "co" : numpy.interp(j, [0, elapsed_seconds], [current["co"], next_entry["co"]]),
-                        "no" : numpy.interp(j, [0, elapsed_seconds], [current["no"], next_entry["no"]]),
-                        "no2" : numpy.interp(j, [0, elapsed_seconds], [current["no2"], next_entry["no2"]]),
-                        "rh" : numpy.interp(j, [0, elapsed_seconds], [current["rh"], next_entry["rh"]]),
-                        "temperature" : numpy.interp(j, [0, elapsed_seconds], [current["temperature"], next_entry["temperature"]]),
-                        "noise" : numpy.interp(j, [0, elapsed_seconds], [current["noise"], next_entry["noise"]]),
-                        "battery" : numpy.interp(j, [0, elapsed_seconds], [current["battery"], next_entry["battery"]]),
-                        "lastUpdated" : interpolated_time
-                    }
-                    new_dynamics.append(interpolated_entry)
-
-                # Append the final reading
-                new_dynamics.append(dynamics_sorted[-1])
-
-            site["dynamics"] = new_dynamics
-
-        return input_data
-      
 
-    def load(self) -> bool:
+    def __process__(self, file_path: str):
         """
-        A method to load pollution data from a json file.
+        A method to read the data file into a store, interpolated unless in
+        lazy mode, whose grid is built on demand. Returns None on failure,
+        after logging each site and field that failed to convert.
         """
+        try:
+            if columnar_format.detect_format(file_path) == "json":
+                measurements = columnar_format.project(MEASUREMENTS, self.measurements)
+                store, errors = pollution_loader.load_store(file_path, measurements)
+            else:
+                store, errors = columnar_format.read_store(file_path, self.measurements), []
+        except ValueError as error:
+            logging.error(f"Failed to load {file_path}: {error}")
+            return None
+        if errors:
+            for error in errors:
+                logging.error(f"Failed to convert {error['count']} {error['field']} value(s) at site "
+                              f"{error['systemCodeNumber']}, e.g. {error['example']!r}.")
+            logging.error("Failed to load json data.")
+            return None
+        return store if self.mode == "lazy" else self.__interpolate_data__(store)
 
-        success = True
 
-        input_data = []
-        self.data.clear()
+    def data_file_path(self) -> str:
+        """
+        A method to return the data file to load: data_file if given,
+        otherwise the most recently written pollution_data file.
+        """
+        if self.data_file:
+            return self.data_file
 
-        # Load the json data files
         # Go one level up from the src directory to the project root
         parent_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
         data_dir = os.path.join(parent_dir, "data")
-        file_path = os.path.join(data_dir, "pollution_data.json")
-        success = load_json(file_path, input_data)
+        candidates = [os.path.join(data_dir, file_name) for file_name in self.DATA_FILES]
+        existing = [
+            file_path for file_path in candidates
+            if os.path.exists(file_path)
+            and (columnar_format.pyarrow is not None or columnar_format.detect_format(file_path) != "parquet")
+        ]
+        if not existing:
+            return candidates[-1]
+        return max(existing, key=os.path.getmtime)
 
-        if not success:
-            logging.error("Failed to load json data.")
-            return success
-        
-        # Interpolate missing values and store data within the class
-        self.__interpolate_data__(input_data)
 
-        # Store processed data in the instantiation
-        self.data = input_data
-        
-        if success:
-            print("Data loaded and processed successfully.")
+    def load(self) -> bool:
+        """
+        A method to load pollution data from the data file, or from the
+        dataset cache when it was already processed with the same settings.
+        In procedural mode the readings of the metadata's sites are derived
+        on demand instead.
+        """
+        if self.mode == "procedural":
+            try:
+                self.data = ProceduralPollutionStore(list(self.site_metadata_cache), self.interpolation_step,
+                                                     self.seed, self.measurements or MEASUREMENTS)
+            except ValueError as error:
+                logging.error(f"Failed to set up procedural data: {error}")
+                return False
+            self.rollups = None
+            print("Procedural data ready.")
+            self.version += 1
+            self.__loaded = True
+            return self.__loaded
+
+        file_path = self.data_file_path()
+        if not os.path.exists(file_path):
+            logging.error(f"No pollution data at {file_path}; generate it with python -m src.air_data_generation")
+            return False
+
+        if self.cache_dir:
+            settings = {"interpolation_step": self.interpolation_step, "mode": self.mode,
+                        "measurements": self.measurements}
+            store = dataset_cache.load_or_build(file_path, settings, lambda: self.__process__(file_path), self.cache_dir)
+        else:
+            store = self.__process__(file_path)
+        if store is None:
+            return False
+
+        # Store the columnar data within the class
+        self.data = LazyPollutionStore(store, self.interpolation_step, self.cache_size) if self.mode == "lazy" else store
+        # The rollups of the new readings are built when first needed
+        self.rollups = None
+
+        print("Data loaded and processed successfully.")
+        self.version += 1
         self.__loaded = True
         return self.__loaded
     
@@ -212,6 +296,19 @@ class PollutionData:
                 "lon": point.get("longitude"),
             }
             self.site_metadata_cache[system_code] = coordinates
+
+        # Index the sites with known coordinates for bbox and nearest queries
+        located = [
+            (code, coordinates["lat"], coordinates["lon"])
+            for code, coordinates in self.site_metadata_cache.items()
+            if coordinates["lat"] is not None and coordinates["lon"] is not None
+        ]
+        self.spatial_index = SpatialIndex(
+            [code for code, _, _ in located],
+            [lat for _, lat, _ in located],
+            [lon for _, _, lon in located]
+        )
+        self.version += 1
         print("Site metadata preloaded successfully.")
                    
                 
@@ -238,18 +335,157 @@ class PollutionData:
             return None
 
         # Find speficied site and closest pollution readings based on given time  
-        for site in self.data:
-            if system_code_number == site["systemCodeNumber"]:
-                
-                closest_dynamic = min(
-                    site["dynamics"], 
-                    key=lambda dynamic: abs((dynamic['lastUpdated'] - current_timestamp).total_seconds())
-                )
-                pollution_data_list.append(closest_dynamic)
+        position = self.data.site_position(system_code_number)
+        if position is not None:
+            reading = self.data.nearest_reading(position, current_timestamp.timestamp())
+            if reading is not None:
+                pollution_data_list.append(self.data.reading_to_dict(*reading))
                 
         return pollution_data_list
 
 
+    def get_reading_time(self, current_timestamp: datetime, system_code_number: str):
+        """
+        A method to return the epoch seconds of the reading that
+        get_pollution_data would return for a time and site, or None if
+        there is none. Requests that resolve to the same reading share it.
+        """
+        if not self.__loaded:
+            self.load()
+        if not self.__loaded:
+            return None
+
+        position = self.data.site_position(system_code_number)
+        if position is None:
+            return None
+        reading = self.data.nearest_reading(position, current_timestamp.timestamp())
+        return None if reading is None else int(reading[0])
+
+
+    def get_live_snapshot(self, current_timestamp: datetime, tolerance: float = 10) -> dict:
+        """
+        A method to return a columnar snapshot of every site's reading within
+        tolerance seconds of the given time, for the live simulation. A tick
+        cursor is kept between calls and recreated whenever the data reloads.
+        """
+        if self.__tick_cursor is None or self.__tick_cursor.store is not self.data:
+            self.__tick_cursor = self.data.tick_cursor()
+        return self.__tick_cursor.snapshot(current_timestamp.timestamp(), tolerance)
+
+
+    def get_pollution_data_many(self, timestamps: list, system_code_numbers: list):
+        """
+        A method to return the closest pollution readings for many paired
+        timestamps and sites in one vectorized lookup. Returns the reading
+        timestamps as epoch seconds, a values matrix with one column per
+        measurement and a mask of lookups that found a reading.
+        """
+        if not self.__loaded:
+            self.load()
+        if not self.__loaded:
+            print("Error: failed to load pollution data")
+            return None
+
+        positions = [self.data.site_position(code) for code in system_code_numbers]
+        positions = [-1 if position is None else position for position in positions]
+        epochs = [timestamp.timestamp() for timestamp in timestamps]
+        return self.data.nearest_readings(positions, epochs)
+
+
+    def get_pollution_data_range(self, start_timestamp: datetime, end_timestamp: datetime,
+                                 system_code_number: str, stride: int = 1):
+        """
+        A method to return a generator of (timestamps, values) chunks for a
+        site's readings between two times, or None if the site is unknown.
+        """
+        if not self.__loaded:
+            self.load()
+        if not self.__loaded:
+            print("Error: failed to load pollution data")
+            return None
+
+        position = self.data.site_position(system_code_number)
+        if position is None:
+            return None
+        return self.data.iter_range(position, start_timestamp.timestamp(), end_timestamp.timestamp(), stride)
+
+
+    def stored_rollups(self):
+        """
+        A method to return the rollups of the stored readings, building
+        them on first use; the raw readings are summarised in lazy mode.
+        """
+        store = self.data.raw if isinstance(self.data, LazyPollutionStore) else self.data
+        with self.rollup_lock:
+            if self.rollups is None or self.rollups.store is not store:
+                self.rollups = Rollups(store)
+            return self.rollups
+
+
+    def window_rollups(self, position: int, start_timestamp: datetime, end_timestamp: datetime):
+        """
+        A method to return the rollups and site position to answer a window
+        from. Procedural data has no stored readings, so its rollups are
+        built from the window's grid readings on demand, in whole days, and
+        a ValueError is raised for windows longer than
+        MAX_PROCEDURAL_WINDOW_DAYS.
+        """
+        if self.mode != "procedural":
+            return self.stored_rollups(), position
+
+        day = RESOLUTIONS["1d"]
+        start_epoch = start_timestamp.timestamp() // day * day
+        end_epoch = end_timestamp.timestamp() // day * day + day - 1
+        if end_epoch - start_epoch >= self.MAX_PROCEDURAL_WINDOW_DAYS * day:
+            raise ValueError(f"Procedural data is summarised over at most {self.MAX_PROCEDURAL_WINDOW_DAYS} days.")
+        chunks = list(self.data.iter_range(position, start_epoch, end_epoch))
+        timestamps = numpy.concatenate([timestamps for timestamps, _ in chunks])
+        values = numpy.concatenate([values for _, values in chunks])
+        window = PollutionStore([self.data.site_codes[position]], [0, len(timestamps)], timestamps, values,
+                                self.data.measurements)
+        return Rollups(window), 0
+
+
+    def get_statistics(self, start_timestamp: datetime, end_timestamp: datetime, system_code_number: str):
+        """
+        A method to return the count, mean, min and max of each measurement
+        for a site's readings between two times, or None if the site is
+        unknown.
+        """
+        if not self.__loaded:
+            self.load()
+        if not self.__loaded:
+            print("Error: failed to load pollution data")
+            return None
+
+        position = self.data.site_position(system_code_number)
+        if position is None:
+            return None
+        rollups, position = self.window_rollups(position, start_timestamp, end_timestamp)
+        return rollups.statistics(position, start_timestamp.timestamp(), end_timestamp.timestamp())
+
+
+    def get_pollution_data_rollup(self, start_timestamp: datetime, end_timestamp: datetime,
+                                  system_code_number: str, resolution: str, stride: int = 1):
+        """
+        A method to return a generator of (starts, counts, means, minimums,
+        maximums) chunks for a site's buckets of the given resolution
+        between two times, or None if the site is unknown.
+        """
+        if not self.__loaded:
+            self.load()
+        if not self.__loaded:
+            print("Error: failed to load pollution data")
+            return None
+
+        position = self.data.site_position(system_code_number)
+        if position is None:
+            return None
+        rollups, position = self.window_rollups(position, start_timestamp, end_timestamp)
+        return rollups.iter_buckets(position, resolution, start_timestamp.timestamp(), end_timestamp.timestamp(),
+                                    stride)
+
+
     def get_site_coordinates(self, system_code_number: str) -> dict:
         """
         A method to get the coordinates of a site based on its system code number.
@@ -273,18 +509,58 @@ class PollutionData:
         ]
 
 
+    def get_sites_in_bbox(self, south: float, west: float, north: float, east: float) -> list:
+        """
+        A method to get the coordinates of the sites inside a bounding box.
+        """
+        if not self.site_metadata_cache:
+            self.load_site_metadata()
+
+        return [
+            {"systemCodeNumber": self.spatial_index.site_codes[position],
+             **self.site_metadata_cache[self.spatial_index.site_codes[position]]}
+            for position in self.spatial_index.within_bbox(south, west, north, east)
+        ]
+
+
+    def get_nearest_sites(self, lat: float, lon: float, k: int = 1) -> list:
+        """
+        A method to get the coordinates of the k sites nearest to a point,
+        nearest first, with their distance in metres.
+        """
+        if not self.site_metadata_cache:
+            self.load_site_metadata()
+
+        return [
+            {"systemCodeNumber": self.spatial_index.site_codes[position],
+             **self.site_metadata_cache[self.spatial_index.site_codes[position]],
+             "distance": round(distance, 1)}
+            for position, distance in self.spatial_index.nearest(lat, lon, k)
+        ]
+
+
 
 
        
 # Create a global instance
-pollution_data = PollutionData()
+pollution_data = PollutionData(mode=os.environ.get("POLLUTION_DATA_MODE", "precomputed"),
+                               cache_dir=os.environ.get("POLLUTION_CACHE_DIR", dataset_cache.DEFAULT_CACHE_DIR),
+                               data_file=os.environ.get("POLLUTION_DATA_FILE") or None,
+                               measurements=[measurement.strip() for measurement in
+                                             os.environ.get("POLLUTION_MEASUREMENTS", "").split(",")
+                                             if measurement.strip()],
+                               seed=int(os.environ.get("POLLUTION_SEED", DEFAULT_SEED)))
 pollution_data.load()                   
 
 
-# Initial timestamp to simulate from
-simulate_live_data.timestamp = datetime(2025, 5, 19, 0, 0, 0, tzinfo=timezone.utc)
+# Simulation clock shared by the worker processes, starting from the initial timestamp
+simulation_clock = SimulationClock(
+    os.path.join(STATE_DIR, "simulation_clock.json"),
+    datetime(2025, 5, 19, 0, 0, 0, tzinfo=timezone.utc)
+)
+leader_lock = LeaderLock(os.path.join(STATE_DIR, "leader.lock"))
 
 scheduler = BackgroundScheduler()
-scheduler.add_job(simulate_live_data, 'interval', seconds=60)
+scheduler.add_job(run_live_tick, 'interval', seconds=60)
 scheduler.start()
 
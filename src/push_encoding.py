@@ -0,0 +1,159 @@
+"""
+A module that shrinks live notifications for subscribers that opt in.
+Delta subscribers are sent only the measurements that moved by more than
+their epsilon since the values they were last sent, with a full keyframe
+every few ticks, and payloads can be compressed with gzip or zstd.
+Author: Ross Cochrane
+"""
+
+
+import gzip
+import threading
+
+try:
+    import zstandard
+except ImportError:     # zstd is only offered when the package is installed
+    zstandard = None
+
+
+DEFAULT_EPSILON = 0.01
+DEFAULT_KEYFRAME_INTERVAL = 10
+
+# Content codings we can produce, in order of preference
+SUPPORTED_ENCODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+# Fields sent with every entry rather than compared
+KEY_FIELDS = ("systemCodeNumber", "lastUpdated")
+
+
+def choose_encoding(accepted) -> str:
+    """
+    A function to pick the content coding to use for a subscriber from the
+    codings it advertised, or None to send the payload uncompressed.
+    """
+    if not accepted:
+        return None
+    accepted = {encoding.strip().lower() for encoding in accepted}
+    for encoding in SUPPORTED_ENCODINGS:
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def compress(payload: bytes, encoding: str) -> bytes:
+    """
+    A function to compress a payload with the given content coding.
+    A fast compression level is used since payloads are compressed every tick.
+    """
+    if encoding == "gzip":
+        return gzip.compress(payload, compresslevel=5, mtime=0)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(payload)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+class DeltaState:
+    """
+    What a delta subscriber holds for each site. Changes are measured
+    against the values it will hold once the notifications in flight are
+    delivered, rather than the last reading, so slow drift is still sent
+    once it adds up to more than epsilon. The acknowledged values only move
+    forward when a push is answered with a 2xx; a failed or dropped
+    delivery discards what was in flight and forces a keyframe.
+    """
+
+    def __init__(self, epsilon: float = DEFAULT_EPSILON, keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL) -> None:
+        self.epsilon = epsilon
+        self.keyframe_interval = keyframe_interval
+        # Values as of the notifications queued so far, and as acknowledged
+        self.sent = {}
+        self.acknowledged = {}
+        # (sequence number, keyframe, changes) of queued notifications, oldest first
+        self.in_flight = []
+        self.draft = None
+        self.ticks = 0
+        self.needs_keyframe = True
+        # Held while a notification is encoded and queued so outboxes stay in
+        # state order; reentrant as a dropped notification resyncs mid-queue
+        self.lock = threading.RLock()
+
+
+    def reset(self) -> None:
+        """
+        A method to make the next notification a keyframe, used when the
+        subscriber may have missed notifications.
+        """
+        with self.lock:
+            self.needs_keyframe = True
+            self.in_flight = []
+            self.sent = {site_id: dict(values) for site_id, values in self.acknowledged.items()}
+
+
+    def diff(self, data: list) -> tuple:
+        """
+        A method to return the entries to send for one tick and whether they
+        form a keyframe. A keyframe carries every field of every site; other
+        ticks carry only the measurements that changed beyond epsilon, and
+        leave out sites with no such change. Pass the notification's
+        sequence number to queued once it is in the outbox.
+        """
+        keyframe = self.needs_keyframe or self.ticks % self.keyframe_interval == 0
+        self.ticks += 1
+        self.needs_keyframe = False
+        if keyframe:
+            self.sent = {}
+
+        entries = []
+        changes = {}
+        for entry in data:
+            site_id = entry["systemCodeNumber"]
+            previous = self.sent.get(site_id)
+            if previous is None:
+                changed = {k: v for k, v in entry.items() if k not in KEY_FIELDS}
+                self.sent[site_id] = dict(changed)
+            else:
+                changed = {
+                    k: v for k, v in entry.items()
+                    if k not in KEY_FIELDS and (k not in previous or abs(v - previous[k]) > self.epsilon)
+                }
+                if not changed:
+                    continue
+                previous.update(changed)
+            changes[site_id] = dict(changed)
+
+            changed["systemCodeNumber"] = site_id
+            if "lastUpdated" in entry:
+                changed["lastUpdated"] = entry["lastUpdated"]
+            entries.append(changed)
+
+        self.draft = (keyframe, changes)
+        return entries, keyframe
+
+
+    def queued(self, sequence) -> None:
+        """
+        A method to record that the notification of the last diff was
+        queued under an outbox sequence number, or, given None, that it
+        could not be delivered.
+        """
+        with self.lock:
+            keyframe, changes = self.draft or (False, {})
+            self.draft = None
+            if sequence is None:
+                self.reset()
+                return
+            self.in_flight.append((sequence, keyframe, changes))
+
+
+    def acknowledge(self, sequence: int) -> None:
+        """
+        A method to move the acknowledged values forward past every
+        notification up to sequence, after a push answered with a 2xx.
+        """
+        with self.lock:
+            while self.in_flight and self.in_flight[0][0] <= sequence:
+                _, keyframe, changes = self.in_flight.pop(0)
+                if keyframe:
+                    self.acknowledged = {}
+                for site_id, values in changes.items():
+                    self.acknowledged.setdefault(site_id, {}).update(values)
@@ -0,0 +1,107 @@
+"""
+A module that caches encoded JSON responses for endpoints whose answers
+only change when the data is reloaded. Bodies are kept in a bounded LRU
+keyed by the request's meaning, served with a content-hash ETag and a
+Cache-Control header, and answered with 304 when the client already holds
+them. Entries are dropped whenever the data version changes.
+Author: Ross Cochrane
+"""
+
+
+from collections import OrderedDict
+import hashlib
+import threading
+from flask import Response, jsonify, request
+
+
+MAX_CACHED_RESPONSES = 4096
+
+# Seconds a client may reuse a response before revalidating it
+CACHE_MAX_AGE = 60
+
+
+class ResponseCache:
+    """
+    A thread-safe LRU of (body, ETag) pairs for one version of the data.
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHED_RESPONSES) -> None:
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+    def get(self, key, version):
+        """
+        A method to return the cached (body, etag) for key, or None. Every
+        entry is discarded first if the data version has changed.
+        """
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+
+    def put(self, key, version, body: bytes) -> tuple:
+        """
+        A method to cache an encoded body for key, evicting the least
+        recently used entries beyond max_entries. Returns (body, etag).
+        """
+        entry = (body, hashlib.blake2b(body, digest_size=16).hexdigest())
+        with self.lock:
+            if version == self.version:
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return entry
+
+
+    def clear(self) -> None:
+        """
+        A method to empty the cache.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.version = None
+
+
+response_cache = ResponseCache()
+
+
+def cached_json_response(key, version, build, cache: ResponseCache = response_cache) -> Response:
+    """
+    A function to answer a request from the cache, calling build() on a
+    miss. build returns (payload, status); only 200 answers are cached.
+    Responses carry an ETag and Cache-Control, and become a 304 when the
+    request's If-None-Match holds the ETag.
+    """
+    entry = cache.get(key, version)
+    if entry is None:
+        payload, status = build()
+        response = jsonify(payload)
+        if status != 200:
+            response.status_code = status
+            return response
+        entry = cache.put(key, version, response.get_data())
+
+    body, etag = entry
+    response = Response(body, 200, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    return response.make_conditional(request)
@@ -0,0 +1,225 @@
+"""
+A module that summarises pollution readings into a time pyramid: per site
+and measurement, the count, sum, minimum and maximum of the readings in
+every 1 minute, 10 minute, hourly and daily bucket. Each level keeps
+cumulative sums and counts, so the mean over any run of buckets is a
+difference of two rows. Statistics for an arbitrary window combine whole
+buckets from the coarsest level that fits with a few finer buckets and raw
+readings at the edges, so their cost does not grow with the window.
+Author: Ross Cochrane
+"""
+
+
+import numpy
+
+
+# Bucket sizes in seconds, finest first; each divides the next
+RESOLUTIONS = {"1m": 60, "10m": 600, "1h": 3600, "1d": 86400}
+
+
+def group_starts(site_ids, bucket_ids):
+    """
+    A function to return the index of the first row of each run of rows
+    sharing a site and bucket, given rows sorted by site then time.
+    """
+    if not len(site_ids):
+        return numpy.empty(0, dtype=numpy.int64)
+    changes = (site_ids[1:] != site_ids[:-1]) | (bucket_ids[1:] != bucket_ids[:-1])
+    return numpy.concatenate(([0], numpy.flatnonzero(changes) + 1))
+
+
+def summarise_rows(values) -> tuple:
+    """
+    A function to return the count, sum, min and max of each column of a
+    values matrix, ignoring missing readings.
+    """
+    values = numpy.asarray(values, dtype=numpy.float32)
+    present = ~numpy.isnan(values)
+    if not len(values):
+        empty = numpy.full(values.shape[1], numpy.nan, dtype=numpy.float32)
+        return numpy.zeros(values.shape[1], dtype=numpy.int64), numpy.zeros(values.shape[1]), empty, empty
+    return (present.sum(axis=0),
+            numpy.where(present, values, 0).sum(axis=0, dtype=numpy.float64),
+            numpy.fmin.reduce(values, axis=0),
+            numpy.fmax.reduce(values, axis=0))
+
+
+def combine(parts: list, columns: int) -> tuple:
+    """
+    A function to combine (count, sum, min, max) parts into the count,
+    mean, min and max of each measurement, with NaN where there are no
+    readings.
+    """
+    count = numpy.zeros(columns, dtype=numpy.int64)
+    total = numpy.zeros(columns)
+    minimum = numpy.full(columns, numpy.nan, dtype=numpy.float32)
+    maximum = numpy.full(columns, numpy.nan, dtype=numpy.float32)
+    for part_count, part_total, part_minimum, part_maximum in parts:
+        count += part_count
+        total += part_total
+        minimum = numpy.fmin(minimum, part_minimum)
+        maximum = numpy.fmax(maximum, part_maximum)
+    mean = numpy.full(columns, numpy.nan)
+    numpy.divide(total, count, out=mean, where=count > 0)
+    return count, mean.astype(numpy.float32), minimum, maximum
+
+
+class RollupLevel:
+    """
+    The buckets of one size for every site: bucket start times grouped by
+    site through offsets, cumulative sums and counts with a leading zero
+    row, and the minimum and maximum of each bucket.
+    """
+
+    def __init__(self, seconds: int, num_sites: int, site_ids, times, columns: int, column_rows) -> None:
+        """
+        Groups rows sorted by site then time into buckets of seconds.
+        column_rows(column) returns the counts, sums, minimums and maximums
+        of one measurement's rows, so only one column is expanded at a time.
+        """
+        self.seconds = seconds
+        first_rows = group_starts(site_ids, times // seconds)
+        self.starts = times[first_rows] // seconds * seconds
+        self.offsets = numpy.searchsorted(site_ids[first_rows], numpy.arange(num_sites + 1))
+        self.cumulative_sums = numpy.zeros((len(first_rows) + 1, columns))
+        self.cumulative_counts = numpy.zeros((len(first_rows) + 1, columns), dtype=numpy.int64)
+        self.minimums = numpy.empty((len(first_rows), columns), dtype=numpy.float32)
+        self.maximums = numpy.empty((len(first_rows), columns), dtype=numpy.float32)
+        if not len(first_rows):
+            return
+        for column in range(columns):
+            counts, sums, minimums, maximums = column_rows(column)
+            numpy.cumsum(numpy.add.reduceat(counts, first_rows), dtype=numpy.int64,
+                         out=self.cumulative_counts[1:, column])
+            numpy.cumsum(numpy.add.reduceat(sums, first_rows), out=self.cumulative_sums[1:, column])
+            self.minimums[:, column] = numpy.fmin.reduceat(minimums, first_rows)
+            self.maximums[:, column] = numpy.fmax.reduceat(maximums, first_rows)
+
+
+    def site_ids(self):
+        """
+        A method to return the site position of every bucket.
+        """
+        return numpy.repeat(numpy.arange(len(self.offsets) - 1), numpy.diff(self.offsets))
+
+
+    def column_rows(self, column: int) -> tuple:
+        """
+        A method to return the counts, sums, minimums and maximums of one
+        measurement's buckets, for building the next level up.
+        """
+        return (numpy.diff(self.cumulative_counts[:, column]), numpy.diff(self.cumulative_sums[:, column]),
+                self.minimums[:, column], self.maximums[:, column])
+
+
+    def bucket_range(self, position: int, start_epoch: int, end_epoch: int) -> tuple:
+        """
+        A method to return the first and last (exclusive) bucket of a site
+        starting in [start_epoch, end_epoch).
+        """
+        site_start, site_end = self.offsets[position], self.offsets[position + 1]
+        starts = self.starts[site_start:site_end]
+        return (site_start + int(numpy.searchsorted(starts, start_epoch, side="left")),
+                site_start + int(numpy.searchsorted(starts, end_epoch, side="left")))
+
+
+    def totals(self, first: int, last: int) -> tuple:
+        """
+        A method to return the count, sum, min and max of a run of buckets,
+        with the count and sum taken from the cumulative rows.
+        """
+        if first >= last:
+            return summarise_rows(numpy.empty((0, self.minimums.shape[1])))
+        return (self.cumulative_counts[last] - self.cumulative_counts[first],
+                self.cumulative_sums[last] - self.cumulative_sums[first],
+                numpy.fmin.reduce(self.minimums[first:last], axis=0),
+                numpy.fmax.reduce(self.maximums[first:last], axis=0))
+
+
+class Rollups:
+    """
+    The pyramid of rollup levels for a PollutionStore, finest first, with
+    the store kept for the raw readings at the edges of a window.
+    """
+
+    def __init__(self, store, resolutions: dict = RESOLUTIONS) -> None:
+        self.store = store
+        self.resolutions = dict(resolutions)
+        self.columns = len(store.measurements)
+        num_sites = len(store.site_codes)
+
+        def raw_rows(column):
+            values = store.values[:, column]
+            present = ~numpy.isnan(values)
+            return present.astype(numpy.int32), numpy.where(present, values, 0).astype(numpy.float64), values, values
+
+        self.levels = {}
+        site_ids = numpy.repeat(numpy.arange(num_sites), numpy.diff(store.offsets))
+        times, column_rows = store.timestamps, raw_rows
+        for name, seconds in sorted(self.resolutions.items(), key=lambda item: item[1]):
+            level = RollupLevel(seconds, num_sites, site_ids, times, self.columns, column_rows)
+            self.levels[name] = level
+            site_ids, times, column_rows = level.site_ids(), level.starts, level.column_rows
+
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The number of bytes held by the rollup arrays.
+        """
+        return sum(
+            level.starts.nbytes + level.offsets.nbytes + level.cumulative_sums.nbytes
+            + level.cumulative_counts.nbytes + level.minimums.nbytes + level.maximums.nbytes
+            for level in self.levels.values()
+        )
+
+
+    def statistics(self, position: int, start_epoch: float, end_epoch: float) -> tuple:
+        """
+        A method to return the count, mean, min and max of each measurement
+        for a site's readings between two epochs inclusive. The window is
+        covered by whole buckets from the coarsest level down, leaving only
+        the readings within a minute of either end to be read directly.
+        """
+        segments = [(int(numpy.ceil(start_epoch)), int(numpy.floor(end_epoch)) + 1)]
+        parts = []
+        for level in sorted(self.levels.values(), key=lambda level: -level.seconds):
+            remaining = []
+            for segment_start, segment_end in segments:
+                aligned_start = -(-segment_start // level.seconds) * level.seconds
+                aligned_end = segment_end // level.seconds * level.seconds
+                if aligned_start >= aligned_end:
+                    remaining.append((segment_start, segment_end))
+                    continue
+                parts.append(level.totals(*level.bucket_range(position, aligned_start, aligned_end)))
+                remaining.extend(
+                    (low, high) for low, high in ((segment_start, aligned_start), (aligned_end, segment_end))
+                    if low < high
+                )
+            segments = remaining
+
+        site_start, site_end = self.store.site_bounds(position)
+        timestamps = self.store.timestamps[site_start:site_end]
+        for segment_start, segment_end in segments:
+            first = site_start + int(numpy.searchsorted(timestamps, segment_start, side="left"))
+            last = site_start + int(numpy.searchsorted(timestamps, segment_end, side="left"))
+            parts.append(summarise_rows(self.store.values[first:last]))
+        return combine(parts, self.columns)
+
+
+    def iter_buckets(self, position: int, resolution: str, start_epoch: float, end_epoch: float,
+                     stride: int = 1, chunk_size: int = 1024):
+        """
+        A generator yielding (starts, counts, means, minimums, maximums)
+        chunks for a site's buckets of the given resolution that start
+        between two epochs inclusive, keeping every stride-th bucket.
+        """
+        level = self.levels[resolution]
+        first, last = level.bucket_range(position, numpy.ceil(start_epoch), numpy.floor(end_epoch) + 1)
+        for chunk_start in range(first, last, chunk_size * stride):
+            rows = numpy.arange(chunk_start, min(chunk_start + chunk_size * stride, last), stride)
+            counts = level.cumulative_counts[rows + 1] - level.cumulative_counts[rows]
+            sums = level.cumulative_sums[rows + 1] - level.cumulative_sums[rows]
+            means = numpy.full(sums.shape, numpy.nan)
+            numpy.divide(sums, counts, out=means, where=counts > 0)
+            yield level.starts[rows], counts, means.astype(numpy.float32), level.minimums[rows], level.maximums[rows]
@@ -0,0 +1,136 @@
+"""
+A module that scores a route polyline by the pollution along it. Sites
+within a corridor of each segment are found through the spatial index,
+their readings are looked up at the segment's mid time and combined with
+inverse distance weighting, all in vectorized passes.
+Author: Ross Cochrane
+"""
+
+
+import math
+import numpy
+from src.spatial_index import EARTH_RADIUS_M
+
+
+DEFAULT_MEASUREMENTS = ("co", "no", "no2")
+
+# Sites closer than this are weighted as if they were this far away
+MIN_WEIGHT_DISTANCE_M = 10.0
+
+
+def project_to_metres(lats, lons, origin_lat: float):
+    """
+    A function to project coordinates onto a local flat plane in metres,
+    which is accurate enough over the length of a city route.
+    """
+    scale = math.radians(1) * EARTH_RADIUS_M
+    x = numpy.asarray(lons, dtype=numpy.float64) * scale * math.cos(math.radians(origin_lat))
+    y = numpy.asarray(lats, dtype=numpy.float64) * scale
+    return x, y
+
+
+def segment_distances(start_x, start_y, end_x, end_y, point_x, point_y):
+    """
+    A function to return the distance from every point to every segment as
+    a (segments, points) matrix.
+    """
+    dx = (end_x - start_x)[:, None]
+    dy = (end_y - start_y)[:, None]
+    px = point_x[None, :] - start_x[:, None]
+    py = point_y[None, :] - start_y[:, None]
+    length_squared = dx ** 2 + dy ** 2
+
+    # Position of the closest point along each segment, clamped to its ends
+    along = numpy.divide(px * dx + py * dy, length_squared,
+                         out=numpy.zeros(px.shape), where=length_squared > 0)
+    along = numpy.clip(along, 0.0, 1.0)
+    return numpy.hypot(px - along * dx, py - along * dy)
+
+
+def score_route(pollution_data, lats, lons, epochs, corridor_m: float,
+                measurements: tuple = DEFAULT_MEASUREMENTS) -> dict:
+    """
+    A function to score a route given its vertex coordinates and epoch
+    timestamps. Each segment's concentration is the inverse distance
+    weighted mean of the readings of sites within corridor_m metres, and its
+    exposure is that concentration multiplied by the segment's duration in
+    seconds. Segments without a nearby site have no concentration and add
+    no exposure.
+    """
+    lats = numpy.asarray(lats, dtype=numpy.float64)
+    lons = numpy.asarray(lons, dtype=numpy.float64)
+    epochs = numpy.asarray(epochs, dtype=numpy.float64)
+    store = pollution_data.data
+    columns = [store.measurements.index(measurement) for measurement in measurements]
+    segment_count = len(lats) - 1
+
+    origin_lat = float(lats.mean())
+    x, y = project_to_metres(lats, lons, origin_lat)
+    lengths = numpy.hypot(numpy.diff(x), numpy.diff(y))
+    durations = numpy.diff(epochs)
+    mid_epochs = (epochs[:-1] + epochs[1:]) / 2
+
+    # Candidate sites are those in the route's bounding box grown by the corridor
+    lat_margin = math.degrees(corridor_m / EARTH_RADIUS_M)
+    lon_margin = lat_margin / max(math.cos(math.radians(origin_lat)), 0.01)
+    index = pollution_data.spatial_index
+    candidates = numpy.array(index.within_bbox(
+        lats.min() - lat_margin, lons.min() - lon_margin,
+        lats.max() + lat_margin, lons.max() + lon_margin
+    ), dtype=numpy.int64)
+    store_positions = numpy.array(
+        [store.site_position(index.site_codes[candidate]) for candidate in candidates], dtype=object
+    )
+    known = numpy.array([position is not None for position in store_positions], dtype=bool)
+    candidates = candidates[known]
+    store_positions = store_positions[known].astype(numpy.int64)
+
+    sums = numpy.zeros((segment_count, len(columns)))
+    weights = numpy.zeros((segment_count, len(columns)))
+    site_counts = numpy.zeros(segment_count, dtype=numpy.int64)
+
+    if len(candidates) and segment_count:
+        site_x, site_y = project_to_metres(index.lats[candidates], index.lons[candidates], origin_lat)
+        distances = segment_distances(x[:-1], y[:-1], x[1:], y[1:], site_x, site_y)
+        segments, sites = numpy.nonzero(distances <= corridor_m)
+        site_counts = numpy.bincount(segments, minlength=segment_count)
+
+        # One lookup for every (segment, site) pair inside the corridor
+        _, values, found = store.nearest_readings(store_positions[sites], mid_epochs[segments])
+        values = values[:, columns].astype(numpy.float64)
+        pair_weights = 1.0 / numpy.maximum(distances[segments, sites], MIN_WEIGHT_DISTANCE_M)
+        pair_weights = numpy.where(found[:, None] & ~numpy.isnan(values), pair_weights[:, None], 0.0)
+        values = numpy.nan_to_num(values)
+
+        for column in range(len(columns)):
+            sums[:, column] = numpy.bincount(segments, pair_weights[:, column] * values[:, column], segment_count)
+            weights[:, column] = numpy.bincount(segments, pair_weights[:, column], segment_count)
+
+    concentrations = numpy.divide(sums, weights, out=numpy.full(sums.shape, numpy.nan), where=weights > 0)
+    exposures = numpy.nan_to_num(concentrations) * durations[:, None]
+    # A measurement covers a segment when some nearby site has a reading of it
+    covered_durations = (durations[:, None] * (weights > 0)).sum(axis=0)
+    total_exposure = exposures.sum(axis=0)
+    mean_concentrations = numpy.divide(total_exposure, covered_durations,
+                                       out=numpy.full(len(columns), numpy.nan), where=covered_durations > 0)
+
+    return {
+        "distance": float(lengths.sum()),
+        "duration": float(durations.sum()),
+        "coverage": (covered_durations / durations.sum()).tolist() if durations.sum() > 0
+                    else [0.0] * len(columns),
+        "total_exposure": total_exposure.tolist(),
+        "mean_concentration": None if numpy.isnan(mean_concentrations).all()
+                              else [None if numpy.isnan(value) else float(value) for value in mean_concentrations],
+        "segments": [
+            {
+                "distance": float(lengths[segment]),
+                "duration": float(durations[segment]),
+                "sites": int(site_counts[segment]),
+                "concentration": None if numpy.isnan(concentrations[segment]).all()
+                                 else [None if numpy.isnan(value) else float(value) for value in concentrations[segment]],
+                "exposure": exposures[segment].tolist()
+            }
+            for segment in range(segment_count)
+        ]
+    }
@@ -5,20 +5,124 @@ Author: Ross Cochrane
 
 
 from datetime import datetime
-from flask import Blueprint, make_response, jsonify, request
-from src.pseudo_air_pollution_data import pollution_data, simulate_live_data      # removed src. prefix to avoid import issues
-from src.subscriptions_utils import subscriptions
+import json
+import math
+import threading
+from flask import Blueprint, Response, make_response, jsonify, request, stream_with_context
+from src.pseudo_air_pollution_data import leader_lock, pollution_data, simulate_live_data, simulation_clock      # removed src. prefix to avoid import issues
+from src.pollution_store import epoch_to_datetime, to_python_floats
+from src.response_cache import cached_json_response
+from src.rollups import RESOLUTIONS
+from src.route_exposure import DEFAULT_MEASUREMENTS, score_route
+from src.subscriptions_utils import delivery_stats, forget_subscriber, revive_subscriber, subscriptions
 
 
 
 pollution_bp = Blueprint('pollution-data', __name__, url_prefix='/pollutiondata')
 
+# Upper limit on the number of (site, timestamp) lookups in one batch request
+MAX_BATCH_LOOKUPS = 10000
+
+# Upper limit on k for nearest site queries
+MAX_NEAREST_SITES = 100
+
+# Upper limits on the size of a route exposure request
+MAX_EXPOSURE_ROUTES = 20
+MAX_ROUTE_POINTS = 5000
+
+
+def is_string_list(value) -> bool:
+    """
+    Returns whether a JSON value is a list of strings.
+    """
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def is_valid_point(lat: float, lon: float) -> bool:
+    """
+    Returns whether a latitude and longitude are finite and within range.
+    """
+    return math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180
+
+
+def reading_time():
+    """
+    Returns the time the request asks for readings at: its timestamp, the
+    current simulation time for readings=true, or None for no readings.
+    Raises ValueError for a malformed timestamp.
+    """
+    timestamp = request.args.get('timestamp')
+    if timestamp is not None:
+        return datetime.strptime(timestamp.replace(" ", "+"), '%Y-%m-%dT%H:%M:%S.%f%z')
+    if request.args.get('readings', 'false').lower() == 'true':
+        return simulation_clock.get()
+    return None
+
+
+def attach_readings(sites: list, timestamp) -> list:
+    """
+    Adds the closest pollution reading at timestamp to each site, unless
+    timestamp is None.
+    """
+    if timestamp is None:
+        return sites
+
+    lookup = pollution_data.get_pollution_data_many(
+        [timestamp] * len(sites), [site["systemCodeNumber"] for site in sites]
+    )
+    if lookup is None:
+        return sites
+    reading_times, values, found = lookup
+    for index, (site, row) in enumerate(zip(sites, to_python_floats(values))):
+        if not found[index]:
+            site["pollution_data"] = None
+            continue
+        site["pollution_data"] = {
+            measurement: value
+            for measurement, value in zip(pollution_data.data.measurements, row)
+            if not math.isnan(value)
+        }
+        site["pollution_data"]["lastUpdated"] = epoch_to_datetime(reading_times[index]).isoformat()
+    return sites
+
+
+def parse_delivery_options(req_data: dict) -> dict:
+    """
+    Reads the optional delivery settings of a subscription request:
+    {"delta": true, "epsilon": 0.05, "keyframeInterval": 10,
+    "acceptEncoding": ["zstd", "gzip"]}. Returns None if none were given.
+    Raises ValueError for invalid settings.
+    """
+    names = ("delta", "epsilon", "keyframeInterval", "acceptEncoding")
+    if not any(name in req_data for name in names):
+        return None
+
+    options = {"delta": bool(req_data.get("delta", False))}
+    if "epsilon" in req_data:
+        epsilon = float(req_data["epsilon"])
+        if not math.isfinite(epsilon) or epsilon < 0:
+            raise ValueError("'epsilon' must be a non-negative number.")
+        options["epsilon"] = epsilon
+    if "keyframeInterval" in req_data:
+        interval = int(req_data["keyframeInterval"])
+        if interval < 1:
+            raise ValueError("'keyframeInterval' must be at least 1.")
+        options["keyframeInterval"] = interval
+    if "acceptEncoding" in req_data:
+        accepted = req_data["acceptEncoding"]
+        if isinstance(accepted, str):
+            accepted = accepted.split(",")
+        options["acceptEncoding"] = [str(encoding).strip().lower() for encoding in accepted]
+    return options
 
 
 @pollution_bp.route('/subscribe', methods=['POST'])
 def subscribe():
     """
     Endpoint to subscribe to live pollution data updates.
+    Optionally give "delta": true to receive only the measurements that
+    changed by more than "epsilon" (with a full keyframe every
+    "keyframeInterval" ticks), and "acceptEncoding" to have bodies compressed.
     """
     req_data = request.get_json()
     notification_url = req_data.get('notificationUrl')
@@ -26,16 +130,74 @@ def subscribe():
 
     if not notification_url or not datasets:
         return make_response(jsonify("Missing 'notificationUrl' or 'subscriptions'."), 400)
-    
+    if not is_string_list(datasets):
+        return make_response(jsonify("'subscriptions' must be a list of strings."), 400)
+
+    try:
+        options = parse_delivery_options(req_data)
+    except (TypeError, ValueError) as e:
+        return make_response(jsonify(f"Invalid delivery options: {e}"), 400)
+
     print(f"New subscription request: {notification_url}")  # Debugging 
-    subscriptions.append({
-        "notificationUrl": notification_url,
-        "subscriptions": datasets
-    })
-    # Push latest data to subscribers
-    print("Subscription setup. Pushing latest data push to subscribers...")  # Debugging
-    simulate_live_data()
-    return make_response(jsonify({"SubscriptinID": len(subscriptions)}), 201)
+    subscription_id, created = subscriptions.add(notification_url, datasets, options)
+    # Subscribing again is how a subscriber that was dead-lettered comes back
+    revive_subscriber(subscription_id)
+    # Push latest data to the new subscriber in the background so the request is not held up
+    print("Subscription setup. Pushing latest data push to subscriber...")  # Debugging
+    threading.Thread(target=simulate_live_data, args=(subscription_id,), daemon=True).start()
+    return make_response(jsonify({"SubscriptinID": subscription_id}), 201 if created else 200)
+
+
+@pollution_bp.route('/subscribe/<subscription_id>', methods=['PUT'])
+def update_subscription(subscription_id):
+    """
+    Endpoint to change a subscription's notificationUrl, subscriptions and/or
+    delivery options. A dead-lettered subscriber returns to active delivery.
+    """
+    req_data = request.get_json(silent=True) or {}
+    notification_url = req_data.get('notificationUrl')
+    datasets = req_data.get("subscriptions")
+
+    try:
+        options = parse_delivery_options(req_data)
+    except (TypeError, ValueError) as e:
+        return make_response(jsonify(f"Invalid delivery options: {e}"), 400)
+
+    if notification_url is None and not datasets and options is None:
+        return make_response(jsonify("Give a 'notificationUrl', 'subscriptions' or delivery options to update."), 400)
+    if datasets is not None and (not datasets or not is_string_list(datasets)):
+        return make_response(jsonify("'subscriptions' must be a non-empty list of strings."), 400)
+
+    try:
+        subscription = subscriptions.update(subscription_id, notification_url, datasets, options)
+    except ValueError as e:
+        return make_response(jsonify(str(e)), 409)
+    if subscription is None:
+        return make_response(jsonify("Subscription not found."), 404)
+    revive_subscriber(subscription_id)
+    return make_response(jsonify(subscription), 200)
+
+
+@pollution_bp.route('/delivery', methods=['GET'])
+def get_delivery_stats():
+    """
+    Endpoint to report each subscriber's outbox: its state (active or dead),
+    pending and dead-lettered notifications, failures and last push result.
+    The outboxes belong to the leader worker; other workers report them as
+    the leader published them at its last tick.
+    """
+    return make_response(jsonify(delivery_stats(leader_lock.is_leader())), 200)
+
+
+@pollution_bp.route('/subscribe/<subscription_id>', methods=['DELETE'])
+def unsubscribe(subscription_id):
+    """
+    Endpoint to cancel a subscription.
+    """
+    if not subscriptions.remove(subscription_id):
+        return make_response(jsonify("Subscription not found."), 404)
+    forget_subscriber(subscription_id)
+    return make_response("", 204)
 
 
 @pollution_bp.route('/simtime', methods=['GET'])
@@ -44,7 +206,7 @@ def get_simulation_time():
     Returns the current timestamp used in the live simulation.
     """
     return make_response(
-        jsonify({"current_simulation_time": simulate_live_data.timestamp.isoformat()}),
+        jsonify({"current_simulation_time": simulation_clock.get().isoformat()}),
         200
     )
 
@@ -58,7 +220,7 @@ def set_simulation_time():
     ts_str = req_data.get("timestamp")
 
     try:
-        simulate_live_data.timestamp = datetime.strptime(ts_str, '%Y-%m-%dT%H:%M:%S%z')
+        simulation_clock.set(datetime.strptime(ts_str, '%Y-%m-%dT%H:%M:%S%z'))
         return make_response(jsonify({"message": "Simulation time updated."}), 200)
     except Exception as e:
         return make_response(jsonify({"error": f"Invalid timestamp: {str(e)}"}), 400)
@@ -89,32 +251,390 @@ def requested_pollution_data():
     except ValueError:
         return make_response(jsonify("Invalid timestamp format. Use 'YYYY-MM-DDTHH:MM:SS.sss+0000'."), 400)
 
-    
-    data = pollution_data.get_pollution_data(timestamp, site)
-    coordinates = pollution_data.get_site_coordinates(site)
+    def build():
+        data = pollution_data.get_pollution_data(timestamp, site)
+        coordinates = pollution_data.get_site_coordinates(site)
 
-    if coordinates is None:
-        return make_response(jsonify("No coordinates found for the given site."), 404)
+        if coordinates is None:
+            return "No coordinates found for the given site.", 404
+
+        if data is None or not data:
+            return "No pollution data available for the given timestamp and site.", 400
+
+        response = {
+            "coordinates": coordinates,
+            "pollution_data": data
+        }
+        return response, 200
+
+    # Timestamps that resolve to the same reading share one cached response
+    reading_time = pollution_data.get_reading_time(timestamp, site)
+    if reading_time is None:
+        response, status = build()
+        return make_response(jsonify(response), status)
+    return cached_json_response(("reading", site, reading_time), pollution_data.version, build)
+
+@pollution_bp.route('/sitemetadata', methods=['GET'])
+def get_all_coordinates():
+    """
+    Returns all static site metadata, ie coordinates.
+    """
+
+    def build():
+        site_coords = pollution_data.get_all_sites_coordinates()
+
+        if not site_coords:
+            return "No site metadata available.", 404
+
+        return site_coords, 200
+
+    return cached_json_response(("sitemetadata",), pollution_data.version, build)
+
+
+@pollution_bp.route('/batch', methods=['POST'])
+def requested_pollution_data_batch():
+    """
+    Returns pollution data for many sites and timestamps in one call.
+    Give either a cross product in the body as
+    {"sites": ["SITE001", ...], "timestamps": ["2025-05-19T08:00:00.000+0000", ...]}
+    or explicit pairs as {"queries": [{"site": "SITE001", "timestamp": "..."}, ...]}.
+    """
+    req_data = request.get_json(silent=True) or {}
+    if not isinstance(req_data, dict):
+        return make_response(jsonify("The body must be a JSON object."), 400)
+
+    if "queries" in req_data:
+        queries = req_data.get("queries") or []
+        if not isinstance(queries, list):
+            return make_response(jsonify("'queries' must be a list of {'site', 'timestamp'} objects."), 400)
+        pairs = [(query.get("site"), query.get("timestamp")) for query in queries if isinstance(query, dict)]
+        if len(pairs) != len(queries) or not all(
+            isinstance(site, str) and isinstance(timestamp, str) for site, timestamp in pairs
+        ):
+            return make_response(jsonify("Each query needs a 'site' and a 'timestamp' string."), 400)
+    else:
+        sites = req_data.get("sites") or []
+        timestamps = req_data.get("timestamps") or []
+        if not is_string_list(sites) or not is_string_list(timestamps):
+            return make_response(jsonify("'sites' and 'timestamps' must be lists of strings."), 400)
+        if len(sites) * len(timestamps) > MAX_BATCH_LOOKUPS:
+            return make_response(jsonify(f"Batch exceeds {MAX_BATCH_LOOKUPS} lookups."), 400)
+        pairs = [(site, timestamp) for site in sites for timestamp in timestamps]
+
+    if not pairs or any(site is None or timestamp is None for site, timestamp in pairs):
+        return make_response(jsonify("Missing parameters required: sites and timestamps, or queries"), 400)
+    if len(pairs) > MAX_BATCH_LOOKUPS:
+        return make_response(jsonify(f"Batch exceeds {MAX_BATCH_LOOKUPS} lookups."), 400)
+
+    # Parse each distinct timestamp once
+    parsed = {}
+    try:
+        for _, timestamp in pairs:
+            if timestamp not in parsed:
+                parsed[timestamp] = datetime.strptime(timestamp.replace(" ", "+"), '%Y-%m-%dT%H:%M:%S.%f%z')
+    except (ValueError, AttributeError):
+        return make_response(jsonify("Invalid timestamp format. Use 'YYYY-MM-DDTHH:MM:SS.sss+0000'."), 400)
+
+    lookup = pollution_data.get_pollution_data_many(
+        [parsed[timestamp] for _, timestamp in pairs],
+        [site for site, _ in pairs]
+    )
+    if lookup is None:
+        return make_response(jsonify("No pollution data available."), 400)
+    reading_times, values, found = lookup
+    values = to_python_floats(values)
+
+    results = []
+    for index, (site, timestamp) in enumerate(pairs):
+        results.append({
+            "site": site,
+            "timestamp": timestamp,
+            "lastUpdated": epoch_to_datetime(reading_times[index]).isoformat() if found[index] else None,
+            "values": [None if math.isnan(value) else value for value in values[index]] if found[index] else None
+        })
+
+    coordinates = {site: pollution_data.get_site_coordinates(site) for site, _ in pairs}
 
-    if data is None or not data:
-        return make_response(jsonify("No pollution data available for the given timestamp and site."), 400)
-    
     response = {
+        "measurements": list(pollution_data.data.measurements),
         "coordinates": coordinates,
-        "pollution_data": data
+        "results": results
     }
 
     return make_response(jsonify(response), 200)
 
-@pollution_bp.route('/sitemetadata', methods=['GET'])
-def get_all_coordinates():
+
+@pollution_bp.route('/range', methods=['GET'])
+def requested_pollution_data_range():
     """
-    Returns all static site metadata, ie coordinates.
+    Streams a site's readings between two timestamps, for example
+    /range?site=SITE001&start=2025-05-19T00:00:00.000+0000&end=2025-05-19T23:59:59.000+0000&stride=6
+    Readings are sent as NDJSON, one per line, or as a JSON array with format=json.
+    With resolution=1m, 10m, 1h or 1d each line is a bucket of that length
+    instead, holding the mean of each measurement and its min and max.
+    """
+    site = request.args.get('site')
+    start = request.args.get('start')
+    end = request.args.get('end')
+    output_format = request.args.get('format', 'ndjson')
+    resolution = request.args.get('resolution')
+
+    if site is None or start is None or end is None:
+        return make_response(jsonify("Missing parameters required: site, start and end"), 400)
+    if output_format not in ('ndjson', 'json'):
+        return make_response(jsonify("Invalid format. Use 'ndjson' or 'json'."), 400)
+    if resolution is not None and resolution not in RESOLUTIONS:
+        return make_response(jsonify(f"Invalid resolution. Use one of {', '.join(RESOLUTIONS)}."), 400)
+
+    try:
+        start = datetime.strptime(start.replace(" ", "+"), '%Y-%m-%dT%H:%M:%S.%f%z')
+        end = datetime.strptime(end.replace(" ", "+"), '%Y-%m-%dT%H:%M:%S.%f%z')
+    except ValueError:
+        return make_response(jsonify("Invalid timestamp format. Use 'YYYY-MM-DDTHH:MM:SS.sss+0000'."), 400)
+
+    try:
+        stride = int(request.args.get('stride', 1))
+    except ValueError:
+        stride = 0
+    if stride < 1:
+        return make_response(jsonify("Invalid stride. Use a positive whole number."), 400)
+    if end < start:
+        return make_response(jsonify("The end timestamp must not be before the start."), 400)
+
+    try:
+        if resolution is None:
+            chunks = pollution_data.get_pollution_data_range(start, end, site, stride)
+        else:
+            chunks = pollution_data.get_pollution_data_rollup(start, end, site, resolution, stride)
+    except ValueError as e:
+        return make_response(jsonify(str(e)), 400)
+    if chunks is None:
+        return make_response(jsonify("No pollution data available for the given site."), 404)
+    measurements = pollution_data.data.measurements
+
+    def generate_reading_lines():
+        """
+        Converts each chunk of readings to JSON lines as it is produced.
+        """
+        for timestamps, values in chunks:
+            for timestamp, row in zip(timestamps, to_python_floats(values)):
+                reading = {
+                    measurement: value
+                    for measurement, value in zip(measurements, row)
+                    if not math.isnan(value)
+                }
+                reading["lastUpdated"] = epoch_to_datetime(timestamp).isoformat()
+                yield json.dumps(reading)
+
+    def generate_bucket_lines():
+        """
+        Converts each chunk of buckets to JSON lines, skipping measurements
+        without readings in a bucket.
+        """
+        for starts, counts, means, minimums, maximums in chunks:
+            for bucket_start, count, mean, minimum, maximum in zip(
+                starts, counts.tolist(), to_python_floats(means),
+                to_python_floats(minimums), to_python_floats(maximums)
+            ):
+                present = [index for index, measurement_count in enumerate(count) if measurement_count]
+                bucket = {measurements[index]: mean[index] for index in present}
+                bucket["min"] = {measurements[index]: minimum[index] for index in present}
+                bucket["max"] = {measurements[index]: maximum[index] for index in present}
+                bucket["lastUpdated"] = epoch_to_datetime(bucket_start).isoformat()
+                yield json.dumps(bucket)
+
+    generate_lines = generate_reading_lines if resolution is None else generate_bucket_lines
+
+    def generate_ndjson():
+        """
+        Yields one JSON reading per line.
+        """
+        for line in generate_lines():
+            yield line + "\n"
+
+    def generate_json():
+        """
+        Yields the readings as the elements of a single JSON array.
+        """
+        separator = "["
+        for line in generate_lines():
+            yield separator + line
+            separator = ",\n"
+        yield "[]" if separator == "[" else "]"
+
+    if output_format == 'json':
+        return Response(stream_with_context(generate_json()), mimetype='application/json')
+    return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+
+
+@pollution_bp.route('/stats', methods=['GET'])
+def requested_pollution_statistics():
+    """
+    Returns the count, mean, min and max of each measurement for a site
+    between two timestamps, for example
+    /stats?site=SITE001&start=2025-05-19T00:00:00.000+0000&end=2025-05-19T23:59:59.000+0000&measurements=no2
+    measurements is optional and defaults to every measurement.
+    """
+    site = request.args.get('site')
+    start = request.args.get('start')
+    end = request.args.get('end')
+
+    if site is None or start is None or end is None:
+        return make_response(jsonify("Missing parameters required: site, start and end"), 400)
+
+    try:
+        start = datetime.strptime(start.replace(" ", "+"), '%Y-%m-%dT%H:%M:%S.%f%z')
+        end = datetime.strptime(end.replace(" ", "+"), '%Y-%m-%dT%H:%M:%S.%f%z')
+    except ValueError:
+        return make_response(jsonify("Invalid timestamp format. Use 'YYYY-MM-DDTHH:MM:SS.sss+0000'."), 400)
+    if end < start:
+        return make_response(jsonify("The end timestamp must not be before the start."), 400)
+
+    measurements = pollution_data.data.measurements
+    requested = request.args.get('measurements')
+    requested = [measurement.strip() for measurement in requested.split(",")] if requested else measurements
+    unknown = [measurement for measurement in requested if measurement not in measurements]
+    if unknown:
+        return make_response(jsonify(f"Unknown measurements: {', '.join(unknown)}."), 400)
+
+    try:
+        statistics = pollution_data.get_statistics(start, end, site)
+    except ValueError as e:
+        return make_response(jsonify(str(e)), 400)
+    if statistics is None:
+        return make_response(jsonify("No pollution data available for the given site."), 404)
+
+    counts, means, minimums, maximums = statistics
+    columns = [measurements.index(measurement) for measurement in requested]
+    means, minimums, maximums = (to_python_floats(values[columns]) for values in (means, minimums, maximums))
+    response = {
+        "systemCodeNumber": site,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "statistics": {
+            measurement: {
+                "count": int(counts[column]),
+                "mean": None if math.isnan(mean) else mean,
+                "min": None if math.isnan(minimum) else minimum,
+                "max": None if math.isnan(maximum) else maximum
+            }
+            for measurement, column, mean, minimum, maximum in zip(requested, columns, means, minimums, maximums)
+        }
+    }
+    return make_response(jsonify(response), 200)
+
+
+@pollution_bp.route('/sites/bbox', methods=['GET'])
+def get_sites_in_bbox():
+    """
+    Returns the sites inside a bounding box given by south, west, north and
+    east in degrees, optionally with readings at a timestamp or readings=true.
     """
-       
-    site_coords = pollution_data.get_all_sites_coordinates()
+    try:
+        south, west, north, east = (
+            float(request.args[name]) for name in ('south', 'west', 'north', 'east')
+        )
+    except (KeyError, ValueError):
+        return make_response(jsonify("Missing or invalid parameters required: south, west, north and east"), 400)
+    if not is_valid_point(south, west) or not is_valid_point(north, east):
+        return make_response(jsonify("Latitudes must be within [-90, 90] and longitudes within [-180, 180]."), 400)
+    if south > north or west > east:
+        return make_response(jsonify("South must not exceed north and west must not exceed east."), 400)
+
+    try:
+        timestamp = reading_time()
+    except ValueError:
+        return make_response(jsonify("Invalid timestamp format. Use 'YYYY-MM-DDTHH:MM:SS.sss+0000'."), 400)
+
+    sites = attach_readings(pollution_data.get_sites_in_bbox(south, west, north, east), timestamp)
+    return make_response(jsonify(sites), 200)
+
+
+@pollution_bp.route('/sites/nearest', methods=['GET'])
+def get_nearest_sites():
+    """
+    Returns the k sites nearest to lat and lon, nearest first with their
+    distance in metres, optionally with readings at a timestamp or readings=true.
+    """
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        k = int(request.args.get('k', 1))
+    except (KeyError, ValueError):
+        return make_response(jsonify("Missing or invalid parameters required: lat and lon, optional k"), 400)
+    if not is_valid_point(lat, lon):
+        return make_response(jsonify("lat must be within [-90, 90] and lon within [-180, 180]."), 400)
+    if not 1 <= k <= MAX_NEAREST_SITES:
+        return make_response(jsonify(f"k must be between 1 and {MAX_NEAREST_SITES}."), 400)
+
+    try:
+        timestamp = reading_time()
+    except ValueError:
+        return make_response(jsonify("Invalid timestamp format. Use 'YYYY-MM-DDTHH:MM:SS.sss+0000'."), 400)
+
+    sites = attach_readings(pollution_data.get_nearest_sites(lat, lon, k), timestamp)
+    return make_response(jsonify(sites), 200)
+
+
+@pollution_bp.route('/exposure', methods=['POST'])
+def route_exposure():
+    """
+    Scores one or more candidate routes by the pollution along them.
+    Give the request in the body in this format
+    {"corridor": 200, "measurements": ["no2"], "routes": [{"id": "A", "points": [
+        {"lat": 54.97, "lon": -1.61, "timestamp": "2025-05-19T08:00:00.000+0000"}, ...]}]}
+    corridor is in metres and measurements is optional; a single name may
+    be given as a string.
+    """
+    req_data = request.get_json(silent=True) or {}
+    if not isinstance(req_data, dict):
+        return make_response(jsonify("The body must be a JSON object."), 400)
+    routes = req_data.get("routes")
+    measurements = req_data.get("measurements")
+    if isinstance(measurements, str):
+        measurements = [measurements]
+    if measurements is not None and not is_string_list(measurements):
+        return make_response(jsonify("'measurements' must be a list of measurement names."), 400)
+    # By default score the default measurements this deployment loaded
+    measurements = tuple(measurements or [
+        measurement for measurement in DEFAULT_MEASUREMENTS if measurement in pollution_data.data.measurements
+    ])
+
+    try:
+        corridor = float(req_data.get("corridor", 200))
+    except (TypeError, ValueError):
+        corridor = -1
+    if not math.isfinite(corridor) or corridor <= 0:
+        return make_response(jsonify("Invalid corridor. Use a positive distance in metres."), 400)
+    if not routes or not isinstance(routes, list) or len(routes) > MAX_EXPOSURE_ROUTES:
+        return make_response(jsonify(f"Give between 1 and {MAX_EXPOSURE_ROUTES} routes."), 400)
+    if not measurements:
+        return make_response(jsonify("Give the measurements to score."), 400)
+    unknown = [measurement for measurement in measurements if measurement not in pollution_data.data.measurements]
+    if unknown:
+        return make_response(jsonify(f"Unknown measurements: {', '.join(map(str, unknown))}."), 400)
+
+    scores = []
+    for number, route in enumerate(routes):
+        points = route.get("points") if isinstance(route, dict) else None
+        if not points or not 2 <= len(points) <= MAX_ROUTE_POINTS:
+            return make_response(jsonify(f"Each route needs between 2 and {MAX_ROUTE_POINTS} points."), 400)
+        try:
+            lats = [float(point["lat"]) for point in points]
+            lons = [float(point["lon"]) for point in points]
+            epochs = [
+                datetime.strptime(point["timestamp"].replace(" ", "+"), '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()
+                for point in points
+            ]
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return make_response(jsonify("Each point needs a lat, lon and timestamp 'YYYY-MM-DDTHH:MM:SS.sss+0000'."), 400)
+        if not all(is_valid_point(lat, lon) for lat, lon in zip(lats, lons)):
+            return make_response(jsonify("Point lat must be within [-90, 90] and lon within [-180, 180]."), 400)
+        if any(later < earlier for earlier, later in zip(epochs, epochs[1:])):
+            return make_response(jsonify("Route timestamps must not go backwards."), 400)
 
-    if not site_coords:
-        return make_response(jsonify("No site metadata available."), 404)
+        score = score_route(pollution_data, lats, lons, epochs, corridor, measurements)
+        score["id"] = route.get("id", number)
+        scores.append(score)
 
-    return make_response(jsonify(site_coords), 200)
\ No newline at end of file
+    return make_response(jsonify({"measurements": list(measurements), "routes": scores}), 200)
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+A module that provides a grid hash spatial index over the site coordinates
+for bounding box and nearest site queries.
+Author: Ross Cochrane
+"""
+
+
+import math
+import numpy
+
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lat, lon, lats, lons):
+    """
+    A function to return the great circle distances in metres from one
+    point to arrays of points.
+    """
+    lat = numpy.radians(lat)
+    lats = numpy.radians(lats)
+    half_dlat = (lats - lat) / 2
+    half_dlon = numpy.radians(numpy.asarray(lons) - lon) / 2
+    a = numpy.sin(half_dlat) ** 2 + numpy.cos(lat) * numpy.cos(lats) * numpy.sin(half_dlon) ** 2
+    return 2 * EARTH_RADIUS_M * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+
+
+class SpatialIndex:
+    """
+    Buckets sites into square lat/lon grid cells so a query only looks at
+    the cells it overlaps rather than every site.
+    """
+
+    def __init__(self, site_codes: list, lats, lons, cell_size: float = 0.01) -> None:
+        self.site_codes = list(site_codes)
+        self.lats = numpy.asarray(lats, dtype=numpy.float64)
+        self.lons = numpy.asarray(lons, dtype=numpy.float64)
+        self.cell_size = cell_size
+
+        # Map each occupied (row, column) cell to the positions of its sites
+        rows = numpy.floor(self.lats / cell_size).astype(numpy.int64)
+        columns = numpy.floor(self.lons / cell_size).astype(numpy.int64)
+        self.cells = {}
+        for position, cell in enumerate(zip(rows.tolist(), columns.tolist())):
+            self.cells.setdefault(cell, []).append(position)
+        self.cells = {cell: numpy.array(positions) for cell, positions in self.cells.items()}
+
+        if self.cells:
+            occupied = numpy.array(list(self.cells))
+            self.row_range = (int(occupied[:, 0].min()), int(occupied[:, 0].max()))
+            self.column_range = (int(occupied[:, 1].min()), int(occupied[:, 1].max()))
+            # Cells are narrowest at the latitude furthest from the equator
+            widest_lat = min(float(numpy.abs(self.lats).max()) + cell_size, 90.0)
+            self.cell_width_m = math.radians(cell_size) * EARTH_RADIUS_M * max(math.cos(math.radians(widest_lat)), 0.0)
+
+
+    def __len__(self) -> int:
+        return len(self.site_codes)
+
+
+    def __cell(self, lat: float, lon: float) -> tuple:
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+
+    def __gather(self, cells) -> numpy.ndarray:
+        """
+        A method to collect the site positions held in the given cells.
+        """
+        found = [self.cells[cell] for cell in cells if cell in self.cells]
+        if not found:
+            return numpy.empty(0, dtype=numpy.int64)
+        return numpy.concatenate(found)
+
+
+    def within_bbox(self, south: float, west: float, north: float, east: float) -> list:
+        """
+        A method to return the positions of the sites inside a bounding box.
+        """
+        if not self.cells or south > north or west > east:
+            return []
+        low_row, low_column = self.__cell(south, west)
+        high_row, high_column = self.__cell(north, east)
+
+        # Clamp to the occupied part of the grid so huge boxes stay cheap
+        low_row, high_row = max(low_row, self.row_range[0]), min(high_row, self.row_range[1])
+        low_column, high_column = max(low_column, self.column_range[0]), min(high_column, self.column_range[1])
+        if (high_row - low_row + 1) * (high_column - low_column + 1) > len(self.cells):
+            candidates = numpy.arange(len(self.site_codes))
+        else:
+            candidates = self.__gather(
+                (row, column)
+                for row in range(low_row, high_row + 1)
+                for column in range(low_column, high_column + 1)
+            )
+
+        inside = ((self.lats[candidates] >= south) & (self.lats[candidates] <= north)
+                  & (self.lons[candidates] >= west) & (self.lons[candidates] <= east))
+        return sorted(candidates[inside].tolist())
+
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> list:
+        """
+        A method to return up to k (position, distance in metres) pairs for
+        the sites closest to a point, nearest first. Rings of cells around
+        the point are searched until no unvisited cell can hold a closer site,
+        using the narrowest cell width as the distance covered by each ring.
+        """
+        if not self.cells or k < 1:
+            return []
+        k = min(k, len(self.site_codes))
+        centre_row, centre_column = self.__cell(lat, lon)
+        query_lat = min(abs(lat) + self.cell_size, 90.0)
+        ring_width_m = min(self.cell_width_m, math.radians(self.cell_size) * EARTH_RADIUS_M
+                           * max(math.cos(math.radians(query_lat)), 0.0))
+
+        # Rings before the first one touching an occupied cell are empty
+        ring = max(0, self.row_range[0] - centre_row, centre_row - self.row_range[1],
+                   self.column_range[0] - centre_column, centre_column - self.column_range[1])
+
+        candidates = []
+        while True:
+            if (2 * ring + 1) ** 2 > 4 * len(self.cells):
+                # The search area now dwarfs the occupied grid, so check every site
+                found = numpy.arange(len(self.site_codes))
+                break
+
+            if ring == 0:
+                ring_cells = [(centre_row, centre_column)]
+            else:
+                ring_cells = [
+                    (centre_row + row_step, centre_column + column_step)
+                    for row_step in range(-ring, ring + 1)
+                    for column_step in ((-ring, ring) if abs(row_step) != ring else range(-ring, ring + 1))
+                ]
+            candidates.append(self.__gather(ring_cells))
+
+            found = numpy.concatenate(candidates)
+            if len(found) >= k:
+                distances = haversine_m(lat, lon, self.lats[found], self.lons[found])
+                if numpy.partition(distances, k - 1)[k - 1] <= ring * ring_width_m:
+                    break
+            ring += 1
+
+        distances = haversine_m(lat, lon, self.lats[found], self.lons[found])
+        order = numpy.argsort(distances, kind="stable")[:k]
+        return [(int(found[index]), float(distances[index])) for index in order]
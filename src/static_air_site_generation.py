@@ -1,60 +1,155 @@
 """
-A module to process raw CSV Mott MacDonald supplied site data.
+A module to process raw CSV Mott MacDonald supplied site data into the
+site metadata served by the API. Every site's OSGB easting and northing is
+reprojected to WGS84 in a single batched pyproj call. When the output
+already exists, only rows whose LASTUPDATED or coordinates changed are
+reprojected; the rest keep their previous latitude and longitude.
+
+Usage: python -m src.static_air_site_generation --input data/AIRQUALITY_DEFINITION.csv --output data/metadata.json
 Author: Ross Cochrane
 """
 
-import pandas as pd
+import argparse
 import json
+import os
+from zoneinfo import ZoneInfo
+import numpy
+import pandas as pd
 from pyproj import Transformer
 
 
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+DEFAULT_INPUT = os.path.join(PROJECT_DIR, "data", "AIRQUALITY_DEFINITION.csv")
+DEFAULT_OUTPUT = os.path.join(PROJECT_DIR, "data", "metadata.json")
+
+COLUMNS = ["SYSTEMCODENUMBER", "LONGDESCRIPTION", "NORTHING", "EASTING", "LASTUPDATED"]
+
+PREVIOUS_COLUMNS = ["systemCodeNumber", "previousEasting", "previousNorthing", "previousUpdated",
+                    "latitude", "longitude"]
+
+# Used for sites whose LASTUPDATED is missing
+DEFAULT_LAST_UPDATED = "2025-06-26T19:47:00.000+0000"
+
+# LASTUPDATED values are naive local times in the council's timezone
+SOURCE_TIMEZONE = ZoneInfo("Europe/London")
 
 # Initialize transformer from EPSG:27700 (OSGB) to WGS84
 transformer = Transformer.from_crs("epsg:27700", "epsg:4326", always_xy=True)
 
-# Read CSV
-df = pd.read_csv("data/AIRQUALITY_DEFINITION.csv", usecols=[
-    "SYSTEMCODENUMBER", "SHORTDESCRIPTION", "LONGDESCRIPTION",
-    "NORTHING", "EASTING", "LASTUPDATED"
-])
-
-# Drop rows with incomplete coordinates
-df = df.dropna(subset=["NORTHING", "EASTING"])
-
-# Sort and re-index system code numbers
-df = df.sort_values(by="SYSTEMCODENUMBER").reset_index(drop=True)
-
-# Generate SITE IDs
-df["systemCodeNumber"] = ["SITE{:03d}".format(i + 1) for i in range(len(df))]
-
-# Convert northing/easting to lat/lon
-def convert_coords(e, n):
-    lon, lat = transformer.transform(e, n)
-    return lat, lon
-
-fixed_timestamp = "2025-06-26T19:47:00.000+0000"
-
-json_output = []
-for _, row in df.iterrows():
-    lat, lon = convert_coords(row["EASTING"], row["NORTHING"])
-    entry = {
-        "systemCodeNumber": row["systemCodeNumber"],
-        "definitions": [
-            {
-                "longDescription": row["LONGDESCRIPTION"],
-                "point": {
-                    "easting": row["EASTING"],
-                    "northing": row["NORTHING"],
-                    "latitude": round(lat, 6),
-                    "longitude": round(lon, 6)
-                },
-                "lastUpdated": fixed_timestamp
-            }
-        ]
-    }
-    json_output.append(entry)
-
-
-# Save to JSON file
-with open("data/metadata.json", "w") as f:
-    json.dump(json_output, f, indent=2)
+
+def read_sites(csv_file: str) -> pd.DataFrame:
+    """
+    A function to read the site definitions from a CSV, dropping rows
+    without coordinates and numbering the rest SITE001, SITE002, ... in
+    SYSTEMCODENUMBER order. LASTUPDATED is read as UK local time and
+    converted to UTC; times repeated when the clocks go back are taken as
+    GMT and times skipped when they go forward are moved to the change.
+    """
+    df = pd.read_csv(csv_file, usecols=COLUMNS)
+    df = df.dropna(subset=["NORTHING", "EASTING"])
+    df = df.sort_values(by="SYSTEMCODENUMBER").reset_index(drop=True)
+    df["systemCodeNumber"] = ["SITE{:03d}".format(i + 1) for i in range(len(df))]
+
+    last_updated = pd.to_datetime(df["LASTUPDATED"], errors="coerce")
+    if last_updated.dt.tz is None:
+        last_updated = last_updated.dt.tz_localize(SOURCE_TIMEZONE, ambiguous=numpy.zeros(len(df), dtype=bool),
+                                                   nonexistent="shift_forward")
+    last_updated = last_updated.dt.tz_convert("UTC")
+    df["lastUpdated"] = (last_updated.dt.strftime("%Y-%m-%dT%H:%M:%S.%f").str[:-3] + "+0000").fillna(DEFAULT_LAST_UPDATED)
+    df["LONGDESCRIPTION"] = df["LONGDESCRIPTION"].astype(object).where(df["LONGDESCRIPTION"].notna(), None)
+    return df
+
+
+def read_previous(output: str) -> pd.DataFrame:
+    """
+    A function to read the points of an earlier metadata file, or an empty
+    frame if there is none.
+    """
+    try:
+        with open(output, "r") as file:
+            sites = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return pd.DataFrame(columns=PREVIOUS_COLUMNS)
+
+    rows = []
+    for site in sites:
+        definition = (site.get("definitions") or [{}])[0]
+        point = definition.get("point", {})
+        rows.append((site.get("systemCodeNumber"), point.get("easting"), point.get("northing"),
+                     definition.get("lastUpdated"), point.get("latitude"), point.get("longitude")))
+    return pd.DataFrame(rows, columns=PREVIOUS_COLUMNS).drop_duplicates("systemCodeNumber")
+
+
+def build_metadata(csv_file: str = DEFAULT_INPUT, output: str = DEFAULT_OUTPUT, incremental: bool = True) -> dict:
+    """
+    A function to build the metadata file from a site definition CSV.
+    With incremental set, sites whose LASTUPDATED and coordinates match
+    the existing output keep their reprojected position. Returns the number
+    of sites written and the number reprojected.
+    """
+    df = read_sites(csv_file)
+    previous = read_previous(output) if incremental else pd.DataFrame(columns=PREVIOUS_COLUMNS)
+    df = df.merge(previous, on="systemCodeNumber", how="left")
+
+    changed = ~(
+        (df["previousUpdated"] == df["lastUpdated"])
+        & (df["previousEasting"] == df["EASTING"])
+        & (df["previousNorthing"] == df["NORTHING"])
+        & df["latitude"].notna() & df["longitude"].notna()
+    )
+    # Convert all changed northing/easting pairs to lat/lon in one call
+    lon, lat = transformer.transform(df.loc[changed, "EASTING"].to_numpy(dtype=float),
+                                     df.loc[changed, "NORTHING"].to_numpy(dtype=float))
+    latitude = df["latitude"].to_numpy(dtype=float, copy=True)
+    longitude = df["longitude"].to_numpy(dtype=float, copy=True)
+    latitude[changed.to_numpy()] = lat.round(6)
+    longitude[changed.to_numpy()] = lon.round(6)
+
+    json_output = [
+        {
+            "systemCodeNumber": code,
+            "definitions": [
+                {
+                    "longDescription": description,
+                    "point": {
+                        "easting": easting,
+                        "northing": northing,
+                        "latitude": site_lat,
+                        "longitude": site_lon
+                    },
+                    "lastUpdated": last_updated
+                }
+            ]
+        }
+        for code, description, easting, northing, site_lat, site_lon, last_updated in zip(
+            df["systemCodeNumber"].tolist(), df["LONGDESCRIPTION"].tolist(), df["EASTING"].tolist(),
+            df["NORTHING"].tolist(), latitude.tolist(), longitude.tolist(), df["lastUpdated"].tolist()
+        )
+    ]
+
+    # Save to JSON file, replacing any earlier output in one step
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(f"{output}.tmp", "w") as f:
+        json.dump(json_output, f, separators=(",", ":"))
+    os.replace(f"{output}.tmp", output)
+    return {"sites": len(json_output), "reprojected": int(changed.sum())}
+
+
+def main(argv: list = None) -> None:
+    """
+    Command line entry point for the metadata builder.
+    """
+    parser = argparse.ArgumentParser(description="Build site metadata from a site definition CSV.")
+    parser.add_argument("--input", default=DEFAULT_INPUT, help="site definition CSV")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="metadata JSON file")
+    parser.add_argument("--full", action="store_true", help="reproject every site, ignoring earlier output")
+    args = parser.parse_args(argv)
+
+    result = build_metadata(args.input, args.output, incremental=not args.full)
+    print(f"Metadata for {result['sites']} sites saved to {args.output} ({result['reprojected']} reprojected)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+A module that keeps track of webhook subscriptions. Subscriptions get a
+stable ID, are deduplicated by notification URL and indexed by dataset
+type, and can optionally be persisted to a JSON file to survive restarts.
+Worker processes sharing the file see each other's changes: every change
+is made under a file lock on top of the latest saved state, and readers
+reload the file when it has been replaced.
+Author: Ross Cochrane
+"""
+
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import uuid
+from src.process_lock import file_lock
+
+
+def check_datasets(datasets) -> None:
+    """
+    A function to raise TypeError for datasets given as a single string,
+    which would otherwise be split into one dataset per character.
+    """
+    if isinstance(datasets, str):
+        raise TypeError("Datasets must be a list of dataset names, not a string.")
+
+
+class SubscriptionRegistry:
+    """
+    Subscriptions by ID with an index from dataset type to subscription IDs
+    """
+
+    def __init__(self, file_name: str = None) -> None:
+        self.file_name = file_name
+        self.subscriptions = {}
+        self.by_url = {}
+        self.by_dataset = {}
+        self.lock = threading.RLock()
+        self.file_version = None
+        self.holding_file_lock = False
+        if file_name and os.path.exists(file_name):
+            self.load()
+
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self.subscriptions)
+
+
+    @contextlib.contextmanager
+    def __changing(self):
+        """
+        Holds the registry lock, and the file lock when persisted, with the
+        latest saved subscriptions loaded, for the duration of a change.
+        """
+        with self.lock:
+            if not self.file_name or self.holding_file_lock:
+                yield
+                return
+            with file_lock(f"{self.file_name}.lock"):
+                self.holding_file_lock = True
+                try:
+                    self.refresh()
+                    yield
+                finally:
+                    self.holding_file_lock = False
+
+
+    def __index(self, subscription_id: str) -> None:
+        subscription = self.subscriptions[subscription_id]
+        self.by_url[subscription["notificationUrl"]] = subscription_id
+        for dataset in subscription["subscriptions"]:
+            self.by_dataset.setdefault(dataset, {})[subscription_id] = subscription
+
+
+    def __unindex(self, subscription_id: str) -> None:
+        subscription = self.subscriptions[subscription_id]
+        self.by_url.pop(subscription["notificationUrl"], None)
+        for dataset in subscription["subscriptions"]:
+            subscribers = self.by_dataset.get(dataset, {})
+            subscribers.pop(subscription_id, None)
+            if not subscribers:
+                self.by_dataset.pop(dataset, None)
+
+
+    def add(self, notification_url: str, datasets: list, options: dict = None) -> tuple:
+        """
+        A method to subscribe a notification URL to datasets, with optional
+        delivery options such as delta updates and compression. Subscribing a
+        URL again replaces its datasets and options and keeps its ID. Returns
+        the subscription ID and whether a new subscription was created.
+        Raises TypeError if datasets is a single string.
+        """
+        check_datasets(datasets)
+        with self.__changing():
+            subscription_id = self.by_url.get(notification_url)
+            if subscription_id is not None:
+                self.update(subscription_id, datasets=datasets, options=options or {})
+                return subscription_id, False
+
+            subscription_id = uuid.uuid4().hex
+            self.subscriptions[subscription_id] = {
+                "subscriptionId": subscription_id,
+                "notificationUrl": notification_url,
+                "subscriptions": list(dict.fromkeys(datasets)),
+                "options": dict(options or {})
+            }
+            self.__index(subscription_id)
+            self.save()
+            return subscription_id, True
+
+
+    def update(self, subscription_id: str, notification_url: str = None, datasets: list = None,
+               options: dict = None):
+        """
+        A method to change a subscription's URL, datasets and/or delivery
+        options. Returns the updated subscription, or None if the ID is
+        unknown. Raises ValueError if the new URL already belongs to another
+        subscription, and TypeError if datasets is a single string.
+        """
+        if datasets is not None:
+            check_datasets(datasets)
+        with self.__changing():
+            subscription = self.subscriptions.get(subscription_id)
+            if subscription is None:
+                return None
+            if notification_url is not None and self.by_url.get(notification_url, subscription_id) != subscription_id:
+                raise ValueError("Another subscription already uses that notificationUrl.")
+
+            self.__unindex(subscription_id)
+            if notification_url is not None:
+                subscription["notificationUrl"] = notification_url
+            if datasets is not None:
+                subscription["subscriptions"] = list(dict.fromkeys(datasets))
+            if options is not None:
+                subscription["options"] = dict(options)
+            self.__index(subscription_id)
+            self.save()
+            return dict(subscription)
+
+
+    def remove(self, subscription_id: str) -> bool:
+        """
+        A method to unsubscribe. Returns False if the ID is unknown.
+        """
+        with self.__changing():
+            if subscription_id not in self.subscriptions:
+                return False
+            self.__unindex(subscription_id)
+            del self.subscriptions[subscription_id]
+            self.save()
+            return True
+
+
+    def get(self, subscription_id: str):
+        """
+        A method to return a copy of a subscription, or None if unknown.
+        """
+        self.refresh()
+        with self.lock:
+            subscription = self.subscriptions.get(subscription_id)
+            return dict(subscription) if subscription is not None else None
+
+
+    def for_dataset(self, dataset: str) -> list:
+        """
+        A method to return the subscriptions to a dataset type.
+        """
+        self.refresh()
+        with self.lock:
+            return list(self.by_dataset.get(dataset, {}).values())
+
+
+    def refresh(self) -> None:
+        """
+        A method to reload the registry file if another process replaced it
+        since it was last loaded or saved here.
+        """
+        if not self.file_name:
+            return
+        with self.lock:
+            try:
+                stat = os.stat(self.file_name)
+            except FileNotFoundError:
+                return
+            if (stat.st_ino, stat.st_mtime_ns) != self.file_version:
+                self.load()
+
+
+    def clear(self) -> None:
+        """
+        A method to remove every subscription.
+        """
+        with self.__changing():
+            self.subscriptions.clear()
+            self.by_url.clear()
+            self.by_dataset.clear()
+            self.save()
+
+
+    def load(self) -> None:
+        """
+        A method to load the subscriptions from the registry file.
+        """
+        with self.lock:
+            try:
+                with open(self.file_name, "r") as file:
+                    stat = os.fstat(file.fileno())
+                    # Recorded even if the file is unreadable, so it is not retried until replaced
+                    self.file_version = (stat.st_ino, stat.st_mtime_ns)
+                    saved = json.load(file)
+            except (OSError, ValueError) as e:
+                logging.error(f"Failed to load subscriptions from {self.file_name}: {e}")
+                return
+
+            self.subscriptions.clear()
+            self.by_url.clear()
+            self.by_dataset.clear()
+            for subscription in saved:
+                subscription_id = subscription["subscriptionId"]
+                self.subscriptions[subscription_id] = subscription
+                self.__index(subscription_id)
+
+
+    def save(self) -> None:
+        """
+        A method to write the subscriptions to the registry file, if one is
+        configured, replacing it atomically.
+        """
+        if not self.file_name:
+            return
+        with self.lock:
+            temp_name = f"{self.file_name}.{os.getpid()}.tmp"
+            with open(temp_name, "w") as file:
+                json.dump(list(self.subscriptions.values()), file)
+            os.replace(temp_name, self.file_name)
+            stat = os.stat(self.file_name)
+            self.file_version = (stat.st_ino, stat.st_mtime_ns)
@@ -1,52 +1,321 @@
 """
 A module that handles the logic for notifying subscribed clients with live pollution data.
+Notifications are queued in per-subscriber outboxes and pushed concurrently
+over a pooled keep-alive HTTP session, so producing a tick never waits on a
+slow webhook. Subscribers can opt in to delta updates and compressed bodies.
 Author: Ross Cochrane
 """
 
 
-subscriptions = []
-
 # src/subscription_utils.py
-import requests
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
+import os
+import threading
+import time
+import numpy
+import requests
+from requests.adapters import HTTPAdapter
+from src.delivery_queue import DeliveryQueue
+from src.delivery_state import SharedDeliveryState
+from src.live_clock import STATE_DIR
+from src.push_encoding import DeltaState, choose_encoding, compress, DEFAULT_EPSILON, DEFAULT_KEYFRAME_INTERVAL
+from src.subscription_registry import SubscriptionRegistry
+
+try:
+    import orjson
+except ImportError:     # fall back to the standard library encoder
+    orjson = None
+
+
+# Maximum number of pushes in flight at once
+MAX_PUSH_WORKERS = 32
+
+# Connect and read timeouts in seconds for each push
+PUSH_TIMEOUT = (3.05, 10)
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+# One keep-alive session shared by every push, with a connection pool per host
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=MAX_PUSH_WORKERS, pool_maxsize=MAX_PUSH_WORKERS)
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+
+push_executor = ThreadPoolExecutor(max_workers=MAX_PUSH_WORKERS, thread_name_prefix="push")
+
+# Registered webhooks, shared by the worker processes through the state
+# directory, or persisted across restarts when SUBSCRIPTIONS_FILE is set
+subscriptions = SubscriptionRegistry(
+    os.environ.get("SUBSCRIPTIONS_FILE") or os.path.join(STATE_DIR, "subscriptions.json")
+)
+
+# Revivals asked of the leader and the leader's outbox statistics, shared
+# by the worker processes through the state directory
+shared_delivery = SharedDeliveryState(STATE_DIR)
+
+# What each delta subscriber has been sent, keyed by (subscription ID, notification URL)
+delta_states = {}
+
+
+def encode_json(obj) -> bytes:
+    """
+    Encodes an object to JSON bytes, using orjson when it is installed.
+    NumPy floats and arrays are handled natively by either encoder.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(",", ":"), default=encode_numpy).encode("utf-8")
+
+
+def encode_numpy(value):
+    """
+    Converts NumPy values that the standard json module cannot encode.
+    """
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    if isinstance(value, numpy.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def build_notification(subscription_type, data, action="INSERT") -> bytes:
+    """
+    Groups the data by systemCodeNumber into a UTMC-style notification and
+    encodes it once, to be shared by every subscriber's outbox.
+    """
+    grouped_data = {}
+    for entry in data:
+        site_id = entry["systemCodeNumber"]
+        dynamic_entry = {k: v for k, v in entry.items() if k != "systemCodeNumber"}
+        grouped_data.setdefault(site_id, []).append(dynamic_entry)
+
+    notification_data = [
+        {
+            "systemCodeNumber": site_id,
+            "dynamics": dynamics
+        }
+        for site_id, dynamics in grouped_data.items()
+    ]
+
+    return encode_json({
+        "subscription": subscription_type,
+        "action": action,
+        "notificationData": notification_data
+    })
+
+
+def build_payload(subscription_id: str, notifications: bytes) -> bytes:
+    """
+    Splices the per-subscriber envelope around a pre-encoded notifications list.
+    """
+    return b'{"subscriptionId":' + encode_json(subscription_id) + b',"notifications":' + notifications + b'}'
+
+
+def push_notification(subscription_id: str, notification_url: str, payload: bytes,
+                      content_encoding: str = None) -> dict:
+    """
+    Posts an encoded payload to a single subscriber, compressed with
+    content_encoding if given, and reports the outcome, size and latency.
+    """
+    started = time.perf_counter()
+    result = {"subscriptionId": subscription_id, "notificationUrl": notification_url}
+    headers = JSON_HEADERS
+    if content_encoding:
+        payload = compress(payload, content_encoding)
+        headers = {**JSON_HEADERS, "Content-Encoding": content_encoding}
+    result["bytes"] = len(payload)
+    try:
+        response = session.post(notification_url, data=payload, headers=headers, timeout=PUSH_TIMEOUT)
+        result["status"] = response.status_code
+        result["ok"] = response.ok
+    except Exception as e:
+        logging.error(f"Failed to notify {notification_url}: {e}")
+        result["status"] = None
+        result["ok"] = False
+        result["error"] = str(e)
+    result["latency"] = time.perf_counter() - started
+    logging.debug(f"Push sent to {notification_url} - Status: {result['status']} in {result['latency']:.3f}s")
+    return result
 
 
+class TickSummary:
+    """
+    The outcome of the latest tick's pushes. Each subscriber's first push
+    attempt after the tick is recorded as it completes through the delivery
+    queue, and one line is logged once every subscriber has been tried, or
+    when the next tick starts first.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.subscription_type = None
+        self.waiting = set()
+        self.pushed = 0
+        self.failed = 0
+        self.slowest = 0.0
+
+
+    def start(self, subscription_type: str, subscription_ids: list) -> None:
+        """
+        A method to begin summarising a tick queued for subscription_ids.
+        """
+        with self.lock:
+            if self.waiting:
+                self.__log()
+            self.subscription_type = subscription_type
+            self.waiting = set(subscription_ids)
+            self.pushed = self.failed = 0
+            self.slowest = 0.0
+
+
+    def record(self, subscription_id: str, result: dict) -> None:
+        """
+        A method to count a completed push, logging the summary once the
+        last subscriber of the tick has been tried.
+        """
+        with self.lock:
+            if subscription_id not in self.waiting:
+                return
+            self.waiting.discard(subscription_id)
+            self.pushed += 1
+            self.failed += 0 if result.get("ok") else 1
+            self.slowest = max(self.slowest, result.get("latency", 0.0))
+            if not self.waiting:
+                self.__log()
+
+
+    def __log(self) -> None:
+        pending = f", {len(self.waiting)} still pending" if self.waiting else ""
+        logging.info(f"Pushed {self.subscription_type} to {self.pushed} subscribers, {self.failed} failed, "
+                     f"slowest {self.slowest:.3f}s{pending}.")
+        self.waiting = set()
+
+
+tick_summary = TickSummary()
+
+
+def record_push_result(subscription_id: str, result: dict, last_sequence: int) -> None:
+    """
+    Called by the delivery queue with the result of every push attempt.
+    A delta subscriber's acknowledged values move forward on a 2xx, and a
+    failed push makes its next notification a keyframe.
+    """
+    tick_summary.record(subscription_id, result)
+    for (state_id, _), state in list(delta_states.items()):
+        if state_id != subscription_id:
+            continue
+        if result.get("ok"):
+            state.acknowledge(last_sequence)
+        else:
+            state.reset()
+
+
+def resync_subscriber(subscription_id: str) -> None:
+    """
+    Makes a delta subscriber's next notification a keyframe, after one of
+    its notifications was dropped or failed to deliver.
+    """
+    for (state_id, _), state in list(delta_states.items()):
+        if state_id == subscription_id:
+            state.reset()
+
+
+def forget_subscriber(subscription_id: str) -> None:
+    """
+    Discards a cancelled subscriber's outbox and delta state in this
+    process. The leader discards its own when it next ticks and finds the
+    subscription gone from the registry.
+    """
+    delivery_queue.remove(subscription_id)
+    for key in [key for key in list(delta_states) if key[0] == subscription_id]:
+        delta_states.pop(key, None)
+
+
+def revive_subscriber(subscription_id: str) -> bool:
+    """
+    Returns a dead-lettered subscriber to active delivery, replaying its
+    dead letters, when it subscribes again or updates its subscription.
+    The outbox in this process is revived at once and the leader is asked
+    to revive its own on its next tick. Returns whether this process's
+    outbox had been dead-lettered.
+    """
+    shared_delivery.request_revival(subscription_id)
+    return delivery_queue.revive(subscription_id)
 
 
-def notify_subscribers(subscription_type, data, action="INSERT"):
+def sync_delivery() -> None:
     """
-    Notify subscribers and creates the structure of the payload
+    Run by the leader at the start of each tick: revives the subscribers
+    other workers asked for, discards the outboxes of cancelled
+    subscriptions and publishes the outbox statistics for /delivery.
     """
-    for sub in subscriptions:
-        if subscription_type in sub["subscriptions"]:
-            # Group data by systemCodeNumber and wrap dynamics
-            grouped_data = {}
-            for entry in data:
-                site_id = entry["systemCodeNumber"]
-                dynamic_entry = {k: v for k, v in entry.items() if k != "systemCodeNumber"}
-                grouped_data.setdefault(site_id, []).append(dynamic_entry)
+    for subscription_id in shared_delivery.take_revivals():
+        delivery_queue.revive(subscription_id)
+    for outbox in delivery_queue.stats():
+        if subscriptions.get(outbox["subscriptionId"]) is None:
+            forget_subscriber(outbox["subscriptionId"])
+    shared_delivery.publish_stats(delivery_queue.stats())
 
-            # Build UTMC-style payload
-            notification_data = [
-                {
-                    "systemCodeNumber": site_id,
-                    "dynamics": dynamics
-                }
-                for site_id, dynamics in grouped_data.items()
-            ]
 
-            payload = {
-                "subscriptionId": str(subscriptions.index(sub)),
-                "notifications": [{
-                    "subscription": subscription_type,
-                    "action": action,
-                    "notificationData": notification_data
-                }]
-            }
+def delivery_stats(leader: bool) -> list:
+    """
+    Returns the state of every outbox: live from the delivery queue in the
+    leader, otherwise as the leader last published them.
+    """
+    return delivery_queue.stats() if leader else shared_delivery.read_stats()
+
+
+# Outboxes between the live simulation and the subscribers' webhooks
+delivery_queue = DeliveryQueue(push_notification, build_payload, push_executor, on_loss=resync_subscriber,
+                               on_result=record_push_result)
+
+
+def notify_subscribers(subscription_type, data, action="INSERT", subscription_ids=None):
+    """
+    Notify subscribers and creates the structure of the payload.
+    The full notification is encoded once and queued in each matching
+    subscriber's outbox; delta subscribers get their own notification of
+    just the changed fields, with action UPDATE between keyframes. Delivery
+    happens in the background. Only the given subscription_ids are notified
+    if set. Returns the ids of the subscriptions it was queued for. The
+    outcome of a tick sent to every subscriber is logged once its pushes
+    complete.
+    """
+    notification = None
+    queued = []
+    matching = [
+        sub for sub in subscriptions.for_dataset(subscription_type)
+        if subscription_ids is None or sub["subscriptionId"] in subscription_ids
+    ]
+    # Summarise scheduled ticks, starting before any push can complete
+    if matching and subscription_ids is None:
+        tick_summary.start(subscription_type, [sub["subscriptionId"] for sub in matching])
+
+    for sub in matching:
+        subscription_id = sub["subscriptionId"]
+        options = sub.get("options", {})
+        content_encoding = choose_encoding(options.get("acceptEncoding"))
 
-            try:
-                response = requests.post(sub["notificationUrl"], json=payload)
-                print(f"📡 Push sent to {sub['notificationUrl']} - Status: {response.status_code}") # debugging
-            except Exception as e:
-                logging.error(f"Failed to notify {sub['notificationUrl']}: {e}")
+        if options.get("delta"):
+            key = (subscription_id, sub["notificationUrl"])
+            state = delta_states.get(key)
+            if state is None:
+                state = delta_states.setdefault(key, DeltaState())
+            state.epsilon = options.get("epsilon", DEFAULT_EPSILON)
+            state.keyframe_interval = options.get("keyframeInterval", DEFAULT_KEYFRAME_INTERVAL)
+            # Queue under the state's lock so the outbox order matches the state
+            with state.lock:
+                entries, keyframe = state.diff(data)
+                delta = build_notification(subscription_type, entries, action if keyframe else "UPDATE")
+                state.queued(delivery_queue.enqueue(subscription_id, sub["notificationUrl"], delta, content_encoding))
+        else:
+            # Group and encode the data once, on the first matching subscriber
+            if notification is None:
+                notification = build_notification(subscription_type, data, action)
+            delivery_queue.enqueue(subscription_id, sub["notificationUrl"], notification, content_encoding)
+        queued.append(subscription_id)
 
+    return queued
@@ -1,18 +1,24 @@
 """
 Integration tests for the pollution data generator.
 
-These tests validate the structure and content of the generated JSON file
-without modifying the original production code. They ensure:
+These tests generate a dataset with the default settings into a temporary
+directory and validate the structure and content of the JSON file. They ensure:
 - Correct number of sites
 - Proper timestamp intervals
 - Expected value ranges based on busy/quiet periods
+- Reproducible output for a seed whatever the number of workers
+- Columnar output holding the same readings as the JSON
 """
 
 import unittest
 import json
 from datetime import datetime, timedelta
 import os
-from src.air_data_generation import is_busy_period  
+import tempfile
+import numpy
+from src.air_data_generation import generate, is_busy_period
+from src.columnar_format import read_store
+from src.pollution_loader import load_store
 
 class TestPollutionDataOutput(unittest.TestCase):
     """
@@ -22,12 +28,18 @@ class TestPollutionDataOutput(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """
-        Load the JSON data once for all tests.
+        Generate and load the JSON data once for all tests.
         """
-        cls.file_path = os.path.join("data", "pollution_data.json")
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.file_path = os.path.join(cls.directory.name, "pollution_data.json")
+        generate(seed=2025, output=cls.file_path, workers=1)
         with open(cls.file_path, "r") as f:
             cls.data = json.load(f)
 
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
     def test_number_of_sites(self):
         """
         Test that the dataset contains exactly 130 sites.
@@ -126,6 +138,42 @@ class TestPollutionDataOutput(unittest.TestCase):
                 else:
                     self.assertTrue(7 <= temp <= 17)
 
+    def test_parameters_and_reproducibility(self):
+        """
+        Test the site, day and interval parameters, and that a seed gives the
+        same file with one worker or several.
+        """
+        first = os.path.join(self.directory.name, "first.json")
+        second = os.path.join(self.directory.name, "second.json")
+        generate(num_sites=260, days=2, interval_minutes=30, seed=7, output=first, workers=1)
+        generate(num_sites=260, days=2, interval_minutes=30, seed=7, output=second, workers=2)
+        with open(first, "rb") as f1, open(second, "rb") as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+        with open(first, "r") as f:
+            data = json.load(f)
+        self.assertEqual(len(data), 260)
+        self.assertEqual(data[-1]["systemCodeNumber"], "SITE260")
+        self.assertEqual(len(data[0]["dynamics"]), 96)
+        self.assertEqual(data[0]["dynamics"][-1]["lastUpdated"], "2025-05-20T23:30:00.000+0000")
+
+    def test_npz_matches_json(self):
+        """
+        Test that an .npz generated with the same seed holds the same readings
+        and is much smaller than the JSON.
+        """
+        npz_path = os.path.join(self.directory.name, "pollution_data.npz")
+        generate(seed=2025, output=npz_path, workers=1)
+        from_npz = read_store(npz_path)
+        from_json, errors = load_store(self.file_path)
+        self.assertEqual(errors, [])
+        self.assertEqual(from_npz.site_codes, from_json.site_codes)
+        self.assertEqual(from_npz.measurements, from_json.measurements)
+        numpy.testing.assert_array_equal(from_npz.offsets, from_json.offsets)
+        numpy.testing.assert_array_equal(from_npz.timestamps, from_json.timestamps)
+        numpy.testing.assert_array_equal(from_npz.values, from_json.values)
+        self.assertLess(os.path.getsize(npz_path) * 10, os.path.getsize(self.file_path))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""
+Unit tests for the benchmark runner.
+"""
+import unittest
+
+from benchmarks.run_benchmarks import NUMBERS, compare, format_seconds, run_scale
+
+
+class TestBenchmarks(unittest.TestCase):
+    """
+    Test suite for timing the hot paths and flagging regressions.
+    """
+
+    def test_run_scale_times_every_benchmark(self):
+        """
+        Test a single quick run at a handful of sites, pushing through the stub webhook.
+        """
+        results = run_scale(5, hours=0.5, repeat=1, numbers={name: 1 for name in NUMBERS})
+        self.assertEqual(set(results), set(NUMBERS))
+        for timing in results.values():
+            self.assertGreater(timing["best"], 0)
+            self.assertEqual(timing["best"], timing["median"])
+
+    def test_compare_flags_slowdowns_beyond_threshold(self):
+        """
+        Test that only benchmarks slower than the baseline by more than the threshold are flagged.
+        """
+        baseline = {"results": {"130": {"load_store": {"best": 0.010}, "get_pollution_data": {"best": 1e-5}}}}
+        results = {
+            "130": {"load_store": {"best": 0.0124}, "get_pollution_data": {"best": 2e-5},
+                    "notify_subscribers": {"best": 1.0}},
+            "1000": {"load_store": {"best": 1.0}}
+        }
+        self.assertEqual(compare(results, baseline, threshold=0.25), [("130", "get_pollution_data", 1e-5, 2e-5)])
+        self.assertEqual(len(compare(results, baseline, threshold=0.2)), 2)
+
+    def test_format_seconds(self):
+        self.assertEqual(format_seconds(2.5), "2.5 s")
+        self.assertEqual(format_seconds(0.0123), "12.3 ms")
+        self.assertEqual(format_seconds(4e-6), "4 us")
+
+
+if __name__ == "__main__":
+    unittest.main()
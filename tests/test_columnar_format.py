@@ -0,0 +1,128 @@
+"""
+Unit tests for the columnar NPZ and Parquet data files.
+"""
+import os
+import tempfile
+import unittest
+import zipfile
+from datetime import datetime, timezone
+
+import numpy
+
+from src import columnar_format
+from src.pollution_store import PollutionStore
+from src.pseudo_air_pollution_data import PollutionData
+
+
+class TestColumnarFormat(unittest.TestCase):
+    """
+    Test suite for writing, detecting and projecting columnar files.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory and a small store.
+        """
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = PollutionStore.from_sites([
+            {"systemCodeNumber": "SITE001", "dynamics": [
+                {"co": 0.17, "no2": 20.5, "rh": 50, "lastUpdated": datetime(2025, 5, 19, 0, 0, tzinfo=timezone.utc)},
+                {"co": 0.5, "no2": 30.0, "rh": 60, "lastUpdated": datetime(2025, 5, 19, 0, 10, tzinfo=timezone.utc)}
+            ]},
+            {"systemCodeNumber": "SITE002", "dynamics": [
+                {"co": 1.5, "no2": 40.0, "rh": 70, "lastUpdated": datetime(2025, 5, 19, 0, 0, tzinfo=timezone.utc)}
+            ]}
+        ])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def assert_same_store(self, read, columns):
+        """
+        Assert a store read back matches the original in the given columns.
+        """
+        indices = [self.store.measurements.index(measurement) for measurement in columns]
+        self.assertEqual(read.site_codes, self.store.site_codes)
+        self.assertEqual(read.measurements, tuple(columns))
+        numpy.testing.assert_array_equal(read.offsets, self.store.offsets)
+        numpy.testing.assert_array_equal(read.timestamps, self.store.timestamps)
+        numpy.testing.assert_array_equal(read.values, self.store.values[:, indices])
+
+    def test_npz_round_trip_and_projection(self):
+        """
+        Test that an .npz holds the store and can be read a few columns at a time.
+        """
+        file_name = os.path.join(self.temp_dir.name, "pollution_data.npz")
+        columnar_format.write_store(self.store, file_name)
+        self.assertEqual(columnar_format.detect_format(file_name), "npz")
+        self.assert_same_store(columnar_format.read_store(file_name), self.store.measurements)
+        self.assert_same_store(columnar_format.read_store(file_name, ["no2", "co"]), ("no2", "co"))
+        with self.assertRaises(ValueError):
+            columnar_format.read_store(file_name, ["ozone"])
+
+    def test_chunked_npz_writes(self):
+        """
+        Test that sites written in several chunks read back as one store.
+        """
+        file_name = os.path.join(self.temp_dir.name, "chunks.npz")
+        writer = columnar_format.NpzWriter(file_name, self.store.measurements)
+        for position in range(len(self.store.site_codes)):
+            start, end = self.store.offsets[position], self.store.offsets[position + 1]
+            writer.write_sites([self.store.site_codes[position]], [end - start],
+                               self.store.timestamps[start:end], self.store.values[start:end])
+        writer.close()
+        self.assert_same_store(columnar_format.read_store(file_name), self.store.measurements)
+        self.assertEqual(os.listdir(self.temp_dir.name), ["chunks.npz"])
+
+    def test_npz_compression_can_be_turned_off(self):
+        """
+        Test that .npz members are deflated by default and stored when asked.
+        """
+        for compress, expected in ((True, zipfile.ZIP_DEFLATED), (False, zipfile.ZIP_STORED)):
+            file_name = os.path.join(self.temp_dir.name, f"compress_{compress}.npz")
+            columnar_format.write_store(self.store, file_name, compress=compress)
+            with zipfile.ZipFile(file_name) as archive:
+                self.assertEqual({member.compress_type for member in archive.infolist()}, {expected})
+            self.assert_same_store(columnar_format.read_store(file_name), self.store.measurements)
+
+    @unittest.skipIf(columnar_format.pyarrow is None, "pyarrow is not installed")
+    def test_parquet_round_trip_and_projection(self):
+        """
+        Test that a Parquet file holds the store and can be read a few columns at a time.
+        """
+        file_name = os.path.join(self.temp_dir.name, "pollution_data.parquet")
+        columnar_format.write_store(self.store, file_name)
+        self.assertEqual(columnar_format.detect_format(file_name), "parquet")
+        self.assert_same_store(columnar_format.read_store(file_name), self.store.measurements)
+        self.assert_same_store(columnar_format.read_store(file_name, ["rh"]), ("rh",))
+
+    def test_detect_format(self):
+        """
+        Test detection from the first bytes, whatever the extension.
+        """
+        file_name = os.path.join(self.temp_dir.name, "pollution_data.dat")
+        with open(file_name, "w") as file:
+            file.write("[]")
+        self.assertEqual(columnar_format.detect_format(file_name), "json")
+        columnar_format.write_store(self.store, file_name, "npz")
+        self.assertEqual(columnar_format.detect_format(file_name), "npz")
+        self.assertEqual(columnar_format.detect_format("missing.parquet"), "parquet")
+
+    def test_pollution_data_loads_projected_npz(self):
+        """
+        Test that PollutionData loads only the configured measurements from an .npz.
+        """
+        file_name = os.path.join(self.temp_dir.name, "pollution_data.npz")
+        columnar_format.write_store(self.store, file_name)
+        data = PollutionData(cache_dir="", data_file=file_name, measurements=["no2"])
+        self.assertTrue(data.load())
+        self.assertEqual(data.data.measurements, ("no2",))
+        self.assertEqual(
+            data.get_pollution_data(datetime(2025, 5, 19, 0, 5, 0, tzinfo=timezone.utc), "SITE001")[0]["no2"],
+            25.25
+        )
+        self.assertFalse(PollutionData(cache_dir="", data_file=file_name, measurements=["ozone"]).load())
+
+
+if __name__ == "__main__":
+    unittest.main()
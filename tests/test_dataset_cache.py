@@ -0,0 +1,121 @@
+"""
+Unit tests for the binary dataset cache.
+"""
+import mmap
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timezone
+
+import numpy
+
+from src import dataset_cache
+from src.pollution_store import PollutionStore
+
+
+class TestDatasetCache(unittest.TestCase):
+    """
+    Test suite for cache keys, round trips and load_or_build.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary source file, cache directory and a small store.
+        """
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_file = os.path.join(self.temp_dir.name, "pollution_data.json")
+        with open(self.source_file, "w") as file:
+            file.write("[]")
+        self.cache_dir = os.path.join(self.temp_dir.name, "cache")
+        self.store = PollutionStore.from_sites([
+            {"systemCodeNumber": "SITE001", "dynamics": [
+                {"co": 0.17, "rh": 50, "lastUpdated": datetime(2025, 5, 19, 0, 0, tzinfo=timezone.utc)},
+                {"co": 0.5, "rh": 60, "lastUpdated": datetime(2025, 5, 19, 0, 10, tzinfo=timezone.utc)}
+            ]}
+        ]).interpolate(10)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_key_depends_on_contents_and_settings(self):
+        """
+        Test that the key changes with the settings and the file contents.
+        """
+        key = dataset_cache.cache_key([self.source_file], {"interpolation_step": 10})
+        self.assertEqual(key, dataset_cache.cache_key([self.source_file], {"interpolation_step": 10}))
+        self.assertNotEqual(key, dataset_cache.cache_key([self.source_file], {"interpolation_step": 5}))
+        with open(self.source_file, "w") as file:
+            file.write("[ ]")
+        self.assertNotEqual(key, dataset_cache.cache_key([self.source_file], {"interpolation_step": 10}))
+
+    def test_round_trip_is_memory_mapped(self):
+        """
+        Test that a saved store loads back identical, with read-only mapped arrays.
+        """
+        directory = os.path.join(self.cache_dir, "entry")
+        dataset_cache.save_store(self.store, directory)
+        loaded = dataset_cache.load_store(directory)
+
+        self.assertEqual(loaded.site_codes, self.store.site_codes)
+        self.assertEqual(loaded.measurements, self.store.measurements)
+        numpy.testing.assert_array_equal(loaded.timestamps, self.store.timestamps)
+        numpy.testing.assert_array_equal(loaded.values, self.store.values)
+        self.assertFalse(loaded.values.flags.writeable)
+        self.assertEqual(loaded.nearest_reading(0, self.store.timestamps[3])[0], self.store.timestamps[3])
+
+    def test_load_or_build_builds_once(self):
+        """
+        Test that a warm start uses the cache instead of building again,
+        and that a failed build is not cached.
+        """
+        builds = []
+
+        def build():
+            builds.append(1)
+            return self.store
+
+        settings = {"interpolation_step": 10}
+        self.assertIsNone(dataset_cache.load_or_build(self.source_file, settings, lambda: None, self.cache_dir))
+        first = dataset_cache.load_or_build(self.source_file, settings, build, self.cache_dir)
+        second = dataset_cache.load_or_build(self.source_file, settings, build, self.cache_dir)
+        self.assertEqual(len(builds), 1)
+        numpy.testing.assert_array_equal(first.values, second.values)
+        entries = [name for name in os.listdir(self.cache_dir) if os.path.isdir(os.path.join(self.cache_dir, name))]
+        self.assertEqual(len(entries), 1)
+
+    def test_concurrent_loads_share_one_build(self):
+        """
+        Test that loads racing on a cold cache build once and all map the
+        same published arrays rather than holding private copies.
+        """
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.2)
+            return self.store
+
+        stores = []
+        threads = [
+            threading.Thread(target=lambda: stores.append(dataset_cache.load_or_build(
+                self.source_file, {"interpolation_step": 10}, build, self.cache_dir)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(len(stores), 4)
+        for store in stores:
+            base = store.values
+            while base is not None and not isinstance(base, mmap.mmap):
+                base = base.base
+            self.assertIsInstance(base, mmap.mmap)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+Unit tests for the per-subscriber delivery queue against a local stub webhook server.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+import unittest
+
+import requests
+
+from src.delivery_queue import DeliveryQueue, DEAD
+
+
+class StubWebhook(BaseHTTPRequestHandler):
+    """
+    Records each POST body; /slow answers after a delay, /fail returns 503
+    and /flaky returns 503 while down is set.
+    """
+    received = []
+    down = False
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        StubWebhook.received.append((self.path, json.loads(body)))
+        if self.path == "/slow":
+            time.sleep(0.3)
+        failing = self.path == "/fail" or (self.path == "/flaky" and StubWebhook.down)
+        self.send_response(503 if failing else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def post(subscription_id: str, notification_url: str, payload: bytes, content_encoding: str = None) -> dict:
+    """
+    Minimal push used by the queue under test.
+    """
+    response = requests.post(notification_url, data=payload, timeout=5)
+    return {"ok": response.ok, "status": response.status_code}
+
+
+def build_payload(subscription_id: str, notifications: bytes) -> bytes:
+    return b'{"subscriptionId":"' + subscription_id.encode() + b'","notifications":' + notifications + b'}'
+
+
+class TestDeliveryQueue(unittest.TestCase):
+    """
+    Test suite for retry, dead-lettering, coalescing and bounded outboxes.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Start the stub webhook server on a free local port.
+        """
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubWebhook)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubWebhook.received.clear()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.queue = DeliveryQueue(post, build_payload, self.executor, max_pending=5, max_batch=10,
+                                   max_failures=3, base_backoff=0.05, max_backoff=0.2)
+
+    def tearDown(self):
+        self.queue.stop()
+        self.executor.shutdown()
+
+    def test_lagging_subscriber_gets_coalesced_batch(self):
+        """
+        Test that ticks queued during a slow push arrive together in the next POST.
+        """
+        self.queue.enqueue("1", f"{self.base_url}/slow", b'{"tick":0}')
+        time.sleep(0.1)
+        for tick in range(1, 4):
+            self.queue.enqueue("1", f"{self.base_url}/slow", b'{"tick":%d}' % tick)
+        self.assertTrue(self.queue.flush(timeout=5))
+
+        batches = [[item["tick"] for item in payload["notifications"]] for _, payload in StubWebhook.received]
+        self.assertEqual(batches, [[0], [1, 2, 3]])
+        self.assertEqual(self.queue.stats()[0]["delivered"], 4)
+
+    def test_failures_back_off_then_dead_letter(self):
+        """
+        Test that a failing subscriber is retried then moved to the dead-letter state.
+        """
+        self.queue.enqueue("2", f"{self.base_url}/fail", b'{"tick":0}')
+        deadline = time.monotonic() + 5
+        while self.queue.stats()[0]["state"] != DEAD and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+        stats = self.queue.stats()[0]
+        self.assertEqual(stats["state"], DEAD)
+        self.assertEqual(len(StubWebhook.received), 3)
+        self.assertEqual(stats["deadLetters"], 1)
+        self.assertEqual(stats["pending"], 0)
+
+    def test_revived_subscriber_gets_dead_letters(self):
+        """
+        Test that a subscriber dead-lettered during an outage is delivered
+        its backlog once revived.
+        """
+        StubWebhook.down = True
+        self.addCleanup(setattr, StubWebhook, "down", False)
+        self.queue.enqueue("4", f"{self.base_url}/flaky", b'{"tick":0}')
+        deadline = time.monotonic() + 5
+        while self.queue.stats()[0]["state"] != DEAD and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.queue.enqueue("4", f"{self.base_url}/flaky", b'{"tick":1}')
+        self.assertEqual(self.queue.stats()[0]["deadLetters"], 2)
+
+        StubWebhook.down = False
+        self.assertTrue(self.queue.revive("4"))
+        self.assertFalse(self.queue.revive("4"))
+        self.assertTrue(self.queue.flush(timeout=5))
+        stats = self.queue.stats()[0]
+        self.assertEqual((stats["state"], stats["delivered"], stats["deadLetters"]), ("active", 2, 0))
+        self.assertEqual([item["tick"] for item in StubWebhook.received[-1][1]["notifications"]], [0, 1])
+
+    def test_outbox_is_bounded(self):
+        """
+        Test that an outbox keeps only the newest notifications when full
+        and reports each dropped one.
+        """
+        lost = []
+        self.queue.on_loss = lost.append
+        self.queue.stop()
+        self.queue.start = lambda: None
+        for tick in range(8):
+            self.queue.enqueue("3", f"{self.base_url}/ok", b'{"tick":%d}' % tick)
+        stats = self.queue.stats()[0]
+        self.assertEqual(stats["pending"], 5)
+        self.assertEqual(stats["dropped"], 3)
+        self.assertEqual(lost, ["3", "3", "3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
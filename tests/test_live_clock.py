@@ -0,0 +1,81 @@
+"""
+Unit tests for the shared simulation clock and leader election.
+"""
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timezone
+
+from src.live_clock import SimulationClock
+from src.process_lock import LeaderLock
+
+
+START = datetime(2025, 5, 19, 0, 0, 0, tzinfo=timezone.utc)
+
+
+class TestSimulationClock(unittest.TestCase):
+    """
+    Test suite for a clock shared through a state file.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.directory.name, "simulation_clock.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_clocks_share_state(self):
+        """
+        Test that a time set through one clock is read through another.
+        """
+        first = SimulationClock(self.state_file, START)
+        second = SimulationClock(self.state_file, START)
+        self.assertEqual(second.get(), START)
+
+        first.set(datetime(2025, 5, 19, 18, 30, tzinfo=timezone.utc))
+        self.assertEqual(second.get(), datetime(2025, 5, 19, 18, 30, tzinfo=timezone.utc))
+        self.assertEqual(second.advance(60), datetime(2025, 5, 19, 18, 30, tzinfo=timezone.utc))
+        self.assertEqual(first.get(), datetime(2025, 5, 19, 18, 31, tzinfo=timezone.utc))
+
+    def test_concurrent_advances_are_not_lost(self):
+        """
+        Test that advances from many clocks at once all take effect.
+        """
+        clocks = [SimulationClock(self.state_file, START) for _ in range(4)]
+        threads = [
+            threading.Thread(target=lambda clock=clock: [clock.advance(60) for _ in range(10)])
+            for clock in clocks
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((clocks[0].get() - START).total_seconds(), 40 * 60)
+
+
+class TestLeaderLock(unittest.TestCase):
+    """
+    Test suite for electing a single leader.
+    """
+
+    def test_single_leader_until_released(self):
+        """
+        Test that only one holder leads and another takes over once it steps down.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            lock_file = os.path.join(directory, "leader.lock")
+            first, second = LeaderLock(lock_file), LeaderLock(lock_file)
+            self.assertTrue(first.is_leader())
+            self.assertTrue(first.is_leader())
+            self.assertFalse(second.is_leader())
+
+            first.release()
+            self.assertTrue(second.is_leader())
+            self.assertFalse(first.is_leader())
+            second.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+Unit tests for the streaming pollution data loader.
+"""
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import numpy
+
+from src import pollution_loader
+from src.pollution_loader import iter_sites, load_store, parse_timestamps
+
+
+SITES = [
+    {"systemCodeNumber": "SITE001", "dynamics": [
+        {"co": 0.5, "rh": 61.7, "lastUpdated": "2025-05-19T00:10:00.000+0000"},
+        {"co": 0.17, "no": "6.95", "rh": 60, "lastUpdated": "2025-05-19T00:00:00.000+0000"}
+    ]},
+    {"systemCodeNumber": "SITE002", "dynamics": [
+        {"co": "bad", "no": 1.0, "lastUpdated": "2025-05-19T01:30:00.000+0130"},
+        {"co": 0.2, "no": 2.0, "lastUpdated": "not a time"},
+        {"co": 0.3, "no": 3.0}
+    ]},
+    {"systemCodeNumber": "SITE003", "dynamics": []}
+]
+
+
+class TestPollutionLoader(unittest.TestCase):
+    """
+    Test suite for streaming, bulk conversion and error reporting.
+    """
+
+    def setUp(self):
+        """
+        Write the sample sites to a temporary file.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "pollution_data.json")
+        with open(self.file_name, "w") as file:
+            json.dump(SITES, file, indent=4)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_iter_sites_streams_in_small_blocks(self):
+        """
+        Test that sites split across many small reads decode the same as json.load.
+        """
+        self.assertEqual(list(iter_sites(self.file_name, read_size=7)), SITES)
+        with open(self.file_name, "w") as file:
+            file.write(" [ ] ")
+        self.assertEqual(list(iter_sites(self.file_name)), [])
+        with open(self.file_name, "w") as file:
+            file.write('[{"systemCodeNumber": "SITE001"}')
+        with self.assertRaises(ValueError):
+            list(iter_sites(self.file_name))
+
+    def test_parse_timestamps(self):
+        """
+        Test the vectorized path against strptime, including offsets and the fallback.
+        """
+        texts = ["2025-05-19T00:00:00.000+0000", "2025-05-19T01:30:00.999-0130", "2025-05-19T00:00:00.5+00:00"]
+        expected = [int(datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()) for text in texts]
+        epochs, parsed = parse_timestamps(texts[:2])
+        self.assertEqual(epochs.tolist(), expected[:2])
+        epochs, parsed = parse_timestamps(texts + [None])
+        self.assertEqual(epochs[:3].tolist(), expected)
+        self.assertEqual(parsed.tolist(), [True, True, True, False])
+
+    def test_load_store(self):
+        """
+        Test that readings are sorted, converted and failures reported per site and field.
+        """
+        store, errors = load_store(self.file_name)
+        self.assertEqual(store.site_codes, ["SITE001", "SITE002", "SITE003"])
+        self.assertEqual(store.offsets.tolist(), [0, 2, 3, 3])
+
+        columns = {measurement: index for index, measurement in enumerate(store.measurements)}
+        self.assertEqual(store.timestamps[0], int(datetime.fromisoformat("2025-05-19T00:00:00+00:00").timestamp()))
+        self.assertAlmostEqual(float(store.values[0, columns["no"]]), 6.95, places=5)
+        self.assertEqual(float(store.values[1, columns["rh"]]), 61.0)
+        self.assertTrue(numpy.isnan(store.values[0, columns["battery"]]))
+        self.assertTrue(numpy.isnan(store.values[2, columns["co"]]))
+
+        self.assertEqual(
+            sorted((error["systemCodeNumber"], error["field"], error["count"]) for error in errors),
+            [("SITE002", "co", 1), ("SITE002", "lastUpdated", 2)]
+        )
+
+    def test_load_store_grows_undersized_arrays(self):
+        """
+        Test that arrays sized below the readings grow in place and are trimmed to fit.
+        """
+        expected, _ = load_store(self.file_name)
+        self.assertEqual(len(expected.timestamps), 3)
+        with mock.patch.object(pollution_loader, "BYTES_PER_READING", 1 << 30):
+            store, _ = load_store(self.file_name)
+        self.assertEqual(store.offsets.tolist(), expected.offsets.tolist())
+        self.assertEqual(store.timestamps.tolist(), expected.timestamps.tolist())
+        numpy.testing.assert_array_equal(store.values, expected.values)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,281 @@
+"""
+Unit tests for the columnar PollutionStore.
+"""
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import numpy
+
+from src.pollution_store import PollutionStore, LazyPollutionStore
+
+
+def make_dynamic(minute: int, co: float) -> dict:
+    """
+    Helper to build a single dynamics entry at the given minute past midnight.
+    """
+    return {
+        "co": co,
+        "no": 1.0,
+        "no2": 2.0,
+        "rh": 55,
+        "temperature": 8.5,
+        "noise": 40.0,
+        "battery": 3.7,
+        "lastUpdated": datetime(2025, 5, 19, 0, minute, 0, tzinfo=timezone.utc)
+    }
+
+
+class TestPollutionStore(unittest.TestCase):
+    """
+    Test suite for building and querying the columnar store.
+    """
+
+    def setUp(self):
+        """
+        Build a store with two sites, the second given out of order.
+        """
+        self.store = PollutionStore.from_sites([
+            {"systemCodeNumber": "SITE001", "dynamics": [make_dynamic(0, 0.17), make_dynamic(10, 0.5)]},
+            {"systemCodeNumber": "SITE002", "dynamics": [make_dynamic(10, 1.5), make_dynamic(0, 1.0)]},
+        ])
+
+    def test_layout(self):
+        """
+        Test that readings are stored as compact typed arrays with site offsets.
+        """
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(self.store.timestamps.dtype, numpy.int64)
+        self.assertEqual(self.store.values.dtype, numpy.float32)
+        self.assertEqual(self.store.offsets.tolist(), [0, 2, 4])
+
+    def test_readings_sorted_per_site(self):
+        """
+        Test that each site's readings are sorted by timestamp.
+        """
+        start, end = self.store.site_bounds(1)
+        self.assertTrue(numpy.all(numpy.diff(self.store.timestamps[start:end]) > 0))
+
+    def test_nearest_row_and_dict(self):
+        """
+        Test that the closest reading is found and converted to a dictionary.
+        """
+        position = self.store.site_position("SITE002")
+        epoch = datetime(2025, 5, 19, 0, 8, 0, tzinfo=timezone.utc).timestamp()
+        entry = self.store.row_to_dict(self.store.nearest_row(position, epoch))
+        self.assertEqual(entry["co"], 1.5)
+        self.assertEqual(entry["lastUpdated"], datetime(2025, 5, 19, 0, 10, 0, tzinfo=timezone.utc))
+
+    def test_float32_values_round_trip(self):
+        """
+        Test that float32 values are returned without float32 noise.
+        """
+        entry = self.store.row_to_dict(0)
+        self.assertEqual(entry["co"], 0.17)
+
+    def test_nearest_row_ties_and_bounds(self):
+        """
+        Test that ties pick the earlier reading and out of range times clamp.
+        """
+        position = self.store.site_position("SITE001")
+        midpoint = datetime(2025, 5, 19, 0, 5, 0, tzinfo=timezone.utc).timestamp()
+        self.assertEqual(self.store.nearest_row(position, midpoint), 0)
+        self.assertEqual(self.store.nearest_row(position, 0), 0)
+        self.assertEqual(self.store.nearest_row(position, midpoint * 2), 1)
+
+    def test_nearest_readings_batch(self):
+        """
+        Test that batched lookups match single lookups and flag unknown sites.
+        """
+        epochs = [datetime(2025, 5, 19, 0, minute, 0, tzinfo=timezone.utc).timestamp() for minute in (2, 8, 30)]
+        timestamps, values, found = self.store.nearest_readings([0, 1, -1], epochs)
+        self.assertEqual(found.tolist(), [True, True, False])
+        for index in range(2):
+            expected = self.store.nearest_reading(index, epochs[index])
+            self.assertEqual(timestamps[index], expected[0])
+            self.assertEqual(values[index].tolist(), expected[1].tolist())
+
+    def test_unknown_site(self):
+        """
+        Test that an unknown site has no position.
+        """
+        self.assertIsNone(self.store.site_position("SITE999"))
+
+
+class TestInterpolation(unittest.TestCase):
+    """
+    Test suite for the vectorized interpolation onto a regular time grid.
+    """
+
+    def setUp(self):
+        """
+        Build a raw store with readings 10 minutes apart and an empty site.
+        """
+        self.raw = PollutionStore.from_sites([
+            {"systemCodeNumber": "SITE001", "dynamics": [make_dynamic(0, 0.0), make_dynamic(10, 6.0), make_dynamic(20, 0.0)]},
+            {"systemCodeNumber": "SITE002", "dynamics": []},
+            {"systemCodeNumber": "SITE003", "dynamics": [make_dynamic(0, 1.0), make_dynamic(10, 2.0)]},
+        ])
+
+    def test_grid_spacing_and_endpoint(self):
+        """
+        Test that the grid is evenly spaced and the final reading appears once.
+        """
+        grid = self.raw.interpolate(10)
+        start, end = grid.site_bounds(0)
+        timestamps = grid.timestamps[start:end]
+        self.assertEqual(end - start, 20 * 6 + 1)
+        self.assertTrue(numpy.all(numpy.diff(timestamps) == 10))
+        self.assertEqual(grid.site_bounds(1), (end, end))
+        self.assertEqual(grid.offsets[-1], len(grid.timestamps))
+
+    def test_interpolated_values(self):
+        """
+        Test that values are linearly interpolated between readings.
+        """
+        grid = self.raw.interpolate(60)
+        start, end = grid.site_bounds(0)
+        co = grid.values[start:end, 0]
+        self.assertAlmostEqual(float(co[5]), 3.0, places=5)
+        self.assertAlmostEqual(float(co[10]), 6.0, places=5)
+        self.assertAlmostEqual(float(co[-1]), 0.0, places=5)
+
+    def test_step_not_dividing_interval(self):
+        """
+        Test that a step which does not divide the interval still hits every reading.
+        """
+        grid = self.raw.interpolate(420)
+        start, end = grid.site_bounds(2)
+        self.assertEqual((grid.timestamps[start:end] - grid.timestamps[start]).tolist(), [0, 420, 600])
+
+    def test_chunked_matches_single_pass(self):
+        """
+        Test that interpolating a few sites at a time gives the same grid as one pass.
+        """
+        whole = self.raw.interpolate(10)
+        with patch("src.pollution_store.INTERPOLATION_CHUNK_POINTS", 5):
+            chunked = self.raw.interpolate(10)
+        numpy.testing.assert_array_equal(chunked.offsets, whole.offsets)
+        numpy.testing.assert_array_equal(chunked.timestamps, whole.timestamps)
+        numpy.testing.assert_array_equal(chunked.values, whole.values)
+        self.assertEqual(chunked.values.dtype, numpy.float32)
+
+    def test_invalid_step(self):
+        """
+        Test that a non positive step is rejected.
+        """
+        with self.assertRaises(ValueError):
+            self.raw.interpolate(0)
+
+
+class TestTickCursor(unittest.TestCase):
+    """
+    Test suite for stepping the live simulation clock through the store.
+    """
+
+    def setUp(self):
+        """
+        Build a 10 second grid for two sites and one site without readings.
+        """
+        self.grid = PollutionStore.from_sites([
+            {"systemCodeNumber": "SITE001", "dynamics": [make_dynamic(0, 0.0), make_dynamic(20, 2.0)]},
+            {"systemCodeNumber": "SITE002", "dynamics": [make_dynamic(10, 1.0), make_dynamic(30, 3.0)]},
+            {"systemCodeNumber": "SITE003", "dynamics": []},
+        ]).interpolate(10)
+        self.start = datetime(2025, 5, 19, 0, 0, 0, tzinfo=timezone.utc).timestamp()
+
+    def test_ticks_match_binary_search(self):
+        """
+        Test that forward ticks, jumps and rewinds agree with a fresh search.
+        """
+        cursor = self.grid.tick_cursor()
+        for offset in (0, 60, 120, 125, 1800, 600, 660, 5000, -100):
+            epoch = self.start + offset
+            timestamps, values, found = cursor.readings(epoch)
+            expected = self.grid.nearest_readings(numpy.arange(3), numpy.full(3, epoch))
+            self.assertEqual(found.tolist(), expected[2].tolist())
+            self.assertEqual(timestamps.tolist(), expected[0].tolist())
+
+    def test_snapshot_tolerance(self):
+        """
+        Test that a snapshot only holds sites with a reading within tolerance.
+        """
+        snapshot = self.grid.tick_cursor().snapshot(self.start + 5, tolerance=10)
+        self.assertEqual(snapshot["site_codes"], ["SITE001"])
+        self.assertEqual(snapshot["values"].shape, (1, 7))
+        snapshot = self.grid.tick_cursor().snapshot(self.start + 900, tolerance=10)
+        self.assertEqual(snapshot["site_codes"], ["SITE001", "SITE002"])
+
+
+class TestLazyPollutionStore(unittest.TestCase):
+    """
+    Test suite checking the lazy store agrees with the precomputed grid.
+    """
+
+    def setUp(self):
+        """
+        Build a raw store with uneven gaps between readings.
+        """
+        self.raw = PollutionStore.from_sites([
+            {"systemCodeNumber": "SITE001", "dynamics": [make_dynamic(0, 0.1), make_dynamic(7, 3.3), make_dynamic(20, 0.7)]},
+            {"systemCodeNumber": "SITE002", "dynamics": []},
+            {"systemCodeNumber": "SITE003", "dynamics": [make_dynamic(1, 1.0), make_dynamic(11, 2.9)]},
+        ])
+
+    def test_matches_precomputed(self):
+        """
+        Test that lookups across and beyond the data range match the precomputed grid.
+        """
+        for step in (10, 45, 420):
+            dense = self.raw.interpolate(step)
+            lazy = LazyPollutionStore(self.raw, step, cache_size=16)
+            start = datetime(2025, 5, 19, 0, 0, 0, tzinfo=timezone.utc).timestamp() - 100
+            for epoch in numpy.arange(start, start + 1500, 2.5):
+                for position in range(len(self.raw)):
+                    expected = dense.nearest_reading(position, epoch)
+                    actual = lazy.nearest_reading(position, epoch)
+                    if expected is None:
+                        self.assertIsNone(actual)
+                        continue
+                    self.assertEqual(expected[0], actual[0])
+                    self.assertEqual(expected[1].tolist(), actual[1].tolist())
+
+    def test_range_matches_precomputed(self):
+        """
+        Test that strided range reads agree between the lazy and precomputed stores.
+        """
+        dense = self.raw.interpolate(45)
+        lazy = LazyPollutionStore(self.raw, 45)
+        start = datetime(2025, 5, 19, 0, 3, 0, tzinfo=timezone.utc).timestamp()
+        for store in (dense, lazy):
+            chunks = list(store.iter_range(0, start, start + 900, stride=4, chunk_size=3))
+            self.assertTrue(all(len(times) <= 3 for times, _ in chunks))
+        expected = numpy.concatenate([times for times, _ in dense.iter_range(0, start, start + 900, 4)])
+        actual = numpy.concatenate([times for times, _ in lazy.iter_range(0, start, start + 900, 4)])
+        self.assertEqual(expected.tolist(), actual.tolist())
+
+    def test_holds_raw_store_without_row_lookups(self):
+        """
+        Test that the raw store is held rather than extended, so row lookups,
+        which would answer from the raw readings, are not offered.
+        """
+        lazy = LazyPollutionStore(self.raw, 10)
+        self.assertNotIsInstance(lazy, PollutionStore)
+        self.assertIs(lazy.raw, self.raw)
+        for name in ("nearest_row", "nearest_rows", "row_to_dict", "timestamps", "values"):
+            self.assertFalse(hasattr(lazy, name))
+        self.assertEqual(lazy.site_position("SITE003"), 2)
+        self.assertEqual(len(lazy), 3)
+
+    def test_cache_is_bounded(self):
+        """
+        Test that the LRU cache never holds more than its configured size.
+        """
+        lazy = LazyPollutionStore(self.raw, 10, cache_size=8)
+        for epoch in range(int(self.raw.timestamps[0]), int(self.raw.timestamps[2]), 10):
+            lazy.nearest_reading(0, epoch)
+        self.assertEqual(lazy.reading_at.cache_info().currsize, 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Unit tests for the procedural pollution store.
+"""
+import unittest
+from datetime import datetime, timezone
+
+import numpy
+
+from src.air_data_generation import DECIMALS, measurement_ranges
+from src.procedural_store import ProceduralPollutionStore
+from src.pseudo_air_pollution_data import PollutionData
+
+
+SITES = ["SITE001", "SITE002", "SITE003"]
+MORNING_RUSH = int(datetime(2031, 1, 6, 8, 0, tzinfo=timezone.utc).timestamp())
+
+
+class TestProceduralPollutionStore(unittest.TestCase):
+    """
+    Test suite for readings derived from a seeded hash.
+    """
+
+    def setUp(self):
+        self.store = ProceduralPollutionStore(SITES, step=10, seed=7)
+
+    def test_readings_are_deterministic(self):
+        """
+        Test that the same seed gives the same readings whatever the site
+        order or measurements, and another seed different ones.
+        """
+        timestamp, values = self.store.nearest_reading(1, MORNING_RUSH + 1234)
+        again = ProceduralPollutionStore(list(reversed(SITES)), step=10, seed=7)
+        self.assertEqual(again.nearest_reading(1, MORNING_RUSH + 1234)[0], timestamp)
+        numpy.testing.assert_array_equal(again.nearest_reading(1, MORNING_RUSH + 1234)[1], values)
+
+        projected = ProceduralPollutionStore(SITES, step=10, seed=7, measurements=("no2",))
+        self.assertEqual(projected.nearest_reading(1, MORNING_RUSH)[1][0],
+                         self.store.nearest_reading(1, MORNING_RUSH)[1][self.store.measurements.index("no2")])
+        other = ProceduralPollutionStore(SITES, step=10, seed=8)
+        self.assertFalse(numpy.array_equal(other.nearest_reading(1, MORNING_RUSH)[1],
+                                           self.store.nearest_reading(1, MORNING_RUSH)[1]))
+
+    def test_bucket_readings_follow_generator_rules(self):
+        """
+        Test that readings at bucket starts fall in the generator's ranges
+        for their hour, allowing for rounding.
+        """
+        epochs = MORNING_RUSH + numpy.arange(0, 24 * 3600, 600)
+        hours = (epochs // 3600) % 24
+        ranges = measurement_ranges(hours)
+        for position in range(len(SITES)):
+            _, values, found = self.store.nearest_readings(numpy.full(len(epochs), position), epochs)
+            self.assertTrue(found.all())
+            for column, measurement in enumerate(self.store.measurements):
+                low, high = ranges[measurement]
+                tolerance = 0.5 * 10 ** -DECIMALS[measurement] + 1e-4
+                self.assertTrue(numpy.all(values[:, column] >= low - tolerance), measurement)
+                self.assertTrue(numpy.all(values[:, column] <= high + tolerance), measurement)
+
+    def test_interpolates_between_buckets(self):
+        """
+        Test that grid points between buckets are linearly interpolated and
+        lookups snap to the nearest grid point.
+        """
+        start = self.store.nearest_reading(0, MORNING_RUSH)[1]
+        end = self.store.nearest_reading(0, MORNING_RUSH + 600)[1]
+        timestamp, middle = self.store.nearest_reading(0, MORNING_RUSH + 304)
+        self.assertEqual(timestamp, MORNING_RUSH + 300)
+        numpy.testing.assert_allclose(middle, (start + end) / 2, rtol=1e-5)
+        self.assertEqual(self.store.nearest_reading(0, MORNING_RUSH + 5)[0], MORNING_RUSH)
+        self.assertEqual(self.store.nearest_reading(0, MORNING_RUSH + 6)[0], MORNING_RUSH + 10)
+
+    def test_range_and_unknown_sites(self):
+        """
+        Test range chunks with a stride, and that unknown positions find nothing.
+        """
+        chunks = list(self.store.iter_range(2, MORNING_RUSH - 5, MORNING_RUSH + 100, stride=3, chunk_size=2))
+        timestamps = numpy.concatenate([chunk[0] for chunk in chunks])
+        self.assertEqual(timestamps.tolist(), [MORNING_RUSH + offset for offset in (0, 30, 60, 90)])
+        numpy.testing.assert_array_equal(chunks[0][1][1], self.store.nearest_reading(2, MORNING_RUSH + 30)[1])
+
+        _, values, found = self.store.nearest_readings([0, -1, 3], [MORNING_RUSH] * 3)
+        self.assertEqual(found.tolist(), [True, False, False])
+        self.assertTrue(numpy.isnan(values[1]).all())
+        self.assertFalse(hasattr(self.store, "nearest_row"))
+
+    def test_pollution_data_procedural_mode(self):
+        """
+        Test that PollutionData serves the metadata's sites at any time without a data file.
+        """
+        data = PollutionData(mode="procedural", data_file="missing.json")
+        self.assertTrue(data.load())
+        self.assertEqual(len(data.data.site_codes), len(data.site_metadata_cache))
+        readings = data.get_pollution_data(datetime(2040, 1, 1, 12, 0, 3, tzinfo=timezone.utc), "SITE001")
+        self.assertEqual(readings[0]["lastUpdated"], datetime(2040, 1, 1, 12, 0, 0, tzinfo=timezone.utc))
+        snapshot = data.get_live_snapshot(datetime(2040, 1, 1, 12, 0, 3, tzinfo=timezone.utc))
+        self.assertEqual(len(snapshot["site_codes"]), len(data.site_metadata_cache))
+        self.assertFalse(PollutionData(mode="procedural", measurements=["ozone"]).load())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,9 @@
 """
-Unit tests for core functionality in air_data_generation.py that do not require numpy.
+Unit tests for core functionality in air_data_generation.py.
 """
 import sys
 import types
 
-# Patch numpy (Generated using AI)
-sys.modules['numpy'] = types.SimpleNamespace(interp=lambda *args, **kwargs: 0)
-
 # Patch apscheduler with a dummy scheduler class (Generated using AI)
 class DummyScheduler:
     def add_job(self, *args, **kwargs):
@@ -29,6 +26,7 @@ from datetime import datetime, timezone
 import json
 
 from src.pseudo_air_pollution_data import load_json, PollutionData
+from src.pollution_store import PollutionStore
 
 
 class TestLoadJson(unittest.TestCase):
@@ -86,7 +84,7 @@ class TestPollutionData(unittest.TestCase):
         Set up a PollutionData instance with mock data.
         """
         self.pollution_data = PollutionData()
-        self.pollution_data.data = [
+        self.pollution_data.data = PollutionStore.from_sites([
             {
                 "systemCodeNumber": "SITE001",
                 "dynamics": [
@@ -102,7 +100,7 @@ class TestPollutionData(unittest.TestCase):
                     }
                 ]
             }
-        ]
+        ])
         self.pollution_data.site_metadata_cache = {
             "SITE001": {"lat": 59.91, "lon": 10.75}
         }
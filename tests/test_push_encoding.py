@@ -0,0 +1,81 @@
+"""
+Unit tests for delta state tracking and payload compression.
+"""
+import gzip
+import unittest
+
+from src.push_encoding import DeltaState, choose_encoding, compress
+
+
+class TestPushEncoding(unittest.TestCase):
+    """
+    Test suite for the delta and compression helpers.
+    """
+
+    def test_choose_encoding(self):
+        """
+        Test that only codings we can produce are chosen.
+        """
+        self.assertIsNone(choose_encoding(None))
+        self.assertIsNone(choose_encoding(["br"]))
+        self.assertEqual(choose_encoding(["br", " GZIP "]), "gzip")
+        self.assertEqual(gzip.decompress(compress(b'{"a":1}', "gzip")), b'{"a":1}')
+        with self.assertRaises(ValueError):
+            compress(b"", "br")
+
+    def test_delta_tracks_last_sent_value(self):
+        """
+        Test that small steps are held back until they add up to more than epsilon.
+        """
+        state = DeltaState(epsilon=0.1, keyframe_interval=10)
+        entries, keyframe = state.diff([{"systemCodeNumber": "A", "co": 1.0}])
+        self.assertTrue(keyframe)
+        self.assertEqual(entries, [{"systemCodeNumber": "A", "co": 1.0}])
+
+        sent = []
+        for co in (1.06, 1.12, 1.18, 1.2):
+            entries, keyframe = state.diff([{"systemCodeNumber": "A", "co": co}])
+            self.assertFalse(keyframe)
+            sent.extend(entry["co"] for entry in entries)
+        self.assertEqual(sent, [1.12])
+
+    def test_acknowledged_values_follow_delivery(self):
+        """
+        Test that acknowledged values move forward only on acknowledgement,
+        and that a failure rolls back to them and forces a keyframe.
+        """
+        state = DeltaState(epsilon=0.0, keyframe_interval=100)
+        state.diff([{"systemCodeNumber": "A", "co": 1.0, "no": 2.0}])
+        state.queued(0)
+        state.diff([{"systemCodeNumber": "A", "co": 1.5, "no": 2.0}])
+        state.queued(1)
+        self.assertEqual(state.acknowledged, {})
+
+        state.acknowledge(0)
+        self.assertEqual(state.acknowledged, {"A": {"co": 1.0, "no": 2.0}})
+        state.reset()
+        self.assertEqual((state.sent, state.in_flight), ({"A": {"co": 1.0, "no": 2.0}}, []))
+        entries, keyframe = state.diff([{"systemCodeNumber": "A", "co": 1.5, "no": 2.0}])
+        self.assertTrue(keyframe)
+        self.assertEqual(entries, [{"systemCodeNumber": "A", "co": 1.5, "no": 2.0}])
+
+        state.queued(None)
+        self.assertTrue(state.needs_keyframe)
+
+    def test_new_site_and_keyframe_interval(self):
+        """
+        Test that a site seen for the first time is sent in full and that
+        every keyframe_interval-th tick is a keyframe.
+        """
+        state = DeltaState(epsilon=0.0, keyframe_interval=2)
+        state.diff([{"systemCodeNumber": "A", "co": 1.0}])
+        entries, keyframe = state.diff([{"systemCodeNumber": "A", "co": 1.0}, {"systemCodeNumber": "B", "co": 2.0, "no": 3.0}])
+        self.assertFalse(keyframe)
+        self.assertEqual(entries, [{"systemCodeNumber": "B", "co": 2.0, "no": 3.0}])
+        entries, keyframe = state.diff([{"systemCodeNumber": "A", "co": 1.0}])
+        self.assertTrue(keyframe)
+        self.assertEqual(len(entries), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+"""
+Unit tests for the encoded response cache.
+"""
+import unittest
+
+from src.response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    """
+    Test suite for LRU eviction and version invalidation.
+    """
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """
+        Test that the cache keeps at most max_entries, dropping the least recently used.
+        """
+        cache = ResponseCache(max_entries=2)
+        self.assertIsNone(cache.get("a", 1))
+        cache.put("a", 1, b"[1]")
+        cache.put("b", 1, b"[2]")
+        self.assertEqual(cache.get("a", 1)[0], b"[1]")
+        cache.put("c", 1, b"[3]")
+        self.assertIsNone(cache.get("b", 1))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_version_change_invalidates(self):
+        """
+        Test that a new data version empties the cache and stale puts are ignored.
+        """
+        cache = ResponseCache()
+        cache.get("a", 1)
+        body, etag = cache.put("a", 1, b"[1]")
+        self.assertEqual(cache.put("b", 1, b"[1]")[1], etag)
+        self.assertIsNone(cache.get("a", 2))
+        cache.put("a", 1, b"[1]")
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
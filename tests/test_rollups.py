@@ -0,0 +1,132 @@
+"""
+Unit tests for the rollup pyramid.
+"""
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+import numpy
+
+from src import columnar_format
+from src.pollution_store import PollutionStore
+from src.pseudo_air_pollution_data import PollutionData
+from src.rollups import Rollups, combine, summarise_rows
+
+
+START = int(datetime(2025, 5, 19, tzinfo=timezone.utc).timestamp())
+
+
+def brute_force(store, position, start_epoch, end_epoch):
+    """
+    Summarise a site's readings between two epochs inclusive directly.
+    """
+    site_start, site_end = store.site_bounds(position)
+    timestamps = store.timestamps[site_start:site_end]
+    inside = (timestamps >= numpy.ceil(start_epoch)) & (timestamps <= numpy.floor(end_epoch))
+    return combine([summarise_rows(store.values[site_start:site_end][inside])], len(store.measurements))
+
+
+class TestRollups(unittest.TestCase):
+    """
+    Test suite for window statistics and bucket reads.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Build two days of 10 second readings for two sites, with a gap and
+        missing values, and a site without readings.
+        """
+        rng = numpy.random.default_rng(3)
+        timestamps = numpy.arange(START, START + 2 * 86400, 10)
+        timestamps = timestamps[(timestamps < START + 30000) | (timestamps > START + 40000)]
+        values = rng.uniform(0, 100, (2 * len(timestamps), 2)).astype(numpy.float32)
+        values[rng.random(values.shape) < 0.05] = numpy.nan
+        cls.store = PollutionStore(
+            ["SITE001", "SITE002", "SITE003"],
+            [0, len(timestamps), 2 * len(timestamps), 2 * len(timestamps)],
+            numpy.concatenate([timestamps, timestamps]),
+            values,
+            ("co", "no2")
+        )
+        cls.rollups = Rollups(cls.store)
+
+    def test_statistics_match_brute_force(self):
+        """
+        Test random windows, including ones shorter than a minute and ones
+        outside the data, against a direct summary.
+        """
+        rng = numpy.random.default_rng(4)
+        for _ in range(200):
+            position = int(rng.integers(3))
+            start_epoch = START + rng.uniform(-3600, 2 * 86400)
+            end_epoch = start_epoch + rng.choice([rng.uniform(0, 59), rng.uniform(0, 2 * 86400)])
+            expected = brute_force(self.store, position, start_epoch, end_epoch)
+            counts, means, minimums, maximums = self.rollups.statistics(position, start_epoch, end_epoch)
+            numpy.testing.assert_array_equal(counts, expected[0])
+            numpy.testing.assert_allclose(means, expected[1], rtol=1e-5)
+            numpy.testing.assert_array_equal(minimums, expected[2])
+            numpy.testing.assert_array_equal(maximums, expected[3])
+
+    def test_iter_buckets(self):
+        """
+        Test that hourly buckets hold their readings' summary and respect the stride.
+        """
+        chunks = list(self.rollups.iter_buckets(1, "1h", START + 1, START + 8 * 3600 - 1, stride=2, chunk_size=3))
+        self.assertEqual(len(chunks), 2)
+        starts = numpy.concatenate([chunk[0] for chunk in chunks])
+        self.assertEqual((starts - START).tolist(), [hour * 3600 for hour in (1, 3, 5, 7)])
+        counts, means, minimums, maximums = (numpy.concatenate([chunk[index] for chunk in chunks]) for index in range(1, 5))
+        expected = brute_force(self.store, 1, START + 3 * 3600, START + 4 * 3600 - 1)
+        numpy.testing.assert_array_equal(counts[1], expected[0])
+        numpy.testing.assert_allclose(means[1], expected[1], rtol=1e-5)
+        numpy.testing.assert_array_equal(maximums[1], expected[3])
+        self.assertEqual(list(self.rollups.iter_buckets(2, "1d", START, START + 86400)), [])
+
+    def test_rollups_built_on_first_read(self):
+        """
+        Test that loading leaves the rollups unbuilt until statistics are
+        asked for, and that a reload summarises the new readings.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, "pollution_data.npz")
+            columnar_format.write_store(self.store, file_name)
+            data = PollutionData(mode="lazy", cache_dir="", data_file=file_name)
+            self.assertTrue(data.load())
+            self.assertIsNone(data.rollups)
+
+            start = datetime.fromtimestamp(START + 600, timezone.utc)
+            end = datetime.fromtimestamp(START + 86400, timezone.utc)
+            counts, _, _, _ = data.get_statistics(start, end, "SITE002")
+            expected = brute_force(self.store, 1, start.timestamp(), end.timestamp())
+            numpy.testing.assert_array_equal(counts, expected[0])
+            rollups = data.rollups
+            self.assertEqual(rollups.levels["1m"].cumulative_counts.dtype, numpy.int64)
+            data.get_statistics(start, end, "SITE001")
+            self.assertIs(data.rollups, rollups)
+
+            self.assertTrue(data.load())
+            self.assertIsNone(data.rollups)
+            list(data.get_pollution_data_rollup(start, end, "SITE001", "1h"))
+            self.assertIs(data.rollups.store, data.data.raw)
+
+    def test_procedural_statistics_on_demand(self):
+        """
+        Test that procedural data is summarised from its grid readings, within a window limit.
+        """
+        data = PollutionData(mode="procedural")
+        self.assertTrue(data.load())
+        start = datetime(2030, 3, 1, 8, 0, tzinfo=timezone.utc)
+        end = datetime(2030, 3, 1, 9, 0, tzinfo=timezone.utc)
+        counts, means, _, _ = data.get_statistics(start, end, "SITE001")
+        self.assertEqual(counts.tolist(), [361] * len(data.data.measurements))
+        position = data.data.site_position("SITE001")
+        _, values = next(data.data.iter_range(position, start.timestamp(), end.timestamp(), chunk_size=1000))
+        numpy.testing.assert_allclose(means, values.astype(numpy.float64).mean(axis=0), rtol=1e-5)
+        with self.assertRaises(ValueError):
+            data.get_statistics(start, datetime(2030, 6, 1, tzinfo=timezone.utc), "SITE001")
+
+
+if __name__ == "__main__":
+    unittest.main()
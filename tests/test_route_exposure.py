@@ -0,0 +1,94 @@
+"""
+Unit tests for scoring routes by the pollution along them.
+"""
+import types
+import unittest
+from datetime import datetime, timezone
+
+import numpy
+
+from src.pollution_store import PollutionStore
+from src.route_exposure import score_route, segment_distances
+from src.spatial_index import SpatialIndex
+
+
+class TestRouteExposure(unittest.TestCase):
+    """
+    Test suite for route_exposure using two sites beside a straight route.
+    """
+
+    def setUp(self):
+        """
+        Build a fake PollutionData with two sites and constant readings.
+        """
+        start = datetime(2025, 5, 19, 8, 0, 0, tzinfo=timezone.utc)
+        self.epoch = start.timestamp()
+        sites = []
+        for code, co in (("SITE001", 1.0), ("SITE002", 3.0)):
+            sites.append({"systemCodeNumber": code, "dynamics": [
+                {"co": co, "no": 10.0, "no2": 20.0, "lastUpdated": start},
+                {"co": co, "no": 10.0, "no2": 20.0, "lastUpdated": start.replace(hour=9)},
+            ]})
+        # SITE002 does not measure no2
+        for dynamic in sites[1]["dynamics"]:
+            del dynamic["no2"]
+        self.pollution_data = types.SimpleNamespace(
+            data=PollutionStore.from_sites(sites).interpolate(10),
+            spatial_index=SpatialIndex(["SITE001", "SITE002"], [54.9701, 54.9801], [-1.6, -1.6])
+        )
+
+    def test_segment_distances(self):
+        """
+        Test distances to a segment from points beside and beyond its ends.
+        """
+        distances = segment_distances(
+            numpy.array([0.0]), numpy.array([0.0]), numpy.array([10.0]), numpy.array([0.0]),
+            numpy.array([5.0, 13.0]), numpy.array([2.0, 4.0])
+        )
+        self.assertTrue(numpy.allclose(distances, [[2.0, 5.0]]))
+
+    def test_score_route(self):
+        """
+        Test that each segment only counts the sites within the corridor.
+        """
+        score = score_route(
+            self.pollution_data,
+            [54.97, 54.975, 54.98], [-1.6, -1.6, -1.6],
+            [self.epoch, self.epoch + 60, self.epoch + 180],
+            corridor_m=50
+        )
+        self.assertEqual([segment["sites"] for segment in score["segments"]], [1, 1])
+        self.assertAlmostEqual(score["segments"][0]["concentration"][0], 1.0)
+        self.assertAlmostEqual(score["segments"][1]["exposure"][0], 3.0 * 120)
+        self.assertAlmostEqual(score["total_exposure"][0], 60 + 360)
+        self.assertEqual(score["coverage"][0], 1.0)
+
+    def test_coverage_per_measurement(self):
+        """
+        Test that coverage and mean concentration are worked out for each measurement.
+        """
+        score = score_route(
+            self.pollution_data,
+            [54.97, 54.975, 54.98], [-1.6, -1.6, -1.6],
+            [self.epoch, self.epoch + 60, self.epoch + 180],
+            corridor_m=50, measurements=("co", "no2")
+        )
+        self.assertEqual(score["coverage"], [1.0, 60 / 180])
+        self.assertAlmostEqual(score["mean_concentration"][0], 420 / 180)
+        self.assertAlmostEqual(score["mean_concentration"][1], 20.0)
+        self.assertIsNone(score["segments"][1]["concentration"][1])
+
+    def test_route_outside_corridor(self):
+        """
+        Test that a route far from every site has no exposure.
+        """
+        score = score_route(
+            self.pollution_data, [55.5, 55.6], [-1.0, -1.0], [self.epoch, self.epoch + 60], corridor_m=50
+        )
+        self.assertIsNone(score["segments"][0]["concentration"])
+        self.assertIsNone(score["mean_concentration"])
+        self.assertEqual(score["total_exposure"], [0.0, 0.0, 0.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
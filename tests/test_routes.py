@@ -7,10 +7,13 @@ import os
 # Add src/ to sys.path so we can import routes.py as a top-level module
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
 
-from routes import pollution_bp 
+from routes import pollution_bp, pollution_data
+from src.response_cache import response_cache
 import unittest
 from unittest.mock import patch
 from flask import Flask
+import json
+import numpy
 
 
 class TestPollutionRoutes(unittest.TestCase):
@@ -25,6 +28,7 @@ class TestPollutionRoutes(unittest.TestCase):
         app = Flask(__name__)
         app.register_blueprint(pollution_bp)
         self.client = app.test_client()
+        response_cache.clear()
 
     @patch("routes.simulate_live_data")
     def test_subscribe_success(self, mock_simulate):
@@ -39,6 +43,67 @@ class TestPollutionRoutes(unittest.TestCase):
         self.assertEqual(response.status_code, 201)
         self.assertIn("SubscriptinID", response.get_json())
 
+    @patch("routes.simulate_live_data")
+    def test_subscribe_deduplicates_url(self, mock_simulate):
+        """
+        Test that subscribing the same URL twice keeps one subscription and ID.
+        """
+        payload = {"notificationUrl": "http://example.com/dedup", "subscriptions": ["AIR QUALITY DYNAMIC"]}
+        first = self.client.post("/pollutiondata/subscribe", json=payload)
+        second = self.client.post("/pollutiondata/subscribe", json=payload)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(first.get_json()["SubscriptinID"], second.get_json()["SubscriptinID"])
+
+    @patch("routes.revive_subscriber")
+    @patch("routes.simulate_live_data")
+    def test_resubscribe_revives_delivery(self, mock_simulate, mock_revive):
+        """
+        Test that subscribing again or updating a subscription revives its
+        delivery, and that outbox states are reported.
+        """
+        payload = {"notificationUrl": "http://example.com/revive", "subscriptions": ["AIR QUALITY DYNAMIC"]}
+        subscription_id = self.client.post("/pollutiondata/subscribe", json=payload).get_json()["SubscriptinID"]
+        self.client.post("/pollutiondata/subscribe", json=payload)
+        self.client.put(f"/pollutiondata/subscribe/{subscription_id}", json={"subscriptions": ["OTHER"]})
+        self.assertEqual([call.args[0] for call in mock_revive.call_args_list], [subscription_id] * 3)
+
+        with patch("routes.delivery_stats", return_value=[{"subscriptionId": subscription_id, "state": "dead"}]):
+            response = self.client.get("/pollutiondata/delivery")
+        self.assertEqual(response.get_json()[0]["state"], "dead")
+        self.client.delete(f"/pollutiondata/subscribe/{subscription_id}")
+
+    @patch("routes.simulate_live_data")
+    def test_update_and_unsubscribe(self, mock_simulate):
+        """
+        Test updating a subscription's datasets and then unsubscribing it.
+        """
+        payload = {"notificationUrl": "http://example.com/update", "subscriptions": ["AIR QUALITY DYNAMIC"]}
+        subscription_id = self.client.post("/pollutiondata/subscribe", json=payload).get_json()["SubscriptinID"]
+
+        response = self.client.put(f"/pollutiondata/subscribe/{subscription_id}", json={"subscriptions": ["OTHER"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["subscriptions"], ["OTHER"])
+
+        self.assertEqual(self.client.delete(f"/pollutiondata/subscribe/{subscription_id}").status_code, 204)
+        self.assertEqual(self.client.delete(f"/pollutiondata/subscribe/{subscription_id}").status_code, 404)
+
+    @patch("routes.simulate_live_data")
+    def test_subscribe_delivery_options(self, mock_simulate):
+        """
+        Test that delta and compression options are stored and validated.
+        """
+        payload = {"notificationUrl": "http://example.com/delta", "subscriptions": ["AIR QUALITY DYNAMIC"],
+                   "delta": True, "epsilon": 0.05, "keyframeInterval": 5, "acceptEncoding": "zstd, gzip"}
+        subscription_id = self.client.post("/pollutiondata/subscribe", json=payload).get_json()["SubscriptinID"]
+        response = self.client.put(f"/pollutiondata/subscribe/{subscription_id}", json={"epsilon": 0.1, "delta": True})
+        self.assertEqual(response.get_json()["options"], {"delta": True, "epsilon": 0.1})
+
+        payload["epsilon"] = -1
+        self.assertEqual(self.client.post("/pollutiondata/subscribe", json=payload).status_code, 400)
+        payload["epsilon"] = "lots"
+        self.assertEqual(self.client.post("/pollutiondata/subscribe", json=payload).status_code, 400)
+        self.client.delete(f"/pollutiondata/subscribe/{subscription_id}")
+
     def test_subscribe_missing_fields(self):
         """
         Test subscription request with missing fields.
@@ -46,6 +111,25 @@ class TestPollutionRoutes(unittest.TestCase):
         response = self.client.post("/pollutiondata/subscribe", json={})
         self.assertEqual(response.status_code, 400)
 
+    @patch("routes.simulate_live_data")
+    def test_subscribe_rejects_non_list_datasets(self, mock_simulate):
+        """
+        Test that subscriptions given as a string or a list of non-strings are rejected.
+        """
+        for datasets in ("AIR QUALITY DYNAMIC", [1, 2], [None]):
+            payload = {"notificationUrl": "http://example.com/types", "subscriptions": datasets}
+            self.assertEqual(self.client.post("/pollutiondata/subscribe", json=payload).status_code, 400)
+        mock_simulate.assert_not_called()
+
+        payload = {"notificationUrl": "http://example.com/types", "subscriptions": ["AIR QUALITY DYNAMIC"]}
+        subscription_id = self.client.post("/pollutiondata/subscribe", json=payload).get_json()["SubscriptinID"]
+        for datasets in ("OTHER", [1], []):
+            response = self.client.put(f"/pollutiondata/subscribe/{subscription_id}", json={"subscriptions": datasets})
+            self.assertEqual(response.status_code, 400)
+        response = self.client.put(f"/pollutiondata/subscribe/{subscription_id}", json={"delta": True})
+        self.assertEqual(response.get_json()["subscriptions"], ["AIR QUALITY DYNAMIC"])
+        self.client.delete(f"/pollutiondata/subscribe/{subscription_id}")
+
     def test_get_simtime(self):
         """
         Test retrieval of current simulation time.
@@ -93,6 +177,299 @@ class TestPollutionRoutes(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.get_json()), 1)
 
+    @patch("routes.pollution_data.get_all_sites_coordinates")
+    def test_get_all_coordinates_conditional(self, mock_all_coords):
+        """
+        Test that site metadata is encoded once per data version and revalidated with 304s.
+        """
+        mock_all_coords.return_value = [{"systemCodeNumber": "SITE001", "lat": 59.91, "lon": 10.75}]
+        first = self.client.get("/pollutiondata/sitemetadata")
+        etag = first.headers["ETag"]
+        self.assertIn("max-age", first.headers["Cache-Control"])
+
+        second = self.client.get("/pollutiondata/sitemetadata")
+        self.assertEqual((second.get_data(), second.headers["ETag"]), (first.get_data(), etag))
+        not_modified = self.client.get("/pollutiondata/sitemetadata", headers={"If-None-Match": etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.get_data(), b"")
+        self.assertEqual(mock_all_coords.call_count, 1)
+
+        # A reload bumps the version and drops the cached body
+        with patch.object(pollution_data, "version", pollution_data.version + 1):
+            self.assertEqual(self.client.get("/pollutiondata/sitemetadata", headers={"If-None-Match": etag}).status_code, 304)
+        self.assertEqual(mock_all_coords.call_count, 2)
+
+    @patch("routes.pollution_data.get_reading_time")
+    @patch("routes.pollution_data.get_pollution_data")
+    @patch("routes.pollution_data.get_site_coordinates")
+    def test_requested_pollution_data_cached_by_reading(self, mock_coords, mock_data, mock_time):
+        """
+        Test that timestamps resolving to the same reading share one cached response.
+        """
+        mock_coords.return_value = {"lat": 59.91, "lon": 10.75}
+        mock_data.return_value = [{"co": 0.4, "lastUpdated": "2025-05-19T00:00:00.000+0000"}]
+        mock_time.return_value = 1747612800
+
+        first = self.client.get("/pollutiondata/?timestamp=2025-05-19T00:00:01.000+0000&site=SITE001")
+        second = self.client.get("/pollutiondata/?timestamp=2025-05-19T00:00:04.000+0000&site=SITE001",
+                                 headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(mock_data.call_count, 1)
+
+        mock_time.return_value = None
+        mock_coords.return_value = None
+        missing = self.client.get("/pollutiondata/?timestamp=2025-05-19T00:00:04.000+0000&site=SITE999")
+        self.assertEqual(missing.status_code, 404)
+        self.assertNotIn("ETag", missing.headers)
+
+
+    @patch("routes.pollution_data.get_pollution_data_many")
+    @patch("routes.pollution_data.get_site_coordinates")
+    def test_batch_cross_product(self, mock_coords, mock_many):
+        """
+        Test that a batch request resolves every site and timestamp pair.
+        """
+        mock_coords.return_value = {"lat": 59.91, "lon": 10.75}
+        mock_many.return_value = (
+            numpy.array([1747612800, 0]),
+            numpy.array([[0.4] * 7, [numpy.nan] * 7], dtype=numpy.float32),
+            numpy.array([True, False])
+        )
+        payload = {"sites": ["SITE001", "SITE999"], "timestamps": ["2025-05-19T00:00:00.000+0000"]}
+        response = self.client.post("/pollutiondata/batch", json=payload)
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(len(body["results"]), 2)
+        self.assertEqual(body["results"][0]["values"][0], 0.4)
+        self.assertIsNone(body["results"][1]["values"])
+        self.assertIn("SITE001", body["coordinates"])
+
+    def test_batch_missing_fields(self):
+        """
+        Test that a batch request without sites or timestamps is rejected.
+        """
+        response = self.client.post("/pollutiondata/batch", json={"sites": ["SITE001"]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_rejects_wrong_types(self):
+        """
+        Test that sites given as a string and queries given as a number are rejected.
+        """
+        for payload in ({"sites": "ABC", "timestamps": ["2025-05-19T00:00:00.000+0000"]},
+                        {"sites": ["SITE001"], "timestamps": "2025-05-19T00:00:00.000+0000"},
+                        {"queries": 5},
+                        {"queries": [{"site": 1, "timestamp": "2025-05-19T00:00:00.000+0000"}]},
+                        ["SITE001"]):
+            response = self.client.post("/pollutiondata/batch", json=payload)
+            self.assertEqual(response.status_code, 400, payload)
+
+    def test_batch_invalid_timestamp(self):
+        """
+        Test that a batch request with a malformed timestamp is rejected.
+        """
+        payload = {"queries": [{"site": "SITE001", "timestamp": "invalid"}]}
+        response = self.client.post("/pollutiondata/batch", json=payload)
+        self.assertEqual(response.status_code, 400)
+
+
+    @patch("routes.pollution_data.get_pollution_data_range")
+    def test_range_ndjson(self, mock_range):
+        """
+        Test that a range request streams one JSON reading per line.
+        """
+        mock_range.return_value = iter([
+            (numpy.array([1747612800, 1747612810]), numpy.array([[0.4] * 7, [0.5] * 7], dtype=numpy.float32))
+        ])
+        response = self.client.get(
+            "/pollutiondata/range?site=SITE001&start=2025-05-19T00:00:00.000+0000&end=2025-05-19T00:01:00.000+0000"
+        )
+        self.assertEqual(response.status_code, 200)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[1])["co"], 0.5)
+
+    @patch("routes.pollution_data.get_pollution_data_range")
+    def test_range_json_array(self, mock_range):
+        """
+        Test that format=json streams a valid JSON array.
+        """
+        mock_range.return_value = iter([])
+        response = self.client.get(
+            "/pollutiondata/range?site=SITE001&start=2025-05-19T00:00:00.000+0000&end=2025-05-19T00:01:00.000+0000&format=json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), [])
+
+    @patch("routes.pollution_data.get_pollution_data_rollup")
+    def test_range_resolution(self, mock_rollup):
+        """
+        Test that resolution streams bucket means with their min and max,
+        and that an unknown resolution is rejected.
+        """
+        means = numpy.array([[0.4] * 6 + [numpy.nan]], dtype=numpy.float32)
+        counts = numpy.array([[360] * 6 + [0]])
+        mock_rollup.return_value = iter([(numpy.array([1747612800]), counts, means, means - 0.25, means + 0.25)])
+        response = self.client.get(
+            "/pollutiondata/range?site=SITE001&start=2025-05-19T00:00:00.000+0000&end=2025-05-19T00:59:59.000+0000&resolution=1h"
+        )
+        bucket = json.loads(response.get_data(as_text=True).splitlines()[0])
+        self.assertEqual(mock_rollup.call_args[0][3], "1h")
+        self.assertEqual((bucket["co"], bucket["min"]["co"], bucket["max"]["co"]), (0.4, 0.15, 0.65))
+        self.assertNotIn("battery", bucket)
+        self.assertEqual(bucket["lastUpdated"], "2025-05-19T00:00:00+00:00")
+
+        response = self.client.get(
+            "/pollutiondata/range?site=SITE001&start=2025-05-19T00:00:00.000+0000&end=2025-05-19T00:01:00.000+0000&resolution=5m"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @patch("routes.pollution_data.get_statistics")
+    def test_statistics(self, mock_statistics):
+        """
+        Test the statistics of the requested measurements and parameter validation.
+        """
+        mock_statistics.return_value = (
+            numpy.array([8640] * 6 + [0]),
+            numpy.array([50.5] * 6 + [numpy.nan], dtype=numpy.float32),
+            numpy.array([5.1] * 6 + [numpy.nan], dtype=numpy.float32),
+            numpy.array([298.3] * 6 + [numpy.nan], dtype=numpy.float32)
+        )
+        url = "/pollutiondata/stats?site=SITE001&start=2025-05-19T00:00:00.000+0000&end=2025-05-19T23:59:59.000+0000"
+        response = self.client.get(url + "&measurements=no2,battery")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["statistics"], {
+            "no2": {"count": 8640, "mean": 50.5, "min": 5.1, "max": 298.3},
+            "battery": {"count": 0, "mean": None, "min": None, "max": None}
+        })
+
+        self.assertEqual(self.client.get(url + "&measurements=ozone").status_code, 400)
+        self.assertEqual(self.client.get("/pollutiondata/stats?site=SITE001").status_code, 400)
+        mock_statistics.return_value = None
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_range_invalid_stride(self):
+        """
+        Test that a non positive stride is rejected.
+        """
+        response = self.client.get(
+            "/pollutiondata/range?site=SITE001&start=2025-05-19T00:00:00.000+0000&end=2025-05-19T00:01:00.000+0000&stride=0"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+    @patch("routes.pollution_data.get_sites_in_bbox")
+    def test_sites_in_bbox(self, mock_bbox):
+        """
+        Test that a bounding box query returns the matching sites.
+        """
+        mock_bbox.return_value = [{"systemCodeNumber": "SITE001", "lat": 54.95, "lon": -1.6}]
+        response = self.client.get("/pollutiondata/sites/bbox?south=54.9&west=-1.7&north=55&east=-1.5")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()[0]["systemCodeNumber"], "SITE001")
+        mock_bbox.assert_called_once_with(54.9, -1.7, 55.0, -1.5)
+
+    def test_sites_in_bbox_missing_fields(self):
+        """
+        Test that a bounding box query without all four edges is rejected.
+        """
+        response = self.client.get("/pollutiondata/sites/bbox?south=54.9&west=-1.7")
+        self.assertEqual(response.status_code, 400)
+
+    @patch("routes.pollution_data.get_pollution_data_many")
+    @patch("routes.pollution_data.get_nearest_sites")
+    def test_nearest_sites_with_readings(self, mock_nearest, mock_many):
+        """
+        Test that nearest sites are joined with their readings at a timestamp.
+        """
+        mock_nearest.return_value = [{"systemCodeNumber": "SITE001", "lat": 54.95, "lon": -1.6, "distance": 12.5}]
+        mock_many.return_value = (
+            numpy.array([1747612800]), numpy.array([[0.4] * 7], dtype=numpy.float32), numpy.array([True])
+        )
+        response = self.client.get(
+            "/pollutiondata/sites/nearest?lat=54.95&lon=-1.6&k=1&timestamp=2025-05-19T00:00:00.000+0000"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()[0]["pollution_data"]["co"], 0.4)
+
+    def test_nearest_sites_invalid_k(self):
+        """
+        Test that an out of range k is rejected.
+        """
+        response = self.client.get("/pollutiondata/sites/nearest?lat=54.95&lon=-1.6&k=0")
+        self.assertEqual(response.status_code, 400)
+
+    @patch("routes.pollution_data.get_nearest_sites")
+    @patch("routes.pollution_data.get_sites_in_bbox")
+    def test_site_queries_reject_non_finite_coordinates(self, mock_bbox, mock_nearest):
+        """
+        Test that infinite, NaN and out of range coordinates are rejected before reaching the index.
+        """
+        for query in ("south=-inf&west=-1.7&north=55&east=-1.5", "south=54.9&west=-1.7&north=nan&east=-1.5",
+                      "south=-91&west=-1.7&north=55&east=-1.5", "south=54.9&west=-1.7&north=55&east=181"):
+            response = self.client.get(f"/pollutiondata/sites/bbox?{query}")
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn("timestamp", response.get_json())
+        for query in ("lat=inf&lon=-1.6", "lat=nan&lon=-1.6", "lat=54.95&lon=-inf", "lat=90.5&lon=0"):
+            response = self.client.get(f"/pollutiondata/sites/nearest?{query}")
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn("timestamp", response.get_json())
+        mock_bbox.assert_not_called()
+        mock_nearest.assert_not_called()
+
+    @patch("routes.pollution_data.get_nearest_sites")
+    def test_nearest_sites_invalid_timestamp(self, mock_nearest):
+        """
+        Test that only a malformed timestamp is reported as one.
+        """
+        response = self.client.get("/pollutiondata/sites/nearest?lat=54.95&lon=-1.6&timestamp=yesterday")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("timestamp", response.get_json())
+        mock_nearest.side_effect = ValueError("index failure")
+        response = self.client.get("/pollutiondata/sites/nearest?lat=54.95&lon=-1.6")
+        self.assertEqual(response.status_code, 500)
+
+
+    def test_exposure_invalid_route(self):
+        """
+        Test that an exposure request with a single point route is rejected.
+        """
+        payload = {"routes": [{"points": [{"lat": 54.97, "lon": -1.61, "timestamp": "2025-05-19T08:00:00.000+0000"}]}]}
+        response = self.client.post("/pollutiondata/exposure", json=payload)
+        self.assertEqual(response.status_code, 400)
+
+    @patch("routes.score_route")
+    def test_exposure_rejects_non_finite_numbers(self, mock_score):
+        """
+        Test that NaN or infinite corridors and point coordinates are rejected rather than failing.
+        """
+        def route(lat="54.97", lon="-1.61"):
+            return [{"points": [{"lat": lat, "lon": lon, "timestamp": "2025-05-19T08:00:00.000+0000"},
+                                {"lat": 54.98, "lon": -1.61, "timestamp": "2025-05-19T08:01:00.000+0000"}]}]
+
+        for corridor in ("nan", "inf", "-inf"):
+            response = self.client.post("/pollutiondata/exposure", json={"corridor": corridor, "routes": route()})
+            self.assertEqual(response.status_code, 400)
+        for lat, lon in (("nan", "-1.61"), ("inf", "-1.61"), ("54.97", "-inf"), ("91", "-1.61")):
+            response = self.client.post("/pollutiondata/exposure", json={"routes": route(lat, lon)})
+            self.assertEqual(response.status_code, 400)
+        mock_score.assert_not_called()
+
+    @patch("routes.score_route")
+    def test_exposure_measurements(self, mock_score):
+        """
+        Test that a single measurement name is taken as a list and other types are rejected.
+        """
+        mock_score.return_value = {}
+        points = [{"lat": 54.97, "lon": -1.61, "timestamp": "2025-05-19T08:00:00.000+0000"},
+                  {"lat": 54.98, "lon": -1.61, "timestamp": "2025-05-19T08:01:00.000+0000"}]
+        response = self.client.post("/pollutiondata/exposure", json={"measurements": "no2", "routes": [{"points": points}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["measurements"], ["no2"])
+        self.assertEqual(mock_score.call_args[0][5], ("no2",))
+
+        response = self.client.post("/pollutiondata/exposure", json={"measurements": 5, "routes": [{"points": points}]})
+        self.assertEqual(response.status_code, 400)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,54 @@
+"""
+Unit tests for the grid hash SpatialIndex.
+"""
+import unittest
+
+import numpy
+
+from src.spatial_index import SpatialIndex, haversine_m
+
+
+class TestSpatialIndex(unittest.TestCase):
+    """
+    Test suite comparing index queries with a brute force scan.
+    """
+
+    def setUp(self):
+        """
+        Build an index over random sites around Newcastle.
+        """
+        rng = numpy.random.default_rng(7)
+        self.lats = 54.9 + rng.random(2000) * 0.2
+        self.lons = -1.7 + rng.random(2000) * 0.3
+        self.index = SpatialIndex([f"SITE{i:04d}" for i in range(2000)], self.lats, self.lons)
+
+    def test_within_bbox(self):
+        """
+        Test that a bounding box query returns exactly the sites inside it.
+        """
+        result = self.index.within_bbox(54.95, -1.6, 55.0, -1.5)
+        expected = numpy.nonzero(
+            (self.lats >= 54.95) & (self.lats <= 55.0) & (self.lons >= -1.6) & (self.lons <= -1.5)
+        )[0].tolist()
+        self.assertEqual(result, expected)
+
+    def test_nearest_matches_brute_force(self):
+        """
+        Test that the k nearest sites match a brute force distance sort.
+        """
+        for lat, lon in ((54.97, -1.61), (54.5, -1.0), (55.2, -2.0)):
+            result = self.index.nearest(lat, lon, 5)
+            expected = numpy.sort(haversine_m(lat, lon, self.lats, self.lons))[:5]
+            self.assertTrue(numpy.allclose([distance for _, distance in result], expected))
+
+    def test_empty_index(self):
+        """
+        Test that an empty index returns no sites.
+        """
+        empty = SpatialIndex([], [], [])
+        self.assertEqual(empty.nearest(54.9, -1.6, 3), [])
+        self.assertEqual(empty.within_bbox(54, -2, 56, -1), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
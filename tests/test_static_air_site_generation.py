@@ -0,0 +1,82 @@
+"""
+Unit tests for the site metadata builder.
+"""
+import json
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+from pyproj import Transformer
+
+from src.static_air_site_generation import build_metadata
+
+
+ROWS = [
+    {"SYSTEMCODENUMBER": "1002", "LONGDESCRIPTION": "Dryden Road", "NORTHING": 561678, "EASTING": 425766,
+     "LASTUPDATED": "2022-08-17 11:18:01.606"},
+    {"SYSTEMCODENUMBER": "1001", "LONGDESCRIPTION": "Durham Road", "NORTHING": 561593, "EASTING": 425763,
+     "LASTUPDATED": "2022-08-17 11:18:01.606"},
+    {"SYSTEMCODENUMBER": "1003", "LONGDESCRIPTION": None, "NORTHING": None, "EASTING": 425000,
+     "LASTUPDATED": None},
+    {"SYSTEMCODENUMBER": "1004", "LONGDESCRIPTION": "Quayside", "NORTHING": 563900, "EASTING": 425500,
+     "LASTUPDATED": None}
+]
+
+
+class TestStaticAirSiteGeneration(unittest.TestCase):
+    """
+    Test suite for batched and incremental metadata builds.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.csv_file = os.path.join(self.directory.name, "sites.csv")
+        self.output = os.path.join(self.directory.name, "metadata.json")
+        pd.DataFrame(ROWS).to_csv(self.csv_file, index=False)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_output(self):
+        with open(self.output, "r") as file:
+            return json.load(file)
+
+    def test_build_matches_row_by_row_transform(self):
+        """
+        Test the sites, numbering and points against a transform of each row.
+        """
+        self.assertEqual(build_metadata(self.csv_file, self.output), {"sites": 3, "reprojected": 3})
+        sites = self.read_output()
+        self.assertEqual([site["systemCodeNumber"] for site in sites], ["SITE001", "SITE002", "SITE003"])
+
+        transformer = Transformer.from_crs("epsg:27700", "epsg:4326", always_xy=True)
+        for site, row in zip(sites, [ROWS[1], ROWS[0], ROWS[3]]):
+            definition = site["definitions"][0]
+            lon, lat = transformer.transform(row["EASTING"], row["NORTHING"])
+            self.assertEqual(definition["longDescription"], row["LONGDESCRIPTION"])
+            self.assertEqual(definition["point"], {"easting": row["EASTING"], "northing": row["NORTHING"],
+                                                   "latitude": round(lat, 6), "longitude": round(lon, 6)})
+        self.assertEqual(sites[0]["definitions"][0]["lastUpdated"], "2022-08-17T10:18:01.606+0000")
+        self.assertEqual(sites[2]["definitions"][0]["lastUpdated"], "2025-06-26T19:47:00.000+0000")
+
+    def test_incremental_build_reprojects_changed_rows(self):
+        """
+        Test that a rebuild only reprojects rows whose LASTUPDATED or coordinates changed.
+        """
+        build_metadata(self.csv_file, self.output)
+        self.assertEqual(build_metadata(self.csv_file, self.output), {"sites": 3, "reprojected": 0})
+
+        rows = [dict(row) for row in ROWS]
+        rows[0].update({"EASTING": 426000, "LASTUPDATED": "2024-01-01 00:00:00.000"})
+        pd.DataFrame(rows).to_csv(self.csv_file, index=False)
+        self.assertEqual(build_metadata(self.csv_file, self.output), {"sites": 3, "reprojected": 1})
+        sites = self.read_output()
+        self.assertEqual(sites[1]["definitions"][0]["point"]["easting"], 426000)
+        self.assertEqual(sites[1]["definitions"][0]["lastUpdated"], "2024-01-01T00:00:00.000+0000")
+
+        self.assertEqual(build_metadata(self.csv_file, self.output, incremental=False)["reprojected"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
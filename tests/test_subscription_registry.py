@@ -0,0 +1,102 @@
+"""
+Unit tests for the SubscriptionRegistry.
+"""
+import os
+import tempfile
+import unittest
+
+from src.subscription_registry import SubscriptionRegistry
+
+
+class TestSubscriptionRegistry(unittest.TestCase):
+    """
+    Test suite for registering, indexing and persisting subscriptions.
+    """
+
+    def setUp(self):
+        """
+        Create a registry backed by a temporary file.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "subscriptions.json")
+        self.registry = SubscriptionRegistry(self.file_name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_add_deduplicates_by_url(self):
+        """
+        Test that subscribing a URL again replaces its datasets and keeps its ID.
+        """
+        first_id, created = self.registry.add("http://a", ["AIR QUALITY DYNAMIC"])
+        self.assertTrue(created)
+        second_id, created = self.registry.add("http://a", ["OTHER", "OTHER"])
+        self.assertFalse(created)
+        self.assertEqual(first_id, second_id)
+        self.assertEqual(len(self.registry), 1)
+        self.assertEqual(self.registry.get(first_id)["subscriptions"], ["OTHER"])
+        self.assertEqual(self.registry.for_dataset("AIR QUALITY DYNAMIC"), [])
+
+    def test_dataset_index(self):
+        """
+        Test that subscriptions are found by dataset type and dropped on removal.
+        """
+        first_id, _ = self.registry.add("http://a", ["AIR QUALITY DYNAMIC"])
+        second_id, _ = self.registry.add("http://b", ["AIR QUALITY DYNAMIC", "OTHER"])
+        self.assertEqual(
+            sorted(sub["subscriptionId"] for sub in self.registry.for_dataset("AIR QUALITY DYNAMIC")),
+            sorted([first_id, second_id])
+        )
+        self.assertTrue(self.registry.remove(second_id))
+        self.assertFalse(self.registry.remove(second_id))
+        self.assertEqual(self.registry.for_dataset("OTHER"), [])
+
+    def test_update_rejects_taken_url(self):
+        """
+        Test that a subscription cannot move to a URL another one uses.
+        """
+        self.registry.add("http://a", ["AIR QUALITY DYNAMIC"])
+        second_id, _ = self.registry.add("http://b", ["AIR QUALITY DYNAMIC"])
+        with self.assertRaises(ValueError):
+            self.registry.update(second_id, notification_url="http://a")
+        self.assertIsNone(self.registry.update("unknown", datasets=["OTHER"]))
+
+    def test_rejects_string_datasets(self):
+        """
+        Test that datasets given as a single string are refused rather than split into characters.
+        """
+        with self.assertRaises(TypeError):
+            self.registry.add("http://a", "AIR QUALITY DYNAMIC")
+        subscription_id, _ = self.registry.add("http://a", ["AIR QUALITY DYNAMIC"])
+        with self.assertRaises(TypeError):
+            self.registry.update(subscription_id, datasets="OTHER")
+        self.assertEqual(len(self.registry.for_dataset("AIR QUALITY DYNAMIC")), 1)
+
+    def test_persistence(self):
+        """
+        Test that subscriptions survive reloading from the registry file.
+        """
+        subscription_id, _ = self.registry.add("http://a", ["AIR QUALITY DYNAMIC"])
+        reloaded = SubscriptionRegistry(self.file_name)
+        self.assertEqual(reloaded.get(subscription_id)["notificationUrl"], "http://a")
+        self.assertEqual(len(reloaded.for_dataset("AIR QUALITY DYNAMIC")), 1)
+
+    def test_registries_sharing_a_file(self):
+        """
+        Test that registries in different processes sharing a file see
+        each other's changes and do not overwrite them.
+        """
+        other = SubscriptionRegistry(self.file_name)
+        first_id, _ = self.registry.add("http://a", ["AIR QUALITY DYNAMIC"])
+        second_id, _ = other.add("http://b", ["AIR QUALITY DYNAMIC"])
+
+        self.assertEqual({sub["subscriptionId"] for sub in self.registry.for_dataset("AIR QUALITY DYNAMIC")},
+                         {first_id, second_id})
+        self.assertEqual(other.add("http://a", ["OTHER"]), (first_id, False))
+        self.assertEqual(self.registry.get(first_id)["subscriptions"], ["OTHER"])
+        self.assertTrue(self.registry.remove(second_id))
+        self.assertIsNone(other.get(second_id))
+
+
+if __name__ == "__main__":
+    unittest.main()
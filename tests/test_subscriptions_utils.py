@@ -0,0 +1,257 @@
+"""
+Unit tests for pushing notifications to subscribers against a local stub webhook server.
+"""
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy
+
+import src.subscriptions_utils as subscriptions_utils
+from src.delivery_state import SharedDeliveryState
+
+
+class StubWebhook(BaseHTTPRequestHandler):
+    """
+    Records each POST body, decompressing gzip bodies; the /slow path waits
+    before answering, /fail returns 500 and so do the next failures_left
+    posts to any path.
+    """
+    received = []
+    encodings = []
+    failures_left = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        path = self.path.split("?")[0]
+        StubWebhook.encodings.append(self.headers.get("Content-Encoding"))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        StubWebhook.received.append((path, json.loads(body)))
+        if path == "/slow":
+            time.sleep(0.5)
+        failing = path == "/fail" or StubWebhook.failures_left > 0
+        StubWebhook.failures_left = max(StubWebhook.failures_left - 1, 0)
+        self.send_response(500 if failing else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestNotifySubscribers(unittest.TestCase):
+    """
+    Test suite for the concurrent subscriber fan out.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Start the stub webhook server on a free local port.
+        """
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubWebhook)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubWebhook.received.clear()
+        StubWebhook.encodings.clear()
+        subscriptions_utils.subscriptions.clear()
+
+    def tearDown(self):
+        subscriptions_utils.subscriptions.clear()
+
+    def subscribe(self, path: str, datasets: list, options: dict = None) -> str:
+        """
+        Helper to register a subscriber on the stub server.
+        """
+        subscription_id, _ = subscriptions_utils.subscriptions.add(f"{self.base_url}{path}", datasets, options)
+        return subscription_id
+
+    def test_payload_delivered(self):
+        """
+        Test that each matching subscriber receives a UTMC payload.
+        """
+        subscription_id = self.subscribe("/ok", ["AIR QUALITY DYNAMIC"])
+        self.subscribe("/other", ["OTHER"])
+        data = [{"systemCodeNumber": "SITE001", "co": 0.4, "lastUpdated": "2025-05-19T00:00:00+00:00"}]
+        queued = subscriptions_utils.notify_subscribers("AIR QUALITY DYNAMIC", data)
+        self.assertEqual(queued, [subscription_id])
+        self.assertTrue(subscriptions_utils.delivery_queue.flush(timeout=5))
+
+        self.assertEqual(len(StubWebhook.received), 1)
+        path, payload = StubWebhook.received[0]
+        self.assertEqual(path, "/ok")
+        self.assertEqual(payload["subscriptionId"], subscription_id)
+        notification = payload["notifications"][0]
+        self.assertEqual(notification["notificationData"][0]["systemCodeNumber"], "SITE001")
+        self.assertEqual(notification["notificationData"][0]["dynamics"][0]["co"], 0.4)
+
+    def test_tick_summary_logged(self):
+        """
+        Test that one summary of a tick's pushes is logged once they complete.
+        """
+        self.subscribe("/ok", ["AIR QUALITY DYNAMIC"])
+        self.subscribe("/slow", ["AIR QUALITY DYNAMIC"])
+        with self.assertLogs(level="INFO") as logs:
+            subscriptions_utils.notify_subscribers("AIR QUALITY DYNAMIC", [])
+            self.assertTrue(subscriptions_utils.delivery_queue.flush(timeout=5))
+        summaries = [line for line in logs.output if "Pushed AIR QUALITY DYNAMIC" in line]
+        self.assertEqual(len(summaries), 1)
+        self.assertIn("to 2 subscribers, 0 failed, slowest 0.", summaries[0])
+
+        summary = subscriptions_utils.TickSummary()
+        summary.start("AIR QUALITY DYNAMIC", ["1", "2", "3"])
+        summary.record("1", {"ok": False, "latency": 0.25})
+        summary.record("9", {"ok": True, "latency": 9.0})
+        with self.assertLogs(level="INFO") as logs:
+            summary.record("2", {"ok": True, "latency": 0.5})
+            summary.start("AIR QUALITY DYNAMIC", ["1"])
+        self.assertIn("to 2 subscribers, 1 failed, slowest 0.500s, 1 still pending.", logs.output[0])
+
+    def test_tick_does_not_wait_on_slow_subscribers(self):
+        """
+        Test that queueing returns at once and slow pushes drain concurrently.
+        """
+        for number in range(4):
+            self.subscribe(f"/slow?n={number}", ["AIR QUALITY DYNAMIC"])
+        started = time.perf_counter()
+        subscriptions_utils.notify_subscribers("AIR QUALITY DYNAMIC", [])
+        self.assertLess(time.perf_counter() - started, 0.2)
+        self.assertTrue(subscriptions_utils.delivery_queue.flush(timeout=1.5))
+        self.assertEqual(len(StubWebhook.received), 4)
+
+    def test_notification_encoded_once(self):
+        """
+        Test that the notification is encoded once and spliced into each payload.
+        """
+        data = [{"systemCodeNumber": "SITE001", "co": numpy.float32(0.17), "lastUpdated": "2025-05-19T00:00:00+00:00"}]
+        notification = subscriptions_utils.build_notification("AIR QUALITY DYNAMIC", data)
+        payload = json.loads(subscriptions_utils.build_payload("7", b"[" + notification + b"]"))
+        self.assertEqual(payload["subscriptionId"], "7")
+        self.assertAlmostEqual(payload["notifications"][0]["notificationData"][0]["dynamics"][0]["co"], 0.17, places=6)
+
+        subscription_ids = [self.subscribe(f"/ok?n={number}", ["AIR QUALITY DYNAMIC"]) for number in range(3)]
+        with patch("src.subscriptions_utils.build_notification", wraps=subscriptions_utils.build_notification) as spy:
+            subscriptions_utils.notify_subscribers("AIR QUALITY DYNAMIC", data)
+        self.assertEqual(spy.call_count, 1)
+        self.assertTrue(subscriptions_utils.delivery_queue.flush(timeout=5))
+        self.assertEqual(sorted(payload["subscriptionId"] for _, payload in StubWebhook.received), sorted(subscription_ids))
+
+    def test_delta_subscriber_gets_changes_and_keyframes(self):
+        """
+        Test that a delta subscriber gets a keyframe, then only changed
+        fields, then a keyframe again, all gzip compressed.
+        """
+        options = {"delta": True, "epsilon": 0.05, "keyframeInterval": 3, "acceptEncoding": ["gzip"]}
+        self.subscribe("/ok?delta=1", ["AIR QUALITY DYNAMIC"], options)
+        self.subscribe("/ok?full=1", ["AIR QUALITY DYNAMIC"])
+        ticks = [
+            [{"systemCodeNumber": "SITE001", "co": 0.40, "no": 0.10, "lastUpdated": "t0"},
+             {"systemCodeNumber": "SITE002", "co": 0.20, "no": 0.30, "lastUpdated": "t0"}],
+            [{"systemCodeNumber": "SITE001", "co": 0.50, "no": 0.11, "lastUpdated": "t1"},
+             {"systemCodeNumber": "SITE002", "co": 0.21, "no": 0.30, "lastUpdated": "t1"}],
+            [{"systemCodeNumber": "SITE001", "co": 0.50, "no": 0.16, "lastUpdated": "t2"},
+             {"systemCodeNumber": "SITE002", "co": 0.22, "no": 0.30, "lastUpdated": "t2"}],
+            [{"systemCodeNumber": "SITE001", "co": 0.50, "no": 0.16, "lastUpdated": "t3"},
+             {"systemCodeNumber": "SITE002", "co": 0.22, "no": 0.30, "lastUpdated": "t3"}],
+        ]
+        for data in ticks:
+            subscriptions_utils.notify_subscribers("AIR QUALITY DYNAMIC", data)
+            self.assertTrue(subscriptions_utils.delivery_queue.flush(timeout=5))
+
+        delta_bodies = [payload for path, payload in StubWebhook.received if payload["notifications"] and
+                        subscriptions_utils.subscriptions.get(payload["subscriptionId"])["options"]]
+        notifications = [notification for payload in delta_bodies for notification in payload["notifications"]]
+        self.assertEqual([notification["action"] for notification in notifications], ["INSERT", "UPDATE", "UPDATE", "INSERT"])
+        self.assertEqual(notifications[0]["notificationData"][1]["dynamics"][0], {"co": 0.20, "no": 0.30, "lastUpdated": "t0"})
+        # Only SITE001's co moved by more than epsilon
+        self.assertEqual(notifications[1]["notificationData"],
+                         [{"systemCodeNumber": "SITE001", "dynamics": [{"co": 0.50, "lastUpdated": "t1"}]}])
+        # no drifted 0.06 from the value last sent, and SITE002 stays within epsilon
+        self.assertEqual(notifications[2]["notificationData"],
+                         [{"systemCodeNumber": "SITE001", "dynamics": [{"no": 0.16, "lastUpdated": "t2"}]}])
+        self.assertEqual(len(notifications[3]["notificationData"]), 2)
+        self.assertEqual(StubWebhook.encodings.count("gzip"), 4)
+        self.assertEqual(StubWebhook.encodings.count(None), 4)
+
+    def test_failed_push_forces_keyframe(self):
+        """
+        Test that a delta subscriber is sent a keyframe after a failed push,
+        and that its acknowledged values only include what was answered with a 2xx.
+        """
+        subscription_id = self.subscribe("/ok", ["AIR QUALITY DYNAMIC"], {"delta": True, "keyframeInterval": 100})
+        ticks = [[{"systemCodeNumber": "SITE001", "co": co, "lastUpdated": "t"}] for co in (0.4, 0.9, 0.9)]
+        with patch.object(subscriptions_utils.delivery_queue, "base_backoff", 0.05):
+            for number, data in enumerate(ticks):
+                StubWebhook.failures_left = 1 if number == 1 else 0
+                subscriptions_utils.notify_subscribers("AIR QUALITY DYNAMIC", data)
+                self.assertTrue(subscriptions_utils.delivery_queue.flush(timeout=5))
+
+        actions = [payload["notifications"][0]["action"] for _, payload in StubWebhook.received]
+        # The failed UPDATE is retried, then the next tick is a keyframe
+        self.assertEqual(actions, ["INSERT", "UPDATE", "UPDATE", "INSERT"])
+        state = next(state for (state_id, _), state in subscriptions_utils.delta_states.items()
+                     if state_id == subscription_id)
+        self.assertEqual(state.acknowledged, {"SITE001": {"co": 0.9}})
+        self.assertEqual(state.in_flight, [])
+
+    def test_dropped_notification_forces_keyframe(self):
+        """
+        Test that a delta subscriber that lost a notification is sent a keyframe next.
+        """
+        subscription_id = self.subscribe("/ok", ["AIR QUALITY DYNAMIC"], {"delta": True, "keyframeInterval": 100})
+        data = [{"systemCodeNumber": "SITE001", "co": 0.4, "lastUpdated": "t0"}]
+        subscriptions_utils.notify_subscribers("AIR QUALITY DYNAMIC", data)
+        self.assertTrue(subscriptions_utils.delivery_queue.flush(timeout=5))
+
+        subscriptions_utils.resync_subscriber(subscription_id)
+        subscriptions_utils.notify_subscribers("AIR QUALITY DYNAMIC", data)
+        self.assertTrue(subscriptions_utils.delivery_queue.flush(timeout=5))
+        actions = [payload["notifications"][0]["action"] for _, payload in StubWebhook.received]
+        self.assertEqual(actions, ["INSERT", "INSERT"])
+
+    def test_leader_applies_changes_from_other_workers(self):
+        """
+        Test that the leader revives subscribers another worker asked for,
+        drops the outboxes of subscriptions cancelled elsewhere, and
+        publishes its outbox statistics for other workers to report.
+        """
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.object(subscriptions_utils, "shared_delivery", SharedDeliveryState(directory)):
+            other_worker = SharedDeliveryState(directory)
+            subscription_id = self.subscribe("/ok", ["AIR QUALITY DYNAMIC"])
+            data = [{"systemCodeNumber": "SITE001", "co": 0.4, "lastUpdated": "t0"}]
+            subscriptions_utils.notify_subscribers("AIR QUALITY DYNAMIC", data)
+            self.assertTrue(subscriptions_utils.delivery_queue.flush(timeout=5))
+
+            other_worker.request_revival(subscription_id)
+            other_worker.request_revival(subscription_id)
+            with patch.object(subscriptions_utils.delivery_queue, "revive") as revive:
+                subscriptions_utils.sync_delivery()
+            self.assertEqual([call.args[0] for call in revive.call_args_list], [subscription_id])
+            self.assertEqual(other_worker.take_revivals(), [])
+            published = subscriptions_utils.delivery_stats(leader=False)
+            self.assertEqual([(outbox["subscriptionId"], outbox["delivered"]) for outbox in published],
+                             [(subscription_id, 1)])
+
+            # Cancelled through another worker, so only the registry changed
+            self.assertTrue(subscriptions_utils.subscriptions.remove(subscription_id))
+            subscriptions_utils.sync_delivery()
+            self.assertEqual(subscriptions_utils.delivery_stats(leader=True), [])
+            self.assertEqual(other_worker.read_stats(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()